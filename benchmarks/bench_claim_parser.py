@@ -0,0 +1,85 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from patent_claim import build_claim_tree
+from synthetic import WORDS, generate_claims as generate_claim_set
+
+
+# Generate n synthetic claims: every tenth claim is independent, the rest depend on one or more earlier claims
+def generate_claims(n, body_words=60, seed=0):
+    rng = random.Random(seed)
+    claims = []
+    for number in range(1, n + 1):
+        body = " ".join(rng.choice(WORDS) for _ in range(body_words))
+        if number % 10 == 1:
+            claims.append(f"{number}. An apparatus comprising:\n{body}.")
+        elif number % 10 == 5:
+            claims.append(f"{number}. The apparatus of any of claims {number - 4}-{number - 1}, wherein\n{body}.")
+        else:
+            claims.append(f"{number}. The apparatus of claim {number - 1} or claim {number - 2}, wherein {body}.")
+    return claims
+
+
+# Claim k depends on "any one of claims 1 to k-1", the worst case for rendering shared dependents
+def generate_chained_claims(n, body_words=60, seed=0):
+    rng = random.Random(seed)
+    claims = [f"1. An apparatus comprising:\n{' '.join(rng.choice(WORDS) for _ in range(body_words))}."]
+    for number in range(2, n + 1):
+        body = " ".join(rng.choice(WORDS) for _ in range(body_words))
+        claims.append(f"{number}. The apparatus according to any one of claims 1 to {number - 1}, wherein {body}.")
+    return claims
+
+
+# Time build_claim_tree and rendering the tree, returning the best of several runs of each in seconds,
+# and the number of lines rendered
+def time_build(claims, repeat=3):
+    best_build = best_render = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tree = build_claim_tree(claims)
+        built = time.perf_counter()
+        lines = tree.render().count("\n")
+        best_build = min(best_build, built - start)
+        best_render = min(best_render, time.perf_counter() - built)
+    return best_build, best_render, lines
+
+
+# Print the time per claim to parse and render as the number of claims, the length of each claim and the
+# number of claims each one depends on grow. Linear scaling shows up as a roughly constant time per claim
+# and per word, and one rendered line per claim.
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parsing and rendering patent claim trees")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size; the best time is reported")
+    args = parser.parse_args()
+
+    header = "parse (ms)   render (ms)   lines"
+    print(f"claims   words/claim   {header}   per claim (us)")
+    for n in (100, 1000, 10000):
+        build, render, lines = time_build(generate_claims(n), args.repeat)
+        print(f"{n:>6}   {60:>11}   {build * 1000:>10.1f}   {render * 1000:>11.1f}   {lines:>5}   "
+              f"{(build + render) / n * 1e6:>14.1f}")
+
+    print(f"\nclaims   words/claim   {header}   per word (ns)")
+    for words in (100, 1000, 10000):
+        build, render, lines = time_build(generate_claims(100, body_words=words), args.repeat)
+        print(f"{100:>6}   {words:>11}   {build * 1000:>10.1f}   {render * 1000:>11.1f}   {lines:>5}   "
+              f"{(build + render) / (100 * words) * 1e9:>13.1f}")
+
+    # Claim sets shaped like real ones (see synthetic.py), and chains where every claim depends on all
+    # earlier ones
+    for title, generate in (("realistic", lambda n: generate_claim_set(n, 60, random.Random(0))),
+                            ("chained", generate_chained_claims)):
+        print(f"\n{title + ' claims':<17}     {header}   per claim (us)")
+        for n in (10, 30, 100, 1000):
+            build, render, lines = time_build(generate(n), args.repeat)
+            print(f"{n:>6}                 {build * 1000:>10.1f}   {render * 1000:>11.1f}   {lines:>5}   "
+                  f"{(build + render) / n * 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generate_families, generate_status_records, google_patent_html, write_lens_responses
+
+# Saved timings that later runs are compared against
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Stages that can be timed, in pipeline order
+STAGES = ("family_extraction", "claim_trees", "html_render", "scrape_http")
+
+# Portfolio sizes, as multiples of the current portfolio (9 main patents, 156 family members)
+DEFAULT_SCALES = (1, 10, 100)
+
+# A stage is reported as a regression when it is this much slower than the baseline...
+DEFAULT_TOLERANCE = 0.25
+# ...and at least this many seconds slower, so tiny stages do not trip on noise
+NOISE_FLOOR = 0.05
+
+# Every n-th patent has no page on the stub server, exercising the "not found" path
+NOT_FOUND_EVERY = 50
+
+
+# Serves synthetic Google Patents pages at /patent/<number>/en
+class StubPatentHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        patent = parts[1] if len(parts) == 3 and parts[0] == "patent" else ""
+        if not patent or sum(map(ord, patent)) % NOT_FOUND_EVERY == 0:
+            self.send_response(404)
+            self.end_headers()
+            return
+        page = google_patent_html(patent).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, *args):
+        pass
+
+
+# Start the stub server on a free local port, returning the server and its URL pattern
+def start_stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubPatentHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/patent/{{}}/en"
+
+
+# Time a stage with its progress output silenced
+def timed(func, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        return time.perf_counter() - start
+
+
+def bench_family_extraction(workdir, families, records, workers):
+    from patent_family_retrieval_Lens import extract_patent_families
+    lens_dir = os.path.join(workdir, "data_Lens")
+    write_lens_responses(lens_dir, families)
+    return timed(extract_patent_families, lens_dir, os.path.join(workdir, "patent_family_data"), workers), \
+        len(families)
+
+
+def bench_claim_trees(workdir, families, records, workers):
+    from patent_claim import render_claim_trees
+    return timed(render_claim_trees, records, None, workers), len(records)
+
+
+def bench_html_render(workdir, families, records, workers):
+    from visualize_patents import write_html
+    return timed(write_html, records, os.path.join(workdir, "patents.html"),
+                 os.path.join(workdir, "claim_tree_cache.json"), workers,
+                 os.path.join(workdir, "html_fragment_cache.db")), len(records)
+
+
+def bench_scrape_http(workdir, families, records, workers):
+    server, url = start_stub_server()
+    os.environ["GOOGLE_PATENTS_URL"] = url
+    import google_patents_http
+    google_patents_http.PATENT_URL = url
+    from google_scraper import plan_scrape, scrape_items
+
+    family_set = {record["patent_number"]: record["related_patents"] for record in records}
+    _, items = plan_scrape(family_set)
+    results = {}
+    try:
+        elapsed = timed(scrape_items, items, results, None, workers or 16, backend="http")
+    finally:
+        server.shutdown()
+    if len(results) != len(items):
+        raise RuntimeError(f"Scraped {len(results)} of {len(items)} stub pages")
+    return elapsed, len(items)
+
+
+BENCHMARKS = {
+    "family_extraction": bench_family_extraction,
+    "claim_trees": bench_claim_trees,
+    "html_render": bench_html_render,
+    "scrape_http": bench_scrape_http,
+}
+
+
+# Run the selected stages at each scale on fresh synthetic data, returning {"stage@scale": result}
+def run_benchmarks(stages, scales, workers=None):
+    results = {}
+    for scale in scales:
+        families = generate_families(scale)
+        records = generate_status_records(families)
+        for stage in stages:
+            with tempfile.TemporaryDirectory() as workdir:
+                seconds, items = BENCHMARKS[stage](workdir, families, records, workers)
+            results[f"{stage}@{scale}"] = {
+                "stage": stage,
+                "scale": scale,
+                "items": items,
+                "seconds": round(seconds, 4),
+                "per_item_us": round(seconds / items * 1e6, 1),
+                # None is each stage's default
+                "workers": workers,
+                "cpus": os.cpu_count(),
+            }
+            print(f"{stage:<18} {scale:>5}x {items:>8} items {seconds:>10.3f} s {seconds / items * 1e6:>12.1f} us/item")
+    return results
+
+
+# Store results in the baseline, keeping the saved results of stages and scales that were not run,
+# so that e.g. a separate 1000x run can be added to it
+def save_baseline(results, path=BASELINE_PATH):
+    previous = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)["results"]
+    merged = {**previous, **results}
+    baseline = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": {key: merged[key] for key in sorted(merged, key=baseline_order)},
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2)
+        f.write("\n")
+
+
+# Sort baseline entries by scale, then by pipeline order
+def baseline_order(key):
+    stage, scale = key.split("@")
+    return int(scale), STAGES.index(stage)
+
+
+# Worker and CPU counts a result was measured with, e.g. "workers=1, cpus=4"
+def settings(result):
+    workers = result.get("workers")
+    return f"workers={'default' if workers is None else workers}, cpus={result.get('cpus', '?')}"
+
+
+# Compare results against the baseline and return the keys of stages that got slower than the tolerance.
+# Results measured with other worker or CPU counts than their baseline entry are not compared.
+def compare_baseline(results, path=BASELINE_PATH, tolerance=DEFAULT_TOLERANCE):
+    with open(path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)["results"]
+
+    regressions = []
+    print(f"\n{'stage':<24} {'baseline (s)':>12} {'now (s)':>10} {'ratio':>7}")
+    for key, result in results.items():
+        if key not in baseline:
+            print(f"{key:<24} {'-':>12} {result['seconds']:>10.3f}")
+            continue
+        if settings(baseline[key]) != settings(result):
+            print(f"{key:<24} {'-':>12} {result['seconds']:>10.3f}  baseline has {settings(baseline[key])}, "
+                  f"this run {settings(result)}")
+            continue
+        before, now = baseline[key]["seconds"], result["seconds"]
+        ratio = now / before if before else float("inf")
+        slower = now > before * (1 + tolerance) and now - before > NOISE_FLOOR
+        print(f"{key:<24} {before:>12.3f} {now:>10.3f} {ratio:>7.2f}{'  [!] regression' if slower else ''}")
+        if slower:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each pipeline stage on synthetic portfolios")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="stages to time")
+    parser.add_argument("--scales", nargs="+", type=int, default=list(DEFAULT_SCALES),
+                        help="portfolio sizes as multiples of the current portfolio, e.g. 1 10 100 1000")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes or threads per stage")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--compare", action="store_true",
+                        help="compare the results with the baseline and exit with status 1 on a regression")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown before a stage counts as a regression (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.stages, args.scales, args.workers)
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f"\n[✓] Saved baseline to {args.baseline}")
+    if args.compare:
+        regressions = compare_baseline(results, args.baseline, args.tolerance)
+        if regressions:
+            print(f"\n[!] {len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n[✓] No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from family_graph import FamilyGraph
+
+# Filler text used to pad synthetic claims, abstracts and descriptions
+WORDS = ("the assembly comprising a transducer waveguide handle battery housing coupled to said "
+         "portion configured wherein further including operable at least one of").split()
+
+# Shape of the current portfolio: eight main patents sharing one extended family of 142 members,
+# and one main patent with a separate family of 14 members (156 members in total)
+SHARED_MAINS = 8
+SHARED_MEMBERS = 142
+SOLO_MEMBERS = 14
+
+# Statuses seen on Google Patents, with roughly the current portfolio's mix
+STATUSES = ["Active"] * 4 + ["Expired - Fee Related", "Expired - Lifetime", "Withdrawn", "Abandoned",
+                              "Pending", "Status not found"]
+
+# Size of the generated text fields
+CLAIMS_PER_PATENT = 20
+WORDS_PER_CLAIM = 40
+ABSTRACT_WORDS = 120
+DESCRIPTION_WORDS = 3000
+
+
+# Patent number of the n-th member of a synthetic family group, cycling through US grants,
+# European publications and Japanese publications
+def member_number(group, n):
+    serial = group * 1000 + n
+    if n % 3 == 0:
+        return f"US{8000000 + serial}"
+    if n % 3 == 1:
+        return f"EP{2000000 + serial}"
+    return f"JP{2013000000 + serial}"
+
+
+def text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+# Claims shaped like a real claim set: a few independent claims, each followed by dependent claims.
+# Most refer back to one earlier claim; others cite two claims, or, as European and Canadian claims
+# often do, "any one of" every claim since their independent claim.
+def generate_claims(n, body_words, rng):
+    claims = []
+    independent = 1
+    for number in range(1, n + 1):
+        body = text(rng, body_words)
+        kind = rng.random()
+        if number == 1 or kind < 0.15:
+            independent = number
+            claims.append(f"{number}. An apparatus comprising: {body}.")
+        elif kind < 0.6 or number - independent < 2:
+            parent = rng.choice([independent, number - 1])
+            claims.append(f"{number}. The apparatus of claim {parent}, wherein {body}.")
+        elif kind < 0.8:
+            claims.append(f"{number}. The apparatus of claim {independent} or {number - 1}, wherein {body}.")
+        else:
+            claims.append(f"{number}. The apparatus according to any one of claims {independent} to {number - 1}, "
+                          f"wherein {body}.")
+    return claims
+
+
+# Extended families of a portfolio `scale` times the current one: {main patent: [members]}
+def generate_families(scale):
+    families = {}
+    for group in range(scale):
+        shared = [member_number(group, n) for n in range(SHARED_MEMBERS)]
+        solo = [member_number(group, n) for n in range(SHARED_MEMBERS, SHARED_MEMBERS + SOLO_MEMBERS)]
+        # The main patents are the group's first US grants, and belong to their own family
+        for main in [m for m in shared if m.startswith("US")][:SHARED_MAINS]:
+            families[main] = shared
+        families[solo[0]] = solo
+    return families
+
+
+# A Lens search response for one main patent, shaped like the files in data_Lens. Each member is
+# listed once per publication kind, as Lens does.
+def lens_response(main, members, seed=0):
+    rng = random.Random(f"{seed}:{main}")
+    jurisdiction, doc_number = main[:2], main[2:]
+    extended = []
+    for member in members:
+        for kind in ("A1", "B2"):
+            extended.append({
+                "document_id": {"jurisdiction": member[:2], "doc_number": member[2:], "kind": kind,
+                                "date": "2013-02-12"},
+                "lens_id": f"{rng.randrange(10 ** 12):012d}",
+            })
+    claims = generate_claims(CLAIMS_PER_PATENT, WORDS_PER_CLAIM, rng)
+    record = {
+        "lens_id": f"{rng.randrange(10 ** 12):012d}",
+        "jurisdiction": jurisdiction,
+        "doc_number": doc_number,
+        "kind": "B2",
+        "date_published": "2013-02-12",
+        "doc_key": f"{jurisdiction}_{doc_number}_B2_20130212",
+        "lang": "en",
+        "biblio": {
+            "publication_reference": {"jurisdiction": jurisdiction, "doc_number": doc_number, "kind": "B2",
+                                      "date": "2013-02-12"},
+            "invention_title": [{"text": text(rng, 8), "lang": "en"}],
+        },
+        "families": {
+            "simple_family": {"members": extended[:4], "size": 2},
+            "extended_family": {"members": extended, "size": len(members)},
+        },
+        "legal_status": {"granted": True, "grant_date": "2013-02-12", "anticipated_term_date": "2028-11-06",
+                         "patent_status": "ACTIVE"},
+        "abstract": [{"text": text(rng, ABSTRACT_WORDS), "lang": "en"}],
+        "claims": [{"claims": [{"claim_text": [claim]} for claim in claims], "lang": "en"}],
+        "description": {"text": text(rng, DESCRIPTION_WORDS), "lang": "en"},
+        "publication_type": "GRANTED_PATENT",
+    }
+    return {"total": 1, "max_score": 23.7, "data": [record], "results": 1}
+
+
+# Write one Lens response per main patent to directory, formatted like save_patent_json_response
+def write_lens_responses(directory, families, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    for main, members in families.items():
+        with open(os.path.join(directory, f"{main}.json"), 'w', encoding='utf-8') as f:
+            json.dump(lens_response(main, members, seed), f, indent=4)
+
+
+# Scraped fields of a patent, generated deterministically from its number
+def patent_fields(patent, seed=0):
+    rng = random.Random(f"{seed}:{patent}")
+    status = rng.choice(STATUSES)
+    return {
+        "title": text(rng, 8).capitalize(),
+        "abstract": text(rng, ABSTRACT_WORDS),
+        "status": status,
+        "anticipated_expiration_date": f"20{rng.randrange(20, 40)}-{rng.randrange(1, 13):02d}-01",
+        "adjusted_expiration_date": "Adjusted expiration date not found",
+        "claims": generate_claims(CLAIMS_PER_PATENT, WORDS_PER_CLAIM, rng),
+    }
+
+
+# Status records for every member of the families, shaped like patent_family_set_status.json
+def generate_status_records(families, seed=0):
+    graph = FamilyGraph.build(families)
+    records = []
+    for index, patent in enumerate(graph):
+        fields = patent_fields(patent, seed)
+        records.append({
+            "index": index,
+            "patent_number": patent,
+            "link": f"https://patents.google.com/patent/{patent}/en",
+            "title": fields["title"],
+            "abstract": fields["abstract"],
+            "status": fields["status"],
+            "anticipated_expiration_date": fields["anticipated_expiration_date"],
+            "adjusted_expiration_date": fields["adjusted_expiration_date"],
+            "related_patents": list(graph[patent]),
+            "claims": fields["claims"],
+        })
+    return records
+
+
+# A Google Patents result page for a patent, with the markup google_patents_http.parse_patent_html reads
+def google_patent_html(patent, seed=0):
+    fields = patent_fields(patent, seed)
+    claims = "\n".join(
+        f'<div class="claim"><div class="claim-text">{claim}</div></div>' for claim in fields["claims"]
+    )
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta name="DC.title" content="{fields['title']}">
+  <title>{patent} - {fields['title']} - Google Patents</title>
+</head>
+<body>
+  <span itemprop="title">{fields['title']}</span>
+  <section itemprop="abstract">
+    <div class="abstract">{fields['abstract']}</div>
+  </section>
+  <dl>
+    <dt>Legal status</dt>
+    <dd itemprop="legalStatusIfi"><span itemprop="status">{fields['status']}</span></dd>
+    <dd itemprop="events">
+      <time itemprop="date" datetime="{fields['anticipated_expiration_date']}">{fields['anticipated_expiration_date']}</time>
+      <span itemprop="title">Anticipated expiration</span>
+    </dd>
+  </dl>
+  <section itemprop="claims">
+    <div class="claims">
+{claims}
+    </div>
+  </section>
+</body>
+</html>"""
@@ -0,0 +1,324 @@
+import argparse
+import mmap
+import os
+import re
+import struct
+import time
+from array import array
+from collections import deque
+
+from family_graph import load_family_graph
+from lens_archive import archived_records, response_paths
+from lens_enrichment import LENS_DIR, MEMBER_DIR
+from patent_family_retrieval_Lens import stream_json_values
+from patent_ids import normalize_patent_id
+
+# Default location of the saved citation graph
+CITATION_GRAPH_PATH = "patent_family_data/patent_citation_graph.bin"
+
+# Citation keys of a Lens record: the documents it cites, and the patents citing it
+CITATION_KEYS = re.compile(r'"(references_cited|cited_by)"\s*:')
+
+# Non-patent literature is interned by its citation text under this prefix
+NPL_PREFIX = "NPL:"
+
+# File layout: a header (magic, node count, edge count, size of the node ID text), then the arrays
+# id_offsets, out_offsets, out_neighbors, in_offsets and in_neighbors, each padded to 8 bytes, then the
+# node IDs in sorted order as UTF-8 text. Offsets are uint64 and neighbors uint32, in native byte order.
+MAGIC = b"PCG1"
+HEADER = struct.Struct("<4s4xQQQ")
+
+
+def citation_key(document_id):
+    if not document_id or not document_id.get("jurisdiction") or not document_id.get("doc_number"):
+        return None
+    return normalize_patent_id(f"{document_id['jurisdiction']}{document_id['doc_number']}")
+
+
+def npl_key(text):
+    return NPL_PREFIX + " ".join(text.split())
+
+
+# The citation fields of a saved Lens response as (key, value) pairs, in file order
+def citation_values(filepath):
+    records = archived_records(filepath, ["biblio"])
+    if records is None:
+        return stream_json_values(filepath, CITATION_KEYS)
+    return [(key, record["biblio"][key]) for record in records for key in ("references_cited", "cited_by")
+            if key in record.get("biblio", {})]
+
+
+# Stream the citation edges (citing, cited) out of a saved Lens response without decoding the rest of it.
+# The patent is taken from the file name, so every record in the file is treated as the same document.
+def citation_edges(filepath):
+    patent = normalize_patent_id(os.path.splitext(os.path.basename(filepath))[0])
+    for key, value in citation_values(filepath):
+        if key == "references_cited":
+            for citation in value.get("citations", []):
+                if "patcit" in citation:
+                    cited = citation_key(citation["patcit"].get("document_id"))
+                elif (citation.get("nplcit") or {}).get("text"):
+                    cited = npl_key(citation["nplcit"]["text"])
+                else:
+                    cited = None
+                if cited and cited != patent:
+                    yield patent, cited
+        else:
+            for citing in value.get("patents", []):
+                citing = citation_key(citing.get("document_id"))
+                if citing and citing != patent:
+                    yield citing, patent
+
+
+# Compressed sparse rows of an edge list: the neighbors of node i are neighbors[offsets[i]:offsets[i + 1]],
+# in ascending order
+def build_csr(sources, targets, node_count):
+    offsets = array('Q', bytes(8 * (node_count + 1)))
+    for source in sources:
+        offsets[source + 1] += 1
+    for i in range(node_count):
+        offsets[i + 1] += offsets[i]
+
+    neighbors = array('I', bytes(4 * len(sources)))
+    fill = offsets[:-1]
+    for source, target in zip(sources, targets):
+        neighbors[fill[source]] = target
+        fill[source] += 1
+    for i in range(node_count):
+        start, end = offsets[i], offsets[i + 1]
+        if end - start > 1:
+            neighbors[start:end] = array('I', sorted(neighbors[start:end]))
+    return offsets, neighbors
+
+
+def write_padded(f, data):
+    f.write(data)
+    f.write(b"\0" * (-f.tell() % 8))
+
+
+# Citation graph over patents and non-patent literature, stored as forward (cites) and backward
+# (cited by) adjacency arrays. Nodes are numbered by their sorted IDs, so a loaded graph finds a
+# patent by binary search over the memory-mapped ID text without building any index in memory.
+class CitationGraph:
+
+    def __init__(self, id_text, id_offsets, out_offsets, out_neighbors, in_offsets, in_neighbors, mapped=None):
+        self.id_text = id_text
+        self.id_offsets = id_offsets
+        self.out_offsets = out_offsets
+        self.out_neighbors = out_neighbors
+        self.in_offsets = in_offsets
+        self.in_neighbors = in_neighbors
+        self._mapped = mapped
+
+    # Build the graph from (citing, cited) pairs, dropping duplicate edges
+    @classmethod
+    def build(cls, edges):
+        interned = {}
+        pairs = set()
+        for citing, cited in edges:
+            source = interned.setdefault(citing, len(interned))
+            target = interned.setdefault(cited, len(interned))
+            pairs.add(source << 32 | target)
+
+        ids = sorted(interned)
+        rank = array('I', bytes(4 * len(ids)))
+        for position, node in enumerate(ids):
+            rank[interned[node]] = position
+        del interned
+
+        sources = array('I', (rank[pair >> 32] for pair in pairs))
+        targets = array('I', (rank[pair & 0xFFFFFFFF] for pair in pairs))
+        del pairs
+
+        encoded = [node.encode("utf-8") for node in ids]
+        id_offsets = array('Q', [0])
+        for node in encoded:
+            id_offsets.append(id_offsets[-1] + len(node))
+        out_offsets, out_neighbors = build_csr(sources, targets, len(ids))
+        in_offsets, in_neighbors = build_csr(targets, sources, len(ids))
+        return cls(b"".join(encoded), id_offsets, out_offsets, out_neighbors, in_offsets, in_neighbors)
+
+    # Build the graph from every saved Lens response in the given directories
+    @classmethod
+    def from_directories(cls, directories=(LENS_DIR, MEMBER_DIR)):
+        paths = [path for directory in directories for path in response_paths(directory)]
+        return cls.build(edge for path in paths for edge in citation_edges(path))
+
+    def save(self, path=CITATION_GRAPH_PATH):
+        with open(path + ".tmp", 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(self), self.edge_count, len(self.id_text)))
+            for data in (self.id_offsets, self.out_offsets, self.out_neighbors, self.in_offsets, self.in_neighbors):
+                write_padded(f, bytes(data))
+            f.write(self.id_text)
+        os.replace(path + ".tmp", path)
+
+    # Memory-map a saved graph. Nothing is read until it is queried.
+    @classmethod
+    def load(cls, path=CITATION_GRAPH_PATH):
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, nodes, edges, text_size = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC:
+            mapped.close()
+            raise ValueError(f"{path} is not a citation graph")
+
+        view = memoryview(mapped)
+        position = HEADER.size
+        sections = []
+        for code, count in (('Q', nodes + 1), ('Q', nodes + 1), ('I', edges), ('Q', nodes + 1), ('I', edges)):
+            size = count * struct.calcsize(code)
+            sections.append(view[position:position + size].cast(code))
+            position += size + (-size % 8)
+        id_text = view[position:position + text_size]
+        graph = cls(id_text, *sections, mapped=mapped)
+        graph._view = view
+        return graph
+
+    # Release the memory map of a loaded graph
+    def close(self):
+        if self._mapped is not None:
+            for data in (self.id_text, self.id_offsets, self.out_offsets, self.out_neighbors, self.in_offsets,
+                         self.in_neighbors, self._view):
+                data.release()
+            self._mapped.close()
+            self._mapped = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.id_offsets) - 1
+
+    @property
+    def edge_count(self):
+        return len(self.out_neighbors)
+
+    def node_id(self, node):
+        return bytes(self.id_text[self.id_offsets[node]:self.id_offsets[node + 1]]).decode("utf-8")
+
+    # Node number of a patent number or NPL ID, or None if it is not in the graph
+    def node(self, patent):
+        key = patent if patent.startswith(NPL_PREFIX) else normalize_patent_id(patent)
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.node_id(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < len(self) and self.node_id(low) == key else None
+
+    def __contains__(self, patent):
+        return self.node(patent) is not None
+
+    def _neighbors(self, node, direction):
+        offsets, neighbors = ((self.out_offsets, self.out_neighbors) if direction == "out"
+                              else (self.in_offsets, self.in_neighbors))
+        return neighbors[offsets[node]:offsets[node + 1]]
+
+    # Documents a patent cites
+    def cited(self, patent):
+        node = self.node(patent)
+        return [] if node is None else [self.node_id(n) for n in self._neighbors(node, "out")]
+
+    # Patents citing a patent
+    def citing(self, patent):
+        node = self.node(patent)
+        return [] if node is None else [self.node_id(n) for n in self._neighbors(node, "in")]
+
+    def out_degree(self, patent):
+        node = self.node(patent)
+        return 0 if node is None else self.out_offsets[node + 1] - self.out_offsets[node]
+
+    def in_degree(self, patent):
+        node = self.node(patent)
+        return 0 if node is None else self.in_offsets[node + 1] - self.in_offsets[node]
+
+    # Documents within hops citation steps of any of the given patents, with their distance. direction is
+    # "in" (patents citing them, directly or through others), "out" (documents they cite) or "both".
+    # The given patents themselves are left out.
+    def k_hop(self, patents, hops=1, direction="in"):
+        directions = ("in", "out") if direction == "both" else (direction,)
+        start = {node for node in (self.node(patent) for patent in patents) if node is not None}
+        distance = dict.fromkeys(start, 0)
+        frontier = deque(start)
+        while frontier:
+            node = frontier.popleft()
+            if distance[node] == hops:
+                continue
+            for way in directions:
+                for neighbor in self._neighbors(node, way):
+                    if neighbor not in distance:
+                        distance[neighbor] = distance[node] + 1
+                        frontier.append(neighbor)
+        return {self.node_id(node): hops_away for node, hops_away in distance.items() if node not in start}
+
+    # Documents within hops citation steps of any member of a patent's family, excluding the family itself
+    def family_citations(self, family_graph, patent, hops=1, direction="in"):
+        family_id = family_graph.family_id(patent)
+        members = [normalize_patent_id(patent)] if family_id is None else family_graph.members(family_id)
+        found = self.k_hop(members, hops, direction)
+        for member in members:
+            found.pop(member, None)
+        return found
+
+    # Distinct documents citing and cited by each family, counting citations between members only once
+    def family_degrees(self, family_graph):
+        degrees = {}
+        for family in family_graph.families:
+            members = {normalize_patent_id(member) for member in family["members"]}
+            citing, cited = set(), set()
+            for member in members:
+                node = self.node(member)
+                if node is not None:
+                    citing.update(self._neighbors(node, "in"))
+                    cited.update(self._neighbors(node, "out"))
+            own = {self.node(member) for member in members}
+            degrees[family["id"]] = {"citing": len(citing - own), "cited": len(cited - own)}
+        return degrees
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the citation graph of the saved Lens responses")
+    parser.add_argument("command", choices=["build", "query", "families"])
+    parser.add_argument("patents", nargs="*", help="patents to query")
+    parser.add_argument("--graph", default=CITATION_GRAPH_PATH, help="file the citation graph is saved to")
+    parser.add_argument("--hops", type=int, default=1, help="citation steps to follow")
+    parser.add_argument("--direction", choices=["in", "out", "both"], default="in",
+                        help="follow citing patents (in), cited documents (out) or both")
+    parser.add_argument("--family", action="store_true",
+                        help="start from every member of the patents' families")
+    parser.add_argument("--family-dir", default="patent_family_data", help="directory with the family graph")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        graph = CitationGraph.from_directories()
+        graph.save(args.graph)
+        print(f"[✓] Saved {len(graph)} documents and {graph.edge_count} citations in "
+              f"{time.perf_counter() - start:.2f}s to {args.graph}.")
+    else:
+        family_graph = load_family_graph(args.family_dir) if args.family or args.command == "families" else None
+        with CitationGraph.load(args.graph) as graph:
+            start = time.perf_counter()
+            if args.command == "families":
+                for family_id, degree in graph.family_degrees(family_graph).items():
+                    print(f"{family_id}: cited by {degree['citing']}, cites {degree['cited']}")
+            else:
+                if not args.patents:
+                    parser.error("query needs at least one patent")
+                for patent in args.patents:
+                    print(f"{patent}: cites {graph.out_degree(patent)}, cited by {graph.in_degree(patent)}")
+                if args.family:
+                    found = {}
+                    for patent in args.patents:
+                        found.update(graph.family_citations(family_graph, patent, args.hops, args.direction))
+                else:
+                    found = graph.k_hop(args.patents, args.hops, args.direction)
+                for node, distance in sorted(found.items(), key=lambda item: (item[1], item[0])):
+                    print(f"  {distance} {node}")
+                print(f"{len(found)} document(s) within {args.hops} hop(s).")
+            print(f"Queried in {(time.perf_counter() - start) * 1000:.3f} ms.")
@@ -0,0 +1,376 @@
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import re
+import time
+
+from family_graph import UnionFind, load_family_graph
+from patent_index import tokenize
+
+# Default location of the saved index
+SIMILARITY_INDEX_PATH = "patent_status_data/claim_similarity_index.json"
+
+# Words per shingle. Shingles never span two claims.
+SHINGLE_WORDS = 3
+
+# Values in a claim set's MinHash signature (a power of two), split into BANDS bands of equal size.
+# Two claim sets become candidates when all values of one band agree, which happens for almost every
+# pair above a Jaccard similarity of 0.6 and for few pairs below 0.3.
+NUM_HASHES = 128
+BANDS = 32
+
+# Estimated Jaccard similarity of the claim shingles above which two claim sets are near-duplicates
+DEFAULT_THRESHOLD = 0.8
+
+# Leading claim number, so renumbered claims still compare equal
+CLAIM_NUMBER = re.compile(r"^\s*\d+\s*\.\s*")
+
+# Words of a changed claim shown around each change in a diff
+DIFF_CONTEXT = 3
+
+# Share of words a claim must have in common with one of the representative's claims to be shown as
+# a change of it rather than as a new claim
+CHANGED_CLAIM_RATIO = 0.6
+
+
+# A claim without its number, as lower-case words
+def claim_words(claim):
+    return tokenize(CLAIM_NUMBER.sub("", claim or ""))
+
+
+# 64-bit hashes of the word shingles of a claim set
+def shingle_hashes(claims):
+    hashes = set()
+    for claim in claims:
+        words = claim_words(claim)
+        for start in range(max(1, len(words) - SHINGLE_WORDS + 1)):
+            shingle = " ".join(words[start:start + SHINGLE_WORDS])
+            if shingle:
+                hashes.add(int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little"))
+    return hashes
+
+
+# MinHash signature of a set of shingle hashes, or None for an empty set. Each shingle is hashed once
+# and falls into one of NUM_HASHES bins by its low bits, keeping the smallest remaining value per bin
+# (one-permutation hashing). Empty bins borrow the value of the next filled bin to their right, offset
+# by the distance, so two sets agree in a position with probability close to their Jaccard similarity.
+def minhash(hashes, num_hashes=NUM_HASHES):
+    if not hashes:
+        return None
+    shift = num_hashes.bit_length() - 1
+    signature = [None] * num_hashes
+    for h in hashes:
+        position, value = h & (num_hashes - 1), h >> shift
+        if signature[position] is None or value < signature[position]:
+            signature[position] = value
+    filled = [position for position, value in enumerate(signature) if value is not None]
+    if len(filled) < num_hashes:
+        densified = list(signature)
+        following = filled[0] + num_hashes
+        for position in range(num_hashes - 1, -1, -1):
+            if signature[position] is not None:
+                following = position
+            else:
+                distance = following - position
+                densified[position] = signature[following % num_hashes] + (distance << (64 - shift))
+        signature = densified
+    return tuple(signature)
+
+
+# Estimated Jaccard similarity of the claim sets behind two signatures
+def similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+# MinHash/LSH index over the claim sets of the status records. Each band of a signature is a key in
+# that band's bucket table, so near-duplicate claim sets are found without comparing every pair.
+# Patents without claims are not indexed.
+class ClaimSimilarityIndex:
+
+    def __init__(self, patents=(), signatures=(), num_hashes=NUM_HASHES, bands=BANDS):
+        self.num_hashes = num_hashes
+        self.bands = bands
+        self.rows = num_hashes // bands
+        self.patents = []
+        self.signatures = []
+        self.docs = {}
+        self.buckets = [{} for _ in range(bands)]
+        for patent, signature in zip(patents, signatures):
+            self.add_signature(patent, tuple(signature))
+
+    # Build an index from status records
+    @classmethod
+    def build(cls, records):
+        index = cls()
+        for record in records:
+            index.add(record)
+        return index
+
+    # Add the claim set of one status record. Returns False if it has no claims.
+    def add(self, record):
+        claims = record.get("claims")
+        signature = minhash(shingle_hashes(claims if isinstance(claims, list) else [claims]), self.num_hashes)
+        if signature is None:
+            return False
+        self.add_signature(record.get("patent_number", "N/A"), signature)
+        return True
+
+    def add_signature(self, patent, signature):
+        doc = len(self.patents)
+        self.patents.append(patent)
+        self.signatures.append(signature)
+        self.docs[patent] = doc
+        for band, key in enumerate(self.band_keys(signature)):
+            self.buckets[band].setdefault(key, []).append(doc)
+
+    def band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows] for band in range(self.bands)]
+
+    def __len__(self):
+        return len(self.patents)
+
+    def __contains__(self, patent):
+        return patent in self.docs
+
+    # Documents sharing at least one band with a signature
+    def candidates(self, signature):
+        docs = set()
+        for band, key in enumerate(self.band_keys(signature)):
+            docs.update(self.buckets[band].get(key, ()))
+        return docs
+
+    # Groups of patents with near-duplicate claims, within or across families. Each group lists its
+    # patents in status file order, and groups are ordered by their first patent. Within a bucket, each
+    # patent is only compared with the first patent of every group already found there, so identical
+    # and near-identical claim sets cost one comparison each instead of one per pair.
+    def clusters(self, threshold=DEFAULT_THRESHOLD):
+        groups = UnionFind()
+        for doc in range(len(self.patents)):
+            groups.add(doc)
+        for buckets in self.buckets:
+            for docs in buckets.values():
+                leaders = []
+                for doc in docs:
+                    matched = False
+                    for leader in leaders:
+                        if (groups.find(doc) == groups.find(leader)
+                                or similarity(self.signatures[doc], self.signatures[leader]) >= threshold):
+                            groups.union(doc, leader)
+                            matched = True
+                    if not matched:
+                        leaders.append(doc)
+
+        members = {}
+        for doc in range(len(self.patents)):
+            members.setdefault(groups.find(doc), []).append(doc)
+        return [[self.patents[doc] for doc in docs] for docs in members.values() if len(docs) > 1]
+
+    # The k patents whose claims are most similar to a signature, as (patent, similarity) pairs
+    def similar_to(self, signature, k=10, exclude=None):
+        scores = [(similarity(signature, self.signatures[doc]), doc) for doc in self.candidates(signature)
+                  if doc != exclude]
+        scores.sort(key=lambda score: (-score[0], score[1]))
+        return [(self.patents[doc], score) for score, doc in scores[:k]]
+
+    # The k indexed patents whose claims are most similar to a patent's claims
+    def most_similar(self, patent, k=10):
+        doc = self.docs[patent]
+        return self.similar_to(self.signatures[doc], k, exclude=doc)
+
+    # The k indexed patents whose claims are most similar to a list of claims
+    def similar_to_claims(self, claims, k=10):
+        signature = minhash(shingle_hashes(claims), self.num_hashes)
+        return [] if signature is None else self.similar_to(signature, k)
+
+    def to_dict(self):
+        return {"num_hashes": self.num_hashes, "bands": self.bands, "patents": self.patents,
+                "signatures": [list(signature) for signature in self.signatures]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["patents"], data["signatures"], data["num_hashes"], data["bands"])
+
+    def save(self, path=SIMILARITY_INDEX_PATH):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path=SIMILARITY_INDEX_PATH):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+# Word-level changes between two versions of a claim, as "... [-removed-] {+added+} ..." with a few
+# words of context around each change
+def claim_change(old, new):
+    old_words, new_words = old.split(), new.split()
+    parts = []
+    last = 0
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_words, new_words, autojunk=False).get_opcodes():
+        if tag == "equal":
+            continue
+        if i1 - last > (2 * DIFF_CONTEXT if parts else DIFF_CONTEXT):
+            parts.extend(old_words[last:last + DIFF_CONTEXT] if parts else [])
+            parts.append("...")
+            parts.extend(old_words[i1 - DIFF_CONTEXT:i1])
+        else:
+            parts.extend(old_words[last:i1])
+        if i2 > i1:
+            parts.append("[-" + " ".join(old_words[i1:i2]) + "-]")
+        if j2 > j1:
+            parts.append("{+" + " ".join(new_words[j1:j2]) + "+}")
+        last = i2
+    parts.extend(old_words[last:last + DIFF_CONTEXT])
+    if last + DIFF_CONTEXT < len(old_words):
+        parts.append("...")
+    return " ".join(parts)
+
+
+# Claim numbers as compact ranges, e.g. "claims 3, 9-12"
+def claim_ranges(numbers):
+    ranges = []
+    for number in numbers:
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    text = ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+    return ("claim " if len(numbers) == 1 else "claims ") + text
+
+
+# Compact description of how a claim set differs from its cluster's representative. Claims are
+# matched by their text without numbers, and the others with the closest remaining claim of the
+# representative, wherever it is. Changed claims show their word-level changes, added claims are
+# listed in full with "+", and claims of the representative the member lacks are listed with "-".
+def claim_diff(representative, rep_claims, claims):
+    old = [CLAIM_NUMBER.sub("", claim).strip() for claim in rep_claims]
+    new = [CLAIM_NUMBER.sub("", claim).strip() for claim in claims]
+    old_words = [claim_words(claim) for claim in old]
+    new_words = [claim_words(claim) for claim in new]
+    removed, added = [], []
+    matcher = difflib.SequenceMatcher(None, [" ".join(w) for w in old_words], [" ".join(w) for w in new_words],
+                                      autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            removed.extend(range(i1, i2))
+            added.extend(range(j1, j2))
+
+    # Each claim not found unchanged is compared with the closest claim of the representative that
+    # was not found either
+    changed, inserted = [], []
+    for j in added:
+        best, match = CHANGED_CLAIM_RATIO, None
+        for i in removed:
+            claim_matcher = difflib.SequenceMatcher(None, old_words[i], new_words[j], autojunk=False)
+            if claim_matcher.quick_ratio() >= best and claim_matcher.ratio() >= best:
+                best, match = claim_matcher.ratio(), i
+        if match is None:
+            inserted.append(j)
+        else:
+            removed.remove(match)
+            changed.append((match, j))
+
+    lines = {j: f"+ {j + 1}. {new[j]}" for j in inserted}
+    for i, j in changed:
+        moved = f"claim {i + 1} of {representative}"
+        if old_words[i] == new_words[j]:
+            lines[j] = f"~ {j + 1}. Same as {moved}"
+        else:
+            lines[j] = f"~ {j + 1}. {f'({moved}) ' if i != j else ''}{claim_change(old[i], new[j])}"
+    lines = [lines[j] for j in sorted(lines)]
+    if removed:
+        lines.append(f"- {claim_ranges([i + 1 for i in sorted(removed)])} of {representative}")
+    if not lines:
+        return f"Same claims as {representative}."
+    return f"Claims of {representative}, except:\n" + "\n".join(lines)
+
+
+# Replaces the claims of near-duplicate patents with a diff against their cluster's representative
+# while status records stream past in file order. The representative of a cluster is its first
+# patent, so its claims have always been seen by the time another member needs them.
+class ClaimDeduper:
+
+    def __init__(self, clusters):
+        self.representative = {}
+        self.members = {}
+        self.claims = {}
+        for cluster in clusters:
+            self.members[cluster[0]] = cluster[1:]
+            for patent in cluster[1:]:
+                self.representative[patent] = cluster[0]
+
+    # Build the deduper from the status records in one pass over them
+    @classmethod
+    def build(cls, records, threshold=DEFAULT_THRESHOLD):
+        return cls(ClaimSimilarityIndex.build(records).clusters(threshold))
+
+    # Remember the claims of representatives; call this for each record before diff
+    def observe(self, record):
+        if record.get("patent_number") in self.members:
+            self.claims[record["patent_number"]] = record.get("claims") or []
+
+    # What the rendered claims of a record depend on besides the record itself: the members of a
+    # representative, or the representative and its claims for a member. None for other patents.
+    def cluster_key(self, record):
+        number = record.get("patent_number")
+        if number in self.members:
+            return ["representative", self.members[number]]
+        representative = self.representative.get(number)
+        if representative in self.claims:
+            return ["duplicate", representative, self.claims[representative]]
+        return None
+
+    # Representative patent and claim diff of a cluster member, or None for patents rendered in full
+    def diff(self, record):
+        representative = self.representative.get(record.get("patent_number"))
+        if representative is None or representative not in self.claims:
+            return None
+        return representative, claim_diff(representative, self.claims[representative], record.get("claims") or [])
+
+
+if __name__ == "__main__":
+    from visualize_patents import JSON_PATH, iter_patents
+
+    parser = argparse.ArgumentParser(description="Find patents with near-duplicate or similar claims")
+    parser.add_argument("command", choices=["build", "query", "clusters"])
+    parser.add_argument("patent", nargs="?", help="patent to find similar claims for")
+    parser.add_argument("--input", default=JSON_PATH, help="status JSON file written by google_scraper.py")
+    parser.add_argument("--store", default=None, help="read the statuses from this SQLite patent store instead")
+    parser.add_argument("--index", default=SIMILARITY_INDEX_PATH, help="file the index is saved to")
+    parser.add_argument("--top", type=int, default=10, help="number of similar patents listed")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="similarity above which claim sets are near-duplicates")
+    parser.add_argument("--family-dir", default="patent_family_data", help="directory with the family graph")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        index = ClaimSimilarityIndex.build(iter_patents(args.input, args.store))
+        index.save(args.index)
+        print(f"Indexed the claims of {len(index)} patents in {time.perf_counter() - start:.2f}s to {args.index}.")
+    elif args.command == "query":
+        if not args.patent:
+            parser.error("query needs a patent number")
+        index = ClaimSimilarityIndex.load(args.index)
+        if args.patent not in index:
+            print(f"[!] {args.patent} has no indexed claims")
+        else:
+            start = time.perf_counter()
+            matches = index.most_similar(args.patent, args.top)
+            elapsed = time.perf_counter() - start
+            for patent, score in matches:
+                print(f"{patent}\t{score:.2f}")
+            print(f"{len(matches)} similar patent(s) in {elapsed * 1000:.3f} ms.")
+    else:
+        index = ClaimSimilarityIndex.load(args.index)
+        family_graph = load_family_graph(args.family_dir)
+        clusters = index.clusters(args.threshold)
+        for cluster in clusters:
+            families = {family_graph.family_id(patent) for patent in cluster} if family_graph is not None else set()
+            scope = "across families" if len(families) > 1 else "within a family"
+            print(f"{cluster[0]}: {len(cluster) - 1} near-duplicate(s) {scope}: {', '.join(cluster[1:])}")
+        duplicates = sum(len(cluster) - 1 for cluster in clusters)
+        print(f"[✓] {len(clusters)} cluster(s); {duplicates} of {len(index)} patents repeat another's claims.")
@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+import time
+from collections.abc import Mapping
+
+from patent_ids import normalize_patent_id
+
+# Directories and files
+family_data_dir = 'patent_family_data'
+FAMILY_GRAPH_FILENAME = 'patent_family_graph.json'
+FAMILY_SET_FILENAME = 'patent_family_set.json'
+
+
+# Disjoint sets of patent numbers, with path halving and union by size
+class UnionFind:
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def add(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        self.add(a)
+        self.add(b)
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+
+# Connected components of the main patents' extended families. Each family (component) stores its
+# main patents and members once; a member's related main patents are all of the family's mains,
+# except for the few members listed in "partial" with the positions of the mains they belong to.
+# Families are identified by their smallest main patent number, so IDs stay the same between runs
+# unless that patent leaves the portfolio.
+#
+# The graph is also a read-only mapping from member to related main patents, in the same shape as
+# patent_family_set.json, so it can be passed anywhere the old family set was used.
+class FamilyGraph(Mapping):
+
+    def __init__(self, families=()):
+        self.families = list(families)
+        self._family_of = {}
+        self._by_id = {}
+        for position, family in enumerate(self.families):
+            self._by_id[family["id"]] = position
+            for member in family["members"]:
+                self._family_of[member] = position
+
+    # Merge the extended families of main patents ({main patent: [members]}) into a graph
+    @classmethod
+    def build(cls, extended_families):
+        uf = UnionFind()
+        for main, members in extended_families.items():
+            uf.add(main)
+            for member in members:
+                uf.union(main, member)
+
+        # Collect each component's mains and, per member, the positions of the mains listing it
+        components = {}
+        for main in sorted(extended_families):
+            component = components.setdefault(uf.find(main), {"mains": [], "members": {}})
+            position = len(component["mains"])
+            component["mains"].append(main)
+            for member in extended_families[main]:
+                positions = component["members"].setdefault(member, [])
+                if not positions or positions[-1] != position:
+                    positions.append(position)
+
+        families = []
+        for component in components.values():
+            mains = component["mains"]
+            families.append({
+                "id": mains[0],
+                "mains": mains,
+                "members": list(component["members"]),
+                "partial": {member: positions for member, positions in component["members"].items()
+                            if len(positions) != len(mains)},
+            })
+        families.sort(key=lambda family: family["id"])
+        return cls(families)
+
+    # Build a graph from the old member -> [related main patents] family set
+    @classmethod
+    def from_family_set(cls, family_set):
+        extended_families = {}
+        for member, mains in family_set.items():
+            for main in mains:
+                extended_families.setdefault(main, []).append(member)
+        return cls.build(extended_families)
+
+    # Related main patents of a member, shared between all members related to every main of the family
+    def __getitem__(self, member):
+        family = self.families[self._family_of[member]]
+        positions = family["partial"].get(member)
+        if positions is None:
+            return family["mains"]
+        return [family["mains"][position] for position in positions]
+
+    def __iter__(self):
+        for family in self.families:
+            yield from family["members"]
+
+    def __len__(self):
+        return len(self._family_of)
+
+    # Position of the family holding a patent, trying its canonical spelling as well
+    def _lookup(self, patent):
+        if patent in self._family_of:
+            return self._family_of[patent]
+        return self._family_of.get(normalize_patent_id(patent))
+
+    # ID of the family a patent belongs to, or None
+    def family_id(self, patent):
+        position = self._lookup(patent)
+        return None if position is None else self.families[position]["id"]
+
+    # Number of members in the family of a patent, or 0 if it is in no family
+    def family_size(self, patent):
+        position = self._lookup(patent)
+        return 0 if position is None else len(self.families[position]["members"])
+
+    # Main patents whose extended family includes a member
+    def related_mains(self, patent):
+        position = self._lookup(patent)
+        if position is None:
+            return []
+        member = patent if patent in self._family_of else normalize_patent_id(patent)
+        return list(self[member])
+
+    # Members and main patents of a family by ID
+    def members(self, family_id):
+        return list(self.families[self._by_id[family_id]]["members"])
+
+    def mains(self, family_id):
+        return list(self.families[self._by_id[family_id]]["mains"])
+
+    # Extended family of each main patent ({main patent: [members]}), the input of build
+    def extended_families(self):
+        extended_families = {}
+        for member in self:
+            for main in self[member]:
+                extended_families.setdefault(main, []).append(member)
+        return extended_families
+
+    # Member -> [related main patents] mapping in the shape of patent_family_set.json
+    def family_set(self):
+        return {member: list(self[member]) for member in self}
+
+    def save(self, path):
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({"families": self.families}, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def save_family_set(self, path):
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.family_set(), f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f)["families"])
+
+    def summary(self):
+        return (f"{len(self.families)} famil{'y' if len(self.families) == 1 else 'ies'}, "
+                f"{sum(len(family['mains']) for family in self.families)} main patent(s), {len(self)} member(s)")
+
+
+# Write the family graph to a family data directory, together with the family set it maps to so tools
+# reading patent_family_set.json stay up to date. Returns the number of bytes written.
+def save_family_data(graph, directory=family_data_dir):
+    graph_path = os.path.join(directory, FAMILY_GRAPH_FILENAME)
+    set_path = os.path.join(directory, FAMILY_SET_FILENAME)
+    graph.save(graph_path)
+    graph.save_family_set(set_path)
+    return os.path.getsize(graph_path) + os.path.getsize(set_path)
+
+
+# Load the family graph from a family data directory. Falls back to converting patent_family_set.json
+# when no graph has been written yet (e.g. when the family set is maintained by hand).
+def load_family_graph(directory=family_data_dir):
+    graph_path = os.path.join(directory, FAMILY_GRAPH_FILENAME)
+    if os.path.exists(graph_path):
+        return FamilyGraph.load(graph_path)
+    set_path = os.path.join(directory, FAMILY_SET_FILENAME)
+    if os.path.exists(set_path):
+        with open(set_path, 'r', encoding='utf-8') as f:
+            return FamilyGraph.from_family_set(json.load(f))
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert patent_family_set.json into the compact family graph")
+    parser.add_argument("--input", default=os.path.join(family_data_dir, FAMILY_SET_FILENAME),
+                        help="family set mapping each member to its related main patents")
+    parser.add_argument("--output", default=os.path.join(family_data_dir, FAMILY_GRAPH_FILENAME),
+                        help="family graph file to write")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with open(args.input, 'r', encoding='utf-8') as f:
+        graph = FamilyGraph.from_family_set(json.load(f))
+    graph.save(args.output)
+    print(f"Saved family graph with {graph.summary()} to {args.output} in {time.perf_counter() - start:.3f}s.")
@@ -0,0 +1,130 @@
+import os
+import re
+
+from lxml import etree
+from lxml import html as lxml_html
+
+import metrics
+from request_utils import request_with_backoff
+
+# Google Patents page for a patent, in English (can be pointed at a local stub server for testing)
+PATENT_URL = os.getenv("GOOGLE_PATENTS_URL", "https://patents.google.com/patent/{}/en")
+
+# Block-level tags that start a new line in rendered text
+BLOCK_TAGS = {"div", "p", "br", "li", "ul", "ol", "section", "h1", "h2", "h3", "dd", "dt", "table", "tr"}
+
+# Browser-like headers so the server returns the regular page
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+
+# Raised when a page was fetched but does not look like a Google Patents result
+class PatentParseError(Exception):
+    pass
+
+
+# Render an element's text the way a browser would: block elements on their own lines,
+# whitespace collapsed and hidden original-language text left out
+def element_text(element):
+    parts = []
+
+    # Source whitespace (including newlines) collapses to a space; only block elements break lines
+    def add_text(text):
+        if text:
+            parts.append(re.sub(r"\s+", " ", text))
+
+    def walk(el, top=False):
+        tag = el.tag if isinstance(el.tag, str) else ""
+        if tag and "google-src-text" not in (el.get("class") or ""):
+            if tag in BLOCK_TAGS:
+                parts.append("\n")
+            add_text(el.text)
+            for child in el:
+                walk(child)
+            if tag in BLOCK_TAGS:
+                parts.append("\n")
+        # The element's own tail belongs to its parent
+        if not top:
+            add_text(el.tail)
+
+    walk(element, top=True)
+    lines = (line.strip() for line in "".join(parts).split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+# Find the date of a legal event (e.g. "Adjusted expiration") in the events timeline
+def find_event_date(tree, title):
+    for event in tree.xpath("//dd[@itemprop='events']"):
+        event_title = event.xpath("string(.//*[@itemprop='title'])")
+        if title.lower() in event_title.lower():
+            date = event.xpath("string(.//time[@itemprop='date'])").strip()
+            if date:
+                return date
+    return None
+
+
+# Parse a Google Patents page into the same dictionary produced by google_scraper.get_patent_details
+def parse_patent_html(page, index, patent_num, link, related_patents=None):
+    try:
+        tree = lxml_html.fromstring(page)
+    except etree.ParserError as e:
+        raise PatentParseError(f"Could not parse page for {patent_num}: {e}") from e
+
+    title = tree.xpath("string(//meta[@name='DC.title']/@content)").strip() \
+        or tree.xpath("normalize-space(//span[@itemprop='title'])")
+    if not title:
+        raise PatentParseError(f"No title found on page for {patent_num}")
+
+    abstracts = tree.xpath("//section[@itemprop='abstract']//div[contains(@class, 'abstract')]")
+    status = tree.xpath("normalize-space(//*[@itemprop='legalStatusIfi']//*[@itemprop='status'])")
+    claim_divs = tree.xpath("//section[@itemprop='claims']//div[contains(concat(' ', @class, ' '), ' claims ')]/div")
+
+    return {
+        "index": index,
+        "patent_number": patent_num,
+        "link": link,
+        "title": title,
+        "abstract": element_text(abstracts[0]) if abstracts else "Abstract not found",
+        "status": status or "Status not found",
+        "anticipated_expiration_date": find_event_date(tree, "Anticipated expiration")
+        or "Anticipated expiration date not found",
+        "adjusted_expiration_date": find_event_date(tree, "Adjusted expiration")
+        or "Adjusted expiration date not found",
+        "related_patents": related_patents or [],
+        "claims": [element_text(div) for div in claim_divs],
+    }
+
+
+# Build the record used for patents that Google Patents has no page for
+def not_found_details(index, patent_num, link, related_patents=None):
+    return {
+        "index": index,
+        "patent_number": patent_num,
+        "link": link,
+        "title": "Title not found",
+        "abstract": "Abstract not found",
+        "status": "Status not found",
+        "anticipated_expiration_date": "Anticipated expiration date not found",
+        "adjusted_expiration_date": "Adjusted expiration date not found",
+        "related_patents": related_patents or [],
+        "claims": [],
+    }
+
+
+# Get detailed information about a patent over plain HTTP, without a browser.
+# Raises on network errors and PatentParseError on pages that cannot be parsed.
+def fetch_patent_details(index, patent_num, session, related_patents=None, limiter=None, timeout=30):
+    print(f"[{index}] Patent: {patent_num}")
+    url = PATENT_URL.format(patent_num)
+    response = request_with_backoff(session, "GET", url, limiter=limiter, timeout=timeout, headers=HEADERS)
+
+    if response.status_code == 404:
+        metrics.count("not_found_total", field="page")
+        return not_found_details(index, patent_num, url, related_patents)
+    response.raise_for_status()
+
+    with metrics.timer("html_parse", patent=patent_num):
+        return parse_patent_html(response.content, index, patent_num, response.url, related_patents)
@@ -1,13 +1,31 @@
+import argparse
 import os
 import platform
+import queue
 import subprocess
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import requests
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+import metrics
+from family_graph import FAMILY_GRAPH_FILENAME, FAMILY_SET_FILENAME, load_family_graph
+from google_patents_http import PatentParseError, fetch_patent_details
+from lens_enrichment import LENS_DIR, MEMBER_DIR, LensRecords, enrich_items
+from patent_ids import dedupe_patent_ids, group_aliases
+from patent_store import PatentStore
+from request_utils import RateLimiter, create_session
+from scrape_cache import DEFAULT_MAX_ENTRIES, CachedResults, ScrapeCache
+
+# Number of pages a WebDriver loads before it is replaced with a fresh one
+DEFAULT_PAGES_PER_DRIVER = 50
+
 
 # Detect the default web browser on the system
 def get_default_browser():
@@ -83,15 +101,20 @@ def get_patent_details(index, patent_num, driver, related_patents=None):
     print(f"[{index}] Patent: {patent_num}")
     # Link for Google Patents
     url = f'https://patents.google.com/patent/{patent_num}/en'
-    driver.get(url)
+    with metrics.timer("page_load", patent=patent_num):
+        driver.get(url)
 
     # Wait until the events section is loaded
-    try:
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, "//div[contains(@class, 'event')]"))
-        )
-    except Exception:
-        print("Warning: Could not verify event section loaded.")
+    with metrics.timer("page_wait", patent=patent_num):
+        try:
+            WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.XPATH, "//div[contains(@class, 'event')]"))
+            )
+        except TimeoutException:
+            metrics.count("timeouts_total", step="page_wait")
+            print("Warning: Could not verify event section loaded.")
+        except Exception:
+            print("Warning: Could not verify event section loaded.")
 
     # Extract a single text element
     def extract(xpath, label):
@@ -99,6 +122,7 @@ def get_patent_details(index, patent_num, driver, related_patents=None):
             el = driver.find_element(By.XPATH, xpath)
             return el.text.strip()
         except Exception:
+            metrics.count("not_found_total", field=label)
             return f"{label} not found"
 
     # Extract multiple claim texts
@@ -113,78 +137,423 @@ def get_patent_details(index, patent_num, driver, related_patents=None):
             return f"{label} not found"
 
     # Return all extracted data as a dictionary, extracting with Xpaths
-    return {
-        "index": index,
-        "patent_number": patent_num,
-        "link": driver.current_url,
-        "title": extract(
-            "//h1[@id='title' and contains(@class, 'scroll-target')"
-            " and contains(@class, 'style-scope') and contains(@class, 'patent-result')]",
-            "Title"
-        ),
-        "abstract": extract(
-            "//*[@id='text']//abstract/div"
-            "[contains(@class, 'abstract') and contains(@class, 'style-scope') and contains(@class, 'patent-text')]",
-            "Abstract"
-        ),
-        "status": extract(
-            "//div[contains(@class, 'event') and .//div[text()='Status']]//span[contains(@class, 'title-text')]",
-            "Status"
-        ),
-        "anticipated_expiration_date": extract(
-            "//div[contains(@class, 'event') and .//span[contains(text(),'Anticipated expiration')]]/div[contains(@class, 'legal-status')]",
-            "Anticipated expiration date"
-        ),
-        "adjusted_expiration_date": extract(
-            "//div[contains(@class, 'event') and .//span[contains(text(),'Adjusted expiration')]]/div[contains(@class, 'legal-status')]",
-            "Adjusted expiration date"
-        ),
-        "related_patents": related_patents or [],
-        "claims": extract_claims(
-            "//patent-text[@name='claims']//section[@id='text']/div[@class='claims style-scope patent-text']/div",
-            "Claim text"
-        )
-    }
-
-
-# Setup output directories
-family_data_dir = 'patent_family_data'
-status_data_dir = 'patent_status_data'
-os.makedirs(status_data_dir, exist_ok=True)
-
-# Load patent family data from JSON
-family_set_path = os.path.join(family_data_dir, 'patent_family_set.json')
-
-if not os.path.exists(family_set_path):
-    print("Error: patent_family_set.json not found.")
-    exit()
-
-with open(family_set_path, 'r', encoding='utf-8') as f:
-    family_set = json.load(f)
-
-# Detect default browser and proceed
-default_browser = get_default_browser()
-
-if default_browser:
-    print(f"Default browser detected: {default_browser}")
-    driver = create_webdriver(default_browser)
+    with metrics.timer("page_extract", patent=patent_num):
+        return {
+            "index": index,
+            "patent_number": patent_num,
+            "link": driver.current_url,
+            "title": extract(
+                "//h1[@id='title' and contains(@class, 'scroll-target')"
+                " and contains(@class, 'style-scope') and contains(@class, 'patent-result')]",
+                "Title"
+            ),
+            "abstract": extract(
+                "//*[@id='text']//abstract/div"
+                "[contains(@class, 'abstract') and contains(@class, 'style-scope') and contains(@class, 'patent-text')]",
+                "Abstract"
+            ),
+            "status": extract(
+                "//div[contains(@class, 'event') and .//div[text()='Status']]//span[contains(@class, 'title-text')]",
+                "Status"
+            ),
+            "anticipated_expiration_date": extract(
+                "//div[contains(@class, 'event') and .//span[contains(text(),'Anticipated expiration')]]/div[contains(@class, 'legal-status')]",
+                "Anticipated expiration date"
+            ),
+            "adjusted_expiration_date": extract(
+                "//div[contains(@class, 'event') and .//span[contains(text(),'Adjusted expiration')]]/div[contains(@class, 'legal-status')]",
+                "Adjusted expiration date"
+            ),
+            "related_patents": related_patents or [],
+            "claims": extract_claims(
+                "//patent-text[@name='claims']//section[@id='text']/div[@class='claims style-scope patent-text']/div",
+                "Claim text"
+            )
+        }
 
-    all_patent_data = []
 
-    # Process each patent in the family set
-    for idx, (main_patent, related_patents) in enumerate(family_set.items()):
+# Worker that scrapes patents from a shared queue with its own WebDriver, replacing the
+# driver after a fixed number of pages or after it crashes. Stops taking new patents once stop is set.
+def scrape_worker(work_queue, results, browser, limiter, pages_per_driver, stop):
+    driver = None
+    pages = 0
+
+    try:
+        while not stop.is_set():
+            try:
+                idx, main_patent, related_patents = work_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            # Retry once with a fresh driver if the current one fails
+            record = None
+            for attempt in range(2):
+                try:
+                    if driver is None or pages >= pages_per_driver:
+                        if driver is not None:
+                            driver.quit()
+                        driver = None
+                        driver = create_webdriver(browser)
+                        pages = 0
+
+                    limiter.wait()
+                    pages += 1
+                    with metrics.timer("browser_page", patent=main_patent):
+                        record = get_patent_details(idx, main_patent, driver, related_patents)
+                    break
+                except Exception as e:
+                    metrics.count("scrape_errors_total", backend="selenium")
+                    print(f"Error processing {main_patent}: {e}")
+                    if driver is not None:
+                        try:
+                            driver.quit()
+                        except Exception:
+                            pass
+                    driver = None
+
+            # Saving the result is not part of scraping: a failure here stops the pool instead of being retried
+            if record is not None:
+                results[idx] = record
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        if driver is not None:
+            driver.quit()
+
+
+# Scrape (index, patent, related patents) work items with a pool of WebDrivers,
+# storing each record in results under its index. On Ctrl-C, or if a worker fails to save a
+# result, the workers finish the pages they are loading and stop before this returns.
+def run_driver_pool(items, results, browser, workers, pages_per_driver, limiter):
+    work_queue = queue.Queue()
+    for item in items:
+        work_queue.put(item)
+    stop = threading.Event()
+    errors = []
+
+    def worker():
         try:
-            data = get_patent_details(idx, main_patent, driver, related_patents)
-            all_patent_data.append(data)
+            scrape_worker(work_queue, results, browser, limiter, pages_per_driver, stop)
         except Exception as e:
-            print(f"Error processing {main_patent}: {e}")
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, min(workers, len(items))))]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        print("Stopping after the pages being loaded...")
+        stop.set()
+        for thread in threads:
+            thread.join()
+        raise
+    if errors:
+        raise errors[0]
+
+
+# Scrape work items over plain HTTP with a shared keep-alive session, storing each record in
+# results under its index. Pages that could not be fetched are left out. Returns the work items
+# whose pages were fetched but could not be parsed.
+def run_http_pool(items, results, workers, limiter):
+    session = create_session(pool_size=workers)
+
+    def fetch(item):
+        idx, main_patent, related_patents = item
+        try:
+            with metrics.timer("http_page", patent=main_patent):
+                record = fetch_patent_details(idx, main_patent, session, related_patents, limiter)
+        except PatentParseError as e:
+            metrics.count("scrape_errors_total", backend="http", reason="parse")
+            print(f"Could not parse {main_patent} without a browser: {e}")
+            return item
+        except requests.RequestException as e:
+            metrics.count("scrape_errors_total", backend="http", reason="network")
+            print(f"[!] Could not fetch {main_patent}: {e}")
+            return None
+        results[idx] = record
+        return None
+
+    with session, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch, item) for item in items]
+        try:
+            return [item for item in (future.result() for future in futures) if item is not None]
+        except BaseException:
+            # On Ctrl-C, or a failure to save a result, finish the pages in flight but start no new ones
+            executor.shutdown(cancel_futures=True)
+            raise
+
+
+# Group the family set by canonical patent number so each distinct document is scraped once.
+# Returns the aliases of each canonical number and the (index, patent, related patents) work items.
+def plan_scrape(family_set):
+    aliases = group_aliases(family_set)
+    items = [(idx, patent, dedupe_patent_ids(p for alias in spellings for p in family_set[alias]))
+             for idx, (patent, spellings) in enumerate(aliases.items())]
+    return aliases, items
+
+
+# Scrape work items into results (any mapping from index to record). The "selenium" backend renders
+# every page in a pool of WebDrivers; the "http" backend parses the server-sent HTML and only falls
+# back to a browser for pages it could not parse. With lens (a LensRecords), patents whose saved Lens
+# records have every field are not scraped, and Lens fields replace the scraped ones for the rest
+# (apart from the expiration dates, see merge_lens_fields). Patents with a fresh record in the cache
+# are not scraped.
+def scrape_items(items, results, browser, workers=1, pages_per_driver=DEFAULT_PAGES_PER_DRIVER,
+                 requests_per_minute=None, backend="selenium", cache=None, lens=None):
+    if lens is not None:
+        items, results = enrich_items(items, results, lens)
+
+    if cache is not None:
+        remaining = []
+        for item in items:
+            idx, patent, related_patents = item
+            record = cache.get(patent)
+            if record is None:
+                remaining.append(item)
+            else:
+                metrics.count("cache_hits_total")
+                results[idx] = {**record, "index": idx, "related_patents": related_patents}
+        items = remaining
+        results = CachedResults(results, cache)
+
+    # A single limiter keeps the whole pool within the politeness limit
+    limiter = RateLimiter(requests_per_minute)
+
+    if backend == "http":
+        items = run_http_pool(items, results, workers, limiter)
+        if items:
+            print(f"Falling back to the browser for {len(items)} patent(s).")
+
+    if items:
+        if browser:
+            run_driver_pool(items, results, browser, workers, pages_per_driver, limiter)
+        else:
+            print(f"No browser available, skipping {len(items)} patent(s).")
+
+
+# Copy a scraped record to every alias of its document
+def fan_out(record, aliases):
+    patent = record["patent_number"]
+    return [record if alias == patent else {**record, "patent_number": alias} for alias in aliases[patent]]
+
+
+# Scrape every patent in the family set, keeping the results in memory.
+# Results are returned in the original index order.
+def scrape_patents(family_set, browser, workers=1, pages_per_driver=DEFAULT_PAGES_PER_DRIVER,
+                   requests_per_minute=None, backend="selenium", cache=None, lens=None):
+    aliases, items = plan_scrape(family_set)
+    results = {}
+    scrape_items(items, results, browser, workers, pages_per_driver, requests_per_minute, backend, cache, lens)
+
+    all_patent_data = []
+    for idx, _, _ in items:
+        if idx in results:
+            all_patent_data.extend(fan_out(results[idx], aliases))
+    return all_patent_data
+
+
+# Appends each scraped record to a JSON-lines checkpoint as soon as it finishes,
+# remembering only which indexes are done
+class CheckpointWriter:
+
+    def __init__(self, path, resume=False):
+        self.done = set()
+        self._lock = threading.Lock()
+        needs_newline = False
+        if resume and os.path.exists(path) and os.path.getsize(path):
+            # Start on a fresh line if the previous run died halfway through a record
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if needs_newline:
+            self.file.write("\n")
+
+    def __setitem__(self, idx, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+            self.done.add(idx)
+
+    def __contains__(self, idx):
+        return idx in self.done
+
+    def close(self):
+        self.file.close()
+
+
+# Index a checkpoint by patent number, mapping each completed patent to the byte offset of its
+# latest record. Lines left incomplete by a crash are ignored.
+def load_checkpoint(checkpoint_path):
+    offsets = {}
+    if not os.path.exists(checkpoint_path):
+        return offsets
+
+    with open(checkpoint_path, 'rb') as f:
+        offset = 0
+        for line in f:
+            try:
+                offsets[json.loads(line)["patent_number"]] = offset
+            except (ValueError, KeyError, TypeError):
+                pass
+            offset += len(line)
+    return offsets
+
+
+# Write the checkpoint out as the JSON array read by visualize_patents.py, one record at a time
+# and in the family set's order. Records are also saved to the patent store, if given.
+def compact_checkpoint(checkpoint_path, output_path, family_set, store=None):
+    aliases, items = plan_scrape(family_set)
+    offsets = load_checkpoint(checkpoint_path)
+    count = 0
+
+    with open(checkpoint_path, 'rb') as checkpoint, open(output_path + ".tmp", 'w', encoding='utf-8') as out:
+        out.write("[")
+        for idx, patent, related_patents in items:
+            if patent not in offsets:
+                continue
+            checkpoint.seek(offsets[patent])
+            record = {**json.loads(checkpoint.readline()), "index": idx, "related_patents": related_patents}
+            alias_records = fan_out(record, aliases)
+            for alias_record in alias_records:
+                text = json.dumps(alias_record, indent=2, ensure_ascii=False).replace("\n", "\n  ")
+                out.write(("," if count else "") + "\n  " + text)
+                count += 1
+            if store is not None:
+                store.save_status_records(alias_records)
+        out.write("\n]" if count else "]")
+    os.replace(output_path + ".tmp", output_path)
+    metrics.count("bytes_written_total", os.path.getsize(output_path), target="status")
+
+    return count
+
+
+# Scrape every patent in the family set, appending results to a checkpoint as they finish and
+# compacting it into output_path at the end. With resume, patents already in the checkpoint are skipped.
+def scrape_with_checkpoint(family_set, browser, checkpoint_path, output_path, resume=False, workers=1,
+                           pages_per_driver=DEFAULT_PAGES_PER_DRIVER, requests_per_minute=None, backend="selenium",
+                           cache=None, store=None, lens=None):
+    _, items = plan_scrape(family_set)
+    if resume:
+        completed = load_checkpoint(checkpoint_path)
+        items = [item for item in items if item[1] not in completed]
+        print(f"Resuming: {len(completed)} patent(s) already scraped, {len(items)} remaining.")
+
+    writer = CheckpointWriter(checkpoint_path, resume)
+    try:
+        scrape_items(items, writer, browser, workers, pages_per_driver, requests_per_minute, backend, cache,
+                     lens)
+    finally:
+        writer.close()
+
+    return compact_checkpoint(checkpoint_path, output_path, family_set, store)
 
-    # Save all results to JSON
+
+# Scrape only the given patents, and the family members of any given main patents, merging the new
+# records into the existing results. The checkpoint is seeded from output_path if it is missing, and
+# the new records are appended to it so they replace the older ones when it is compacted.
+def scrape_subset(family_set, patents, browser, checkpoint_path, output_path, workers=1,
+                  pages_per_driver=DEFAULT_PAGES_PER_DRIVER, requests_per_minute=None, backend="selenium",
+                  cache=None, store=None, lens=None):
+    if not os.path.exists(checkpoint_path) and os.path.exists(output_path):
+        with open(output_path, 'r', encoding='utf-8') as f, open(checkpoint_path, 'w', encoding='utf-8') as out:
+            for record in json.load(f):
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    wanted = set(dedupe_patent_ids(patents))
+    _, items = plan_scrape(family_set)
+    items = [item for item in items if item[1] in wanted or wanted.intersection(item[2])]
+    print(f"Scraping {len(items)} patent(s) of the {len(wanted)} requested.")
+
+    writer = CheckpointWriter(checkpoint_path, resume=True)
+    try:
+        scrape_items(items, writer, browser, workers, pages_per_driver, requests_per_minute, backend, cache,
+                     lens)
+    finally:
+        writer.close()
+
+    return compact_checkpoint(checkpoint_path, output_path, family_set, store)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape the status of every patent in the patent family graph")
+    parser.add_argument("--workers", type=int, default=1, help="number of browsers scraping in parallel")
+    parser.add_argument("--pages-per-driver", type=int, default=DEFAULT_PAGES_PER_DRIVER,
+                        help="number of pages a browser loads before it is restarted")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="maximum pages per minute loaded across all browsers")
+    parser.add_argument("--backend", choices=["selenium", "http"], default="selenium",
+                        help="render pages in a browser, or parse the server HTML and use the browser as a fallback")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip patents already saved in the checkpoint by an interrupted run")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="scrape every patent again instead of reusing fresh cached results")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_ENTRIES,
+                        help="maximum number of patents kept in the scrape cache")
+    parser.add_argument("--store", default=None,
+                        help="read the family set from this SQLite patent store and save the results to it")
+    parser.add_argument("--no-lens", action="store_true",
+                        help="scrape every field instead of filling them from the saved Lens records first")
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    # Setup output directories
+    family_data_dir = 'patent_family_data'
+    status_data_dir = 'patent_status_data'
+    os.makedirs(status_data_dir, exist_ok=True)
+
+    store = PatentStore(args.store) if args.store else None
+
+    # Load the patent family graph from the store or from JSON. The graph maps each member to its
+    # related main patents, so it is used as the family set directly.
+    if store is not None:
+        family_set = store.family_graph()
+        if not family_set:
+            print(f"Error: no patent families found in {args.store}.")
+            return
+    else:
+        family_set = load_family_graph(family_data_dir)
+        if family_set is None:
+            print(f"Error: neither {FAMILY_GRAPH_FILENAME} nor {FAMILY_SET_FILENAME} found.")
+            return
+    print(f"Loaded {family_set.summary()}.")
+
+    # Detect default browser and proceed
+    default_browser = get_default_browser()
+
+    if default_browser:
+        print(f"Default browser detected: {default_browser}")
+    elif args.backend == "http":
+        print("Unable to detect the default browser. Pages that fail to parse will be skipped.")
+    else:
+        print("Unable to detect the default browser. Exiting.")
+        return
+
+    # Results are appended to the checkpoint as they finish, then compacted into the JSON array
+    checkpoint_path = os.path.join(status_data_dir, 'patent_family_set_status.jsonl')
     final_output_path = os.path.join(status_data_dir, 'patent_family_set_status.json')
-    with open(final_output_path, 'w', encoding='utf-8') as f:
-        json.dump(all_patent_data, f, indent=2, ensure_ascii=False)
+    cache = None if args.no_cache else ScrapeCache(os.path.join(status_data_dir, 'scrape_cache.json'),
+                                                   args.cache_size)
+    lens = None if args.no_lens else LensRecords([LENS_DIR, MEMBER_DIR])
+    metrics.start_run("google_scraper", args.metrics_dir, args.profile)
+    try:
+        count = scrape_with_checkpoint(family_set, default_browser, checkpoint_path, final_output_path, args.resume,
+                                       args.workers, args.pages_per_driver, args.rate, args.backend, cache, store,
+                                       lens)
+    finally:
+        metrics.finish_run()
+        if cache is not None:
+            cache.save()
+            print(cache.summary())
+        if store is not None:
+            store.close()
+
+    print(f"\nSaved {count} result(s) to: {final_output_path}")
+
 
-    print(f"\nSaved all results to: {final_output_path}")
-    driver.quit()
-else:
-    print("Unable to detect the default browser. Exiting.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+import argparse
+import io
+import json
+import os
+import threading
+import time
+import zlib
+
+# Files of a response directory's archive. Like the retrieval manifest, their names start with "_" so
+# they are never mistaken for a response.
+ARCHIVE_INDEX = "_archive_index.jsonl"
+SEGMENT_PREFIX = "_segment_"
+SEGMENT_SUFFIX = ".bin"
+
+# Size at which a segment file is closed and the next one started
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# zlib compression level of each frame
+COMPRESSION_LEVEL = 6
+
+# Archives opened in this process, by directory
+open_archives = {}
+open_archives_lock = threading.Lock()
+
+
+def segment_name(segment):
+    return f"{SEGMENT_PREFIX}{segment:05d}{SEGMENT_SUFFIX}"
+
+
+def compress_json(value):
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+                         COMPRESSION_LEVEL)
+
+
+def decompress_json(frame):
+    return json.loads(zlib.decompress(frame))
+
+
+# Split a response into separately compressed frames: a shell with the response's own fields and the
+# field names of each record, then one frame per record field, in record and field order
+def encode_response(data):
+    records = data.get("data") if isinstance(data, dict) else None
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        return [compress_json({"response": data, "records": None})]
+    shell = {"response": {key: (None if key == "data" else value) for key, value in data.items()},
+             "records": [list(record) for record in records]}
+    return [compress_json(shell)] + [compress_json(value) for record in records for value in record.values()]
+
+
+# The response and its records decoded from a response's frames. With fields, each record only holds
+# those of its fields.
+def decode_response(frames, fields=None):
+    shell = decompress_json(frames[0])
+    if shell["records"] is None:
+        data = shell["response"].get("data") if isinstance(shell["response"], dict) else None
+        return shell["response"], data if isinstance(data, list) else []
+    records, frame = [], 1
+    for keys in shell["records"]:
+        records.append({key: decompress_json(frames[frame + position]) for position, key in enumerate(keys)
+                        if fields is None or key in fields})
+        frame += len(keys)
+    return {key: (records if key == "data" else value) for key, value in shell["response"].items()}, records
+
+
+# Compressed, seekable store of the Lens responses of one directory, appended to segment files. Each
+# field of each record is compressed on its own, so a reader that needs only some fields (the extended
+# family, or the citations) decompresses and decodes only those. The index holds one JSON line per write
+# with the patent number, segment, offset and frame sizes, so reading a response takes one seek and one
+# read. Later lines replace earlier ones for the same patent; compact() drops the responses they replaced.
+class LensArchive:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, ARCHIVE_INDEX)
+        self.entries = {}
+        self.index_size = 0
+        self.lock = threading.Lock()
+        self.reload()
+
+    # Read the index again, e.g. after another process wrote to the archive
+    def reload(self):
+        entries = {}
+        with open(self.index_path, "rb") as f:
+            for line in f:
+                # A line cut short by an interrupted write is ignored, whether it is still the last line or
+                # a later write has been appended after it
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry["patent"]] = (entry["segment"], entry["offset"], entry["frames"])
+            self.index_size = f.tell()
+        self.entries = entries
+        segments = segment_files(self.directory)
+        self.segment = int(segments[-1][len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) if segments else 0
+
+    def __contains__(self, patent):
+        return patent in self.entries
+
+    def __iter__(self):
+        return iter(sorted(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Compressed size of a patent's response
+    def size(self, patent):
+        return sum(self.entries[patent][2])
+
+    # The compressed frames of a patent's response
+    def read_frames(self, patent):
+        segment, offset, sizes = self.entries[patent]
+        with open(os.path.join(self.directory, segment_name(segment)), "rb") as f:
+            f.seek(offset)
+            blob = f.read(sum(sizes))
+        frames, position = [], 0
+        for size in sizes:
+            frames.append(blob[position:position + size])
+            position += size
+        return frames
+
+    # The records of a patent's response. With fields, each record only holds those of its fields.
+    def records(self, patent, fields=None):
+        return decode_response(self.read_frames(patent), fields)[1]
+
+    def get(self, patent):
+        return decode_response(self.read_frames(patent))[0]
+
+    # Add or replace a patent's response. Returns the number of bytes written.
+    def put(self, patent, data):
+        frames = encode_response(data)
+        blob = b"".join(frames)
+        with self.lock:
+            path = os.path.join(self.directory, segment_name(self.segment))
+            if os.path.exists(path) and os.path.getsize(path) + len(blob) > SEGMENT_SIZE:
+                self.segment += 1
+                path = os.path.join(self.directory, segment_name(self.segment))
+            segment = self.segment
+            with open(path, "ab") as f:
+                offset = f.tell()
+                f.write(blob)
+            # The response is on disk before the index points to it
+            sizes = [len(frame) for frame in frames]
+            line = json.dumps({"patent": patent, "segment": segment, "offset": offset, "frames": sizes})
+            with open(self.index_path, "a+b") as f:
+                # Start on a new line if an interrupted write left the last one unfinished
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = "\n" + line
+                f.write(line.encode("utf-8") + b"\n")
+                self.index_size = f.tell()
+            self.entries[patent] = (segment, offset, sizes)
+        return len(blob)
+
+    # Rewrite the archive with only the latest response of each patent. The live responses are copied
+    # into new segments numbered after the current ones, and the old segments are only removed once the
+    # new index has replaced the old one, so an interrupted compaction leaves a readable archive.
+    def compact(self):
+        with self.lock:
+            old_segments = segment_files(self.directory)
+            entries = {}
+            segment, out = self.segment + 1, None
+            try:
+                for patent in sorted(self.entries):
+                    blob = b"".join(self.read_frames(patent))
+                    if out is not None and out.tell() + len(blob) > SEGMENT_SIZE:
+                        out.close()
+                        segment, out = segment + 1, None
+                    if out is None:
+                        out = open(os.path.join(self.directory, segment_name(segment)), "wb")
+                    entries[patent] = (segment, out.tell(), self.entries[patent][2])
+                    out.write(blob)
+            finally:
+                if out is not None:
+                    out.close()
+
+            with open(self.index_path + ".tmp", "w", encoding="utf-8") as f:
+                for patent, (segment_id, offset, sizes) in entries.items():
+                    f.write(json.dumps({"patent": patent, "segment": segment_id, "offset": offset,
+                                        "frames": sizes}) + "\n")
+            os.replace(self.index_path + ".tmp", self.index_path)
+            for filename in old_segments:
+                os.remove(os.path.join(self.directory, filename))
+            self.reload()
+
+    # Bytes on disk taken by the segments and index
+    def disk_size(self):
+        return sum(os.path.getsize(os.path.join(self.directory, filename))
+                   for filename in segment_files(self.directory) + [ARCHIVE_INDEX])
+
+
+def segment_files(directory):
+    return sorted(filename for filename in os.listdir(directory)
+                  if filename.startswith(SEGMENT_PREFIX) and filename.endswith(SEGMENT_SUFFIX))
+
+
+# The archive of a response directory, or None if the directory has none. Archives are opened once per
+# process and read again when another process has written to them.
+def open_archive(directory):
+    index_path = os.path.join(directory, ARCHIVE_INDEX)
+    if not os.path.exists(index_path):
+        return None
+    key = os.path.abspath(directory)
+    with open_archives_lock:
+        archive = open_archives.get(key)
+        if archive is None:
+            archive = open_archives[key] = LensArchive(directory)
+        elif os.path.getsize(index_path) != archive.index_size:
+            archive.reload()
+    return archive
+
+
+# A saved response is found by the path of its JSON file (<directory>/<patent>.json). The file is used if
+# it exists; otherwise the response is read from the directory's archive.
+def response_key(path):
+    return os.path.dirname(path) or ".", os.path.splitext(os.path.basename(path))[0]
+
+
+# The archive holding a response that has no JSON file, and the response's patent number
+def find_archived(path):
+    directory, patent = response_key(path)
+    archive = open_archive(directory)
+    if archive is None or patent not in archive:
+        raise FileNotFoundError(path)
+    return archive, patent
+
+
+def response_exists(path):
+    if os.path.exists(path):
+        return True
+    directory, patent = response_key(path)
+    archive = open_archive(directory)
+    return archive is not None and patent in archive
+
+
+# Open a saved response as a text file
+def open_response(path):
+    if os.path.exists(path):
+        return open(path, "r", encoding="utf-8")
+    archive, patent = find_archived(path)
+    return io.StringIO(json.dumps(archive.get(patent), ensure_ascii=False, separators=(",", ":")))
+
+
+def load_response(path):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    archive, patent = find_archived(path)
+    return archive.get(patent)
+
+
+# The records of a saved response. Records read from an archive only hold the given fields.
+def load_records(path, fields=None):
+    records = archived_records(path, fields)
+    if records is None:
+        records = load_response(path).get("data") or []
+    return records
+
+
+# The records of an archived response, holding only the given fields, or None if the response is a
+# JSON file. Lets readers of a few fields skip the rest of an archived response, while still streaming
+# files.
+def archived_records(path, fields=None):
+    if os.path.exists(path):
+        return None
+    archive, patent = find_archived(path)
+    return archive.records(patent, fields)
+
+
+# Bytes read from disk for a saved response
+def response_size(path):
+    if os.path.exists(path):
+        return os.path.getsize(path)
+    archive, patent = find_archived(path)
+    return archive.size(patent)
+
+
+# Paths of every saved response in a directory, as files or in its archive, in patent order
+def response_paths(directory):
+    patents = set()
+    if os.path.isdir(directory):
+        patents.update(os.path.splitext(filename)[0] for filename in os.listdir(directory)
+                       if filename.endswith(".json") and not filename.startswith("_"))
+        archive = open_archive(directory)
+        if archive is not None:
+            patents.update(archive)
+    return [os.path.join(directory, f"{patent}.json") for patent in sorted(patents)]
+
+
+# Save a response in its directory: into the archive if the directory has one, replacing any JSON file
+# of the patent, or as an indented JSON file otherwise. Returns the number of bytes written.
+def save_response(directory, patent, data):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{patent}.json")
+    archive = open_archive(directory)
+    if archive is not None:
+        size = archive.put(patent, data)
+        if os.path.exists(path):
+            os.remove(path)
+        return size
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4)
+        return f.tell()
+
+
+# Create an empty archive in a directory, or open the one already there
+def create_archive(directory):
+    os.makedirs(directory, exist_ok=True)
+    index_path = os.path.join(directory, ARCHIVE_INDEX)
+    if not os.path.exists(index_path):
+        open(index_path, "a").close()
+    return open_archive(directory)
+
+
+# Move every JSON response of a directory into its archive, creating the archive if needed.
+# Returns the number of responses moved.
+def pack(directory):
+    archive = create_archive(directory)
+    moved = replaced = 0
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".json") and not filename.startswith("_"):
+            path = os.path.join(directory, filename)
+            patent = os.path.splitext(filename)[0]
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            replaced += patent in archive
+            archive.put(patent, data)
+            # Only remove the file once its response reads back unchanged
+            if archive.get(patent) != data:
+                raise ValueError(f"{path} did not read back from the archive unchanged")
+            os.remove(path)
+            moved += 1
+    if replaced:
+        archive.compact()
+    return moved
+
+
+# Write every archived response of a directory back to an indented JSON file, as the retrieval script
+# writes them, and remove the archive. Returns the number of responses written.
+def unpack(directory):
+    archive = open_archive(directory)
+    if archive is None:
+        return 0
+    for patent in archive:
+        with open(os.path.join(directory, f"{patent}.json"), "w", encoding="utf-8") as f:
+            json.dump(archive.get(patent), f, indent=4)
+    for filename in segment_files(directory) + [ARCHIVE_INDEX]:
+        os.remove(os.path.join(directory, filename))
+    open_archives.pop(os.path.abspath(directory), None)
+    return len(archive)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a directory of saved Lens responses to or from a compressed archive")
+    parser.add_argument("command", choices=["pack", "unpack", "compact", "stats"])
+    parser.add_argument("directories", nargs="*", default=["data_Lens"], help="directories of saved responses")
+    args = parser.parse_args()
+
+    for directory in args.directories:
+        if not os.path.isdir(directory):
+            print(f"[!] No directory {directory}")
+            continue
+        json_size = sum(os.path.getsize(os.path.join(directory, filename)) for filename in os.listdir(directory)
+                        if filename.endswith(".json") and not filename.startswith("_"))
+        if args.command == "pack":
+            count = pack(directory)
+            archive = open_archive(directory)
+            print(f"[✓] Packed {count} response(s) of {directory}: {json_size} bytes of JSON "
+                  f"into {archive.disk_size()} bytes.")
+        elif args.command == "unpack":
+            count = unpack(directory)
+            print(f"[✓] Unpacked {count} response(s) of {directory}.")
+        else:
+            archive = open_archive(directory)
+            if archive is None:
+                print(f"[!] {directory} has no archive")
+                continue
+            if args.command == "compact":
+                before = archive.disk_size()
+                archive.compact()
+                print(f"[✓] Compacted {directory} from {before} to {archive.disk_size()} bytes.")
+            else:
+                start = time.perf_counter()
+                for patent in archive:
+                    archive.get(patent)
+                elapsed = time.perf_counter() - start
+                print(f"{directory}: {len(archive)} archived response(s) in {archive.disk_size()} bytes, "
+                      f"read in {elapsed:.3f}s; {json_size} bytes of JSON files.")
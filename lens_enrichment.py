@@ -0,0 +1,291 @@
+import argparse
+import os
+import re
+from collections import Counter
+from datetime import date, timedelta
+
+import metrics
+from family_graph import load_family_graph
+from lens_archive import load_records, response_paths
+from patent_ids import normalize_patent_id
+from patent_retrieval_Lens import DEFAULT_REQUESTS_PER_MINUTE, api_key, process_patent_numbers
+
+# Lens responses of the main patents, and of the family members fetched for enrichment
+LENS_DIR = "data_Lens"
+MEMBER_DIR = "data_Lens_members"
+
+# Patent numbers per Lens search request when fetching family members
+DEFAULT_BATCH_SIZE = 100
+
+# Lens patent statuses and the Google Patents wording used in the status records. Statuses Lens
+# cannot determine (UNKNOWN, or PATENTED without a known legal state) are left to the scraper.
+LENS_STATUSES = {
+    "ACTIVE": "Active",
+    "PENDING": "Pending",
+    "EXPIRED": "Expired",
+    "INACTIVE": "Ceased",
+    "DISCONTINUED": "Abandoned",
+}
+
+# Fields a record needs before the Google Patents page can be skipped
+REQUIRED_FIELDS = ("title", "abstract", "status", "claims")
+
+# Expiration dates derived from Lens's term calculation. They are estimates (Google Patents can differ by
+# a few days), so a scraped page's dates are kept over them; they only fill records that are not scraped.
+ESTIMATED_FIELDS = ("anticipated_expiration_date", "adjusted_expiration_date")
+
+# Fields of a Lens record read by lens_fields; archived responses only have these decoded
+RECORD_FIELDS = ("date_published", "jurisdiction", "kind", "biblio", "abstract", "claims", "legal_status")
+
+# Spaces Lens leaves before punctuation, e.g. "according to claim 1 , wherein"
+SPACE_BEFORE_PUNCTUATION = re.compile(r"\s+([,;:.])")
+# Lens runs the elements of a claim together; Google Patents starts a new line after each ":" or ";"
+# (keeping a trailing "and"/"or" on the line it ends)
+CLAIM_ELEMENT_BREAK = re.compile(r"([:;](?: and| or)?) +")
+CLAIM_NUMBER = re.compile(r"^\s*(\d+)\s*\.")
+TERM_EXTENSION = re.compile(r"Applied \d+ days? term extension")
+
+# US design patents filed on or after this date run 15 years from grant instead of 14
+DESIGN_TERM_CHANGE = "2015-05-13"
+
+
+# The English text of a list of {"text", "lang"} entries, or None
+def english_text(entries):
+    for entry in entries or []:
+        if entry.get("lang") == "en" and entry.get("text", "").strip():
+            return entry["text"].strip()
+    return None
+
+
+# Format Lens claims like the scraped ones ("1. An apparatus ..."), one string per claim with one line per
+# claim element, so they parse with build_claim_tree. Only English claims are used.
+def format_claims(claim_sets):
+    for claim_set in claim_sets or []:
+        if claim_set.get("lang") != "en":
+            continue
+        claims = []
+        for number, claim in enumerate(claim_set.get("claims", []), 1):
+            text = "\n".join(part.strip() for part in claim.get("claim_text", []) if part.strip())
+            text = SPACE_BEFORE_PUNCTUATION.sub(r"\1", text)
+            text = CLAIM_ELEMENT_BREAK.sub(r"\1\n", text)
+            if not text:
+                continue
+            if not CLAIM_NUMBER.match(text):
+                text = f"{number}. {text}"
+            claims.append(text)
+        if claims:
+            return claims
+    return None
+
+
+def add_years(iso_date, years):
+    day = date.fromisoformat(iso_date)
+    try:
+        return day.replace(year=day.year + years).isoformat()
+    except ValueError:
+        # 29 February in a year without one
+        return (day.replace(day=28, year=day.year + years)).isoformat()
+
+
+# Estimate when a granted patent expires when Lens gives no anticipated term date: 20 years from the
+# application date for utility patents, and 14 or 15 years from grant for US design patents
+def estimate_expiration(record):
+    legal = record.get("legal_status") or {}
+    if not legal.get("granted"):
+        return None
+    filed = ((record.get("biblio") or {}).get("application_reference") or {}).get("date")
+    if record.get("jurisdiction") == "US" and record.get("kind") == "S":
+        grant_date = legal.get("grant_date")
+        if not grant_date or not filed:
+            return None
+        return add_years(grant_date, 15 if filed >= DESIGN_TERM_CHANGE else 14)
+    return add_years(filed, 20) if filed else None
+
+
+# Anticipated and adjusted expiration dates of a record. Lens's anticipated term date includes any
+# term extension, which Google Patents reports as the adjusted expiration date.
+def lens_expiration(record):
+    legal = record.get("legal_status") or {}
+    term_date = legal.get("anticipated_term_date")
+    if term_date:
+        if any(TERM_EXTENSION.search(line) for line in legal.get("calculation_log", [])):
+            return None, term_date
+        return term_date, None
+    return estimate_expiration(record), None
+
+
+# Status record fields found in a patent's Lens records, newest publication first. Each field comes from
+# the newest record that has it; fields Lens lacks are left out.
+def lens_fields(records):
+    fields = {}
+    for record in sorted(records, key=lambda r: r.get("date_published", ""), reverse=True):
+        biblio = record.get("biblio") or {}
+        status = LENS_STATUSES.get((record.get("legal_status") or {}).get("patent_status"))
+        anticipated, adjusted = lens_expiration(record)
+        found = {
+            "title": english_text(biblio.get("invention_title")),
+            "abstract": english_text(record.get("abstract")),
+            "status": status,
+            "claims": format_claims(record.get("claims")),
+        }
+        if anticipated or adjusted:
+            found["anticipated_expiration_date"] = anticipated or "Anticipated expiration date not found"
+            found["adjusted_expiration_date"] = adjusted or "Adjusted expiration date not found"
+        for key, value in found.items():
+            if value and key not in fields:
+                fields[key] = value
+    return fields
+
+
+def missing_fields(fields):
+    return [field for field in REQUIRED_FIELDS if field not in fields]
+
+
+# Build a full status record from Lens fields, in the shape get_patent_details returns
+def lens_status_record(index, patent_num, fields, related_patents=None):
+    return {
+        "index": index,
+        "patent_number": patent_num,
+        "link": f"https://patents.google.com/patent/{patent_num}/en",
+        "title": fields.get("title", "Title not found"),
+        "abstract": fields.get("abstract", "Abstract not found"),
+        "status": fields.get("status", "Status not found"),
+        "anticipated_expiration_date": fields.get("anticipated_expiration_date",
+                                                  "Anticipated expiration date not found"),
+        "adjusted_expiration_date": fields.get("adjusted_expiration_date", "Adjusted expiration date not found"),
+        "related_patents": related_patents or [],
+        "claims": fields.get("claims", []),
+    }
+
+
+# Saved Lens responses, found by canonical patent number across several directories
+class LensRecords:
+
+    def __init__(self, directories=(LENS_DIR, MEMBER_DIR)):
+        self.paths = {}
+        for directory in directories:
+            for path in response_paths(directory):
+                patent = normalize_patent_id(os.path.splitext(os.path.basename(path))[0])
+                self.paths.setdefault(patent, []).append(path)
+
+    def __contains__(self, patent):
+        return normalize_patent_id(patent) in self.paths
+
+    # Status record fields Lens has for a patent ({} if it has no saved response)
+    def fields(self, patent):
+        records = []
+        for path in self.paths.get(normalize_patent_id(patent), []):
+            try:
+                records.extend(load_records(path, RECORD_FIELDS))
+            except (OSError, ValueError):
+                print(f"Failed to read {path}")
+        return lens_fields(records)
+
+
+# A scraped record with the fields Lens has for the patent. Scraped values are kept for the fields Lens
+# lacks, and for the estimated expiration dates unless the page had neither date.
+def merge_lens_fields(record, fields):
+    if any(not record.get(field, "").endswith("not found") for field in ESTIMATED_FIELDS):
+        fields = {key: value for key, value in fields.items() if key not in ESTIMATED_FIELDS}
+    return {**record, **fields}
+
+
+# Wraps a results mapping so every scraped record stored in it is merged with the fields Lens has for
+# the patent
+class LensMergedResults:
+
+    def __init__(self, results, fields):
+        self.results = results
+        self.fields = fields
+
+    def __setitem__(self, idx, record):
+        self.results[idx] = merge_lens_fields(record, self.fields.get(record["patent_number"], {}))
+
+    def __contains__(self, idx):
+        return idx in self.results
+
+
+# Fill status records from Lens for (index, patent, related patents) work items. Records with every
+# required field are stored in results right away; returns the items still to be scraped, and results
+# wrapped so the scraped records of those items are merged with their Lens fields.
+def enrich_items(items, results, lens):
+    remaining, partial = [], {}
+    for item in items:
+        idx, patent, related_patents = item
+        fields = lens.fields(patent)
+        if fields and not missing_fields(fields):
+            metrics.count("lens_records_total", source="complete")
+            results[idx] = lens_status_record(idx, patent, fields, related_patents)
+            continue
+        if fields:
+            metrics.count("lens_records_total", source="partial")
+            partial[patent] = fields
+        else:
+            metrics.count("lens_records_total", source="missing")
+        remaining.append(item)
+    if items:
+        print(f"Filled {len(items) - len(remaining)} of {len(items)} patent(s) from Lens, "
+              f"{len(remaining)} left to scrape.")
+    return remaining, LensMergedResults(results, partial)
+
+
+# Fetch the Lens records of family members that have no saved response, in batched searches
+def fetch_member_records(family_set, directory=MEMBER_DIR, workers=4, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                         batch_size=DEFAULT_BATCH_SIZE, max_age=None, patents=None):
+    mains = LensRecords([LENS_DIR])
+    members = [patent for patent in dict.fromkeys(normalize_patent_id(p) for p in family_set)
+               if patent not in mains]
+    if patents is not None:
+        wanted = {normalize_patent_id(patent) for patent in patents}
+        members = [patent for patent in members if patent in wanted]
+    print(f"Fetching Lens records for {len(members)} family member(s).")
+    process_patent_numbers(members, directory, workers, requests_per_minute, batch_size=batch_size, max_age=max_age)
+
+
+# Count how many family members Lens can fill completely, and which fields the others lack
+def coverage(family_set, lens):
+    patents = list(dict.fromkeys(normalize_patent_id(p) for p in family_set))
+    missing = Counter()
+    complete = 0
+    for patent in patents:
+        fields = missing_fields(lens.fields(patent))
+        complete += not fields
+        missing.update(fields)
+    return len(patents), complete, missing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fetch Lens records for every family member, so scraping only fills the fields Lens lacks")
+    parser.add_argument("--fetch", action="store_true", help="fetch missing member records from Lens first")
+    parser.add_argument("--family-dir", default="patent_family_data", help="directory with the family graph")
+    parser.add_argument("--output", default=MEMBER_DIR, help="directory to save the member records in")
+    parser.add_argument("--workers", type=int, default=4, help="number of concurrent requests")
+    parser.add_argument("--rate", type=float, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help="maximum requests per minute sent to Lens")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="patent numbers per Lens search request")
+    parser.add_argument("--max-age", type=float, default=None,
+                        help="skip members fetched successfully within this many hours")
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    family_set = load_family_graph(args.family_dir)
+    if family_set is None:
+        print(f"[!] No family graph found in {args.family_dir}")
+    else:
+        metrics.start_run("lens_enrichment", args.metrics_dir, args.profile)
+        try:
+            if args.fetch:
+                if not api_key:
+                    print("[!] No API_KEY set, using the saved Lens records.")
+                else:
+                    max_age = timedelta(hours=args.max_age) if args.max_age is not None else None
+                    fetch_member_records(family_set, args.output, args.workers, args.rate, args.batch_size,
+                                         max_age)
+            total, complete, missing = coverage(family_set, LensRecords([LENS_DIR, args.output]))
+            print(f"[✓] Lens fills {complete} of {total} patent(s) completely.")
+            for field, count in missing.most_common():
+                print(f"  {count} patent(s) lack {field}")
+        finally:
+            metrics.finish_run()
@@ -0,0 +1,221 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Default directory for the JSON logs, Prometheus files and profiles written by each run
+DEFAULT_METRICS_DIR = "metrics"
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+# Key of a metric: its name and sorted label pairs. Label values are stored as text, as Prometheus reads
+# them, so keys whose values were given as numbers and as strings (e.g. reason=503 and reason="timeout")
+# still sort together.
+def metric_key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+# Escape a label value for the Prometheus text format
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Format a metric key as a Prometheus series, e.g. item_seconds_bucket{stage="scrape",le="0.5"}
+def series(name, labels, suffix="", extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return name + suffix
+    label_text = ",".join(f'{k}="{escape_label(v)}"' for k, v in pairs)
+    return f"{name}{suffix}{{{label_text}}}"
+
+
+# Counters and latency histograms for one run of a pipeline stage, with an optional JSON-lines log.
+# All methods are thread-safe.
+class Metrics:
+
+    def __init__(self, stage="pipeline", log_path=None):
+        self.stage = stage
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._log = open(log_path, 'a', encoding='utf-8') if log_path else None
+
+    # Add to a counter, e.g. count("retries_total", reason="429")
+    def count(self, name, amount=1, **labels):
+        key = metric_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    # Record a latency in seconds in a histogram
+    def observe(self, name, seconds, **labels):
+        key = metric_key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+                    break
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    # Time the body of a with block into item_seconds{step=...}, logging it with any extra fields
+    @contextmanager
+    def timer(self, step, **fields):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("item_seconds", elapsed, step=step)
+            self.log("item", step=step, seconds=round(elapsed, 6), **fields)
+
+    # Write one structured event to the JSON log
+    def log(self, event, **fields):
+        if self._log is None:
+            return
+        line = json.dumps({"ts": round(time.time(), 3), "run": self.run_id, "stage": self.stage, "event": event,
+                           **fields}, ensure_ascii=False, default=str)
+        with self._lock:
+            self._log.write(line + "\n")
+
+    # Render every metric in the Prometheus text exposition format, labelled with the stage
+    def prometheus_text(self):
+        lines = []
+        stage = (("stage", self.stage),)
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{series(name, stage + labels)} {value}")
+
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                cumulative += bucket
+                lines.append(f"{series(name, stage + labels, '_bucket', [('le', bound)])} {cumulative}")
+            lines.append(f"{series(name, stage + labels, '_bucket', [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{series(name, stage + labels, '_sum')} {histogram['sum']:.6f}")
+            lines.append(f"{series(name, stage + labels, '_count')} {histogram['count']}")
+
+        lines.append("# TYPE run_duration_seconds gauge")
+        lines.append(f"{series('run_duration_seconds', stage)} {time.time() - self.started:.3f}")
+        return "\n".join(lines) + "\n"
+
+    # Write the Prometheus text file, replacing the previous run's file atomically
+    def write_prometheus(self, path):
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(path + ".tmp", path)
+
+    # One line per timed step (count, mean and total seconds) followed by the counters
+    def summary(self):
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        lines = []
+        for (name, labels), h in histograms:
+            label = ",".join(f"{k}={v}" for k, v in labels)
+            lines.append(f"  {name}[{label}]: {h['count']} x {h['sum'] / h['count'] * 1000:.1f} ms "
+                         f"= {h['sum']:.2f} s")
+        for (name, labels), value in counters:
+            label = ",".join(f"{k}={v}" for k, v in labels)
+            lines.append(f"  {name}[{label}]: {value}")
+        return "\n".join(lines)
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+# Metrics of the current run. Until start_run is called, metrics are collected in memory and discarded.
+_current = Metrics()
+_profiler = None
+_metrics_dir = None
+
+
+def current():
+    return _current
+
+
+def count(name, amount=1, **labels):
+    _current.count(name, amount, **labels)
+
+
+def observe(name, seconds, **labels):
+    _current.observe(name, seconds, **labels)
+
+
+def timer(step, **fields):
+    return _current.timer(step, **fields)
+
+
+def log(event, **fields):
+    _current.log(event, **fields)
+
+
+# Add the --metrics-dir and --profile options shared by the pipeline scripts
+def add_metrics_arguments(parser):
+    parser.add_argument("--metrics-dir", default=DEFAULT_METRICS_DIR,
+                        help="directory for the run's JSON log and Prometheus metrics ('' to disable)")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the run with cProfile and save the stats to the metrics directory")
+
+
+# Start collecting metrics for a stage. Events are appended to <metrics_dir>/<stage>.jsonl; with profile,
+# the calling thread is profiled with cProfile until finish_run.
+def start_run(stage, metrics_dir=DEFAULT_METRICS_DIR, profile=False):
+    global _current, _profiler, _metrics_dir
+    _current.close()
+    _metrics_dir = metrics_dir or None
+    log_path = None
+    if _metrics_dir:
+        os.makedirs(_metrics_dir, exist_ok=True)
+        log_path = os.path.join(_metrics_dir, f"{stage}.jsonl")
+    _current = Metrics(stage, log_path)
+    _current.log("start")
+    if profile:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    return _current
+
+
+# Finish the current run: write <stage>.prom (and <stage>.prof when profiling) and print a summary
+def finish_run():
+    global _profiler
+    metrics = _current
+    if _profiler is not None:
+        _profiler.disable()
+        if _metrics_dir:
+            profile_path = os.path.join(_metrics_dir, f"{metrics.stage}.prof")
+            _profiler.dump_stats(profile_path)
+            print(f"[✓] Saved profile to {profile_path} (view with: python -m pstats {profile_path})")
+        _profiler = None
+
+    counters = {series(name, labels): value for (name, labels), value in sorted(metrics.counters.items())}
+    metrics.log("finish", seconds=round(time.time() - metrics.started, 3), counters=counters)
+    if _metrics_dir:
+        prom_path = os.path.join(_metrics_dir, f"{metrics.stage}.prom")
+        metrics.write_prometheus(prom_path)
+        print(f"[✓] Saved metrics to {prom_path}")
+    summary = metrics.summary()
+    if summary:
+        print(f"Run metrics for {metrics.stage}:\n{summary}")
+    metrics.close()
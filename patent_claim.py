@@ -1,6 +1,8 @@
 import re
 import json
 import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 # from google_scraper import get_default_browser, create_webdriver, get_patent_details
 
@@ -9,75 +11,283 @@ load_dotenv()
 api_key = os.getenv("API_KEY")
 # create a claimnode class 
 class ClaimNode:
+    # slots keep each node to four fields with no per-instance __dict__
+    __slots__ = ("number", "text", "children", "parents")
 
     def __init__(self, number, text):
         self.number = number
         self.text = text
         self.children = []
+        self.parents = []
 
+    ## only list the children's numbers so large subtrees are not dumped recursively
     def __repr__(self):
-        return f"ClaimNode: {self.number}, text: {self.text}, children: {self.children}"
+        return f"ClaimNode: {self.number}, text: {self.text}, children: {[c.number for c in self.children]}"
 
     def add_child(self, child):
         self.children.append(child)
+        child.parents.append(self.number)
+
+    ## iterate over (level, node, parent) from the node downwards, depth first, without recursion. A claim
+    ## depending on several claims is a child of each of them, but is only visited under the lowest of them
+    ## (by default, the lowest within this subtree), so shared subtrees are not repeated.
+    def walk(self, level=0, lowest=None):
+        if lowest is None:
+            lowest = {self.number: None}
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                for child in node.children:
+                    if child.number not in lowest:
+                        lowest[child.number] = node.number
+                        stack.append(child)
+                    elif node.number < lowest[child.number]:
+                        lowest[child.number] = node.number
+
+        stack = [(level, self, None)]
+        while stack:
+            level, node, parent = stack.pop()
+            yield level, node, parent
+            stack.extend((level + 1, child, node) for child in reversed(node.children)
+                         if lowest[child.number] == node.number)
+
+    ## yield the lines of the tree from the node downwards. A claim shown under one of its parents notes
+    ## the other claims it depends on.
+    def iter_lines(self, level=0, lowest=None):
+        for depth, node, parent in self.walk(level, lowest):
+            others = [number for number in node.parents if number != parent.number] if parent else []
+            note = f" (also depends on {format_claim_numbers(others)})" if others else ""
+            yield f"{'  ' * depth}- Claim {node.number}{note}: {node.text}\n"
+
+    ## write the tree from the node downwards to a file-like object
+    def write_tree(self, file, level=0):
+        file.writelines(self.iter_lines(level))
 
     ## print tree from the node downwards
     def print_tree(self, level=0):
-        indent = "  " * level
-        output = f"{indent}- Claim {self.number}: {self.text}\n"
-        for child in self.children:
-            output += child.print_tree(level + 1)
-        return output
-    
-# returns a list containing first claim reference number
-def find_claim_references(claim_text:str) -> list:
+        return "".join(self.iter_lines(level))
+
+
+# the root claims of a patent, with every node indexed by claim number
+class ClaimTree(list):
+    __slots__ = ("nodes",)
+
+    def __init__(self, roots=(), nodes=None):
+        super().__init__(roots)
+        self.nodes = nodes if nodes is not None else {}
+
+    ## look up a node by claim number
+    def node(self, number):
+        return self.nodes.get(number)
+
+    ## yield the lines of every root's tree, each tree preceded by a blank line. Each claim is shown once,
+    ## under the lowest claim it depends on, even if it depends on claims in several trees.
+    def iter_lines(self):
+        lowest = {number: min(node.parents, default=None) for number, node in self.nodes.items()}
+        for root in self:
+            yield "\n"
+            yield from root.iter_lines(lowest=lowest)
+
+    ## write every tree to a file-like object
+    def write(self, file):
+        file.writelines(self.iter_lines())
+
+    ## render every tree as a single string
+    def render(self):
+        return "".join(self.iter_lines())
+
+# Claim number at the start of a claim, e.g. "12. A device ..."
+CLAIM_NUMBER = re.compile(r"(\d+)\.\s+")
+
+# A single claim number or a range such as "1-5" or "1 to 5"
+CLAIM_RANGE = re.compile(r"(\d+)(?:\s*(?:-|–|to|through)\s*(\d+))?")
+
+# A claim number or range inside a reference. Each whitespace run can only be matched one way, so long
+# runs of spaces do not make the pattern backtrack.
+CLAIM_ITEM = r"\d+(?:\s*[-–]\s*\d+|\s+(?:to|through)\s+\d+)?"
+
+# Separator between the items of a list of claims: a comma, "and"/"or", or both
+CLAIM_SEPARATOR = r"(?:\s*,\s*(?:(?:and|or)\s+)?|\s+(?:and|or)\s+)"
+
+# What may follow an item after a separator: the end of the text, punctuation, or a word that carries on
+# the claim. Keeps quantities such as "claim 1, and 3 arms" out of the list.
+CLAIM_LIST_END = r"\b(?=\s*(?:$|[^\sa-z]|(?:and|or|wherein|further|in|which|characteri[sz]ed)\b))"
+
+# A reference to one or more claims, e.g. "claim 1", "claims 1-5", "any of claims 1, 2 or 4", "claim 1 or 2"
+CLAIM_REFERENCE = re.compile(
+    rf"\bclaims?\s+({CLAIM_ITEM}(?:{CLAIM_SEPARATOR}{CLAIM_ITEM}{CLAIM_LIST_END})*)\b",
+    re.IGNORECASE
+)
+
+# Largest claim range expanded from a single reference
+MAX_RANGE = 1000
+
+
+# claim numbers as text, with consecutive numbers joined into ranges, e.g. "claims 1-3, 5"
+def format_claim_numbers(numbers) -> str:
+    numbers = sorted(numbers)
+    parts = []
+    start = 0
+    for i in range(1, len(numbers) + 1):
+        if i == len(numbers) or numbers[i] != numbers[i - 1] + 1:
+            first, last = numbers[start], numbers[i - 1]
+            parts.append(str(first) if first == last else f"{first}-{last}")
+            start = i
+    return f"claim{'s' if len(numbers) > 1 else ''} {', '.join(parts)}"
+
+
+# returns a list of every claim number referenced in the text, in order of appearance
+def find_claim_references(claim_text: str) -> list:
     ref_list = list()
-    # find all claim # references within the text using regex
-    claim_match = re.finditer(r"\bclaim (\d+)\b", claim_text, re.IGNORECASE)
-    # return all matching numbers
-    for idx,m in enumerate(claim_match):
-        if idx > 0:
-            break
-        number = m.group(1)
-        ref_list.append(int(number))
-    return ref_list
+    # find all claim # references within the text in a single pass
+    for m in CLAIM_REFERENCE.finditer(claim_text):
+        # expand lists and ranges of numbers such as "1, 2 or 4" and "1-5"
+        for r in CLAIM_RANGE.finditer(m.group(1)):
+            start = int(r.group(1))
+            end = int(r.group(2)) if r.group(2) else start
+            if end < start or end - start > MAX_RANGE:
+                end = start
+            ref_list.extend(range(start, end + 1))
+    # drop repeated references, keeping the first occurrence
+    return list(dict.fromkeys(ref_list))
 
 # build the claim tree given a string of claims
-def build_claim_tree(claims: list) -> list:
+def build_claim_tree(claims: list) -> ClaimTree:
     nodes = {}
     roots = []
     
     # first, create our claim nodes.
     for claim in claims:
         # break the claim into number and text
-        match = re.match(r'^(\d+)\.\s+((.*\n*)*)', claim.strip())
+        claim = claim.strip()
+        match = CLAIM_NUMBER.match(claim)
         if not match:
             continue
         number = int(match.group(1))
-        text = match.group(2)
+        text = claim[match.end():]
         nodes[number] = ClaimNode(number,text)
 
     #then, create the tree
     for number, node in nodes.items():
-        # find the references of the given claim
-        refs = find_claim_references(node.text)
+        # find the references of the given claim. A claim can only depend on earlier claims.
+        refs = [ref for ref in find_claim_references(node.text) if ref in nodes and ref < number]
         # if none are found, claim is a root
         if refs == []:
             roots.append(node)
         # if not, add the claim as a child to the referenced node(s).
         else:
             for ref in refs:
-                if ref in nodes: # make sure claim number is in nodes. If not make a root node.
-                    nodes[ref].add_child(node)
-                else:
-                    roots.append(node)
+                nodes[ref].add_child(node)
+
+    return ClaimTree(roots, nodes)
+
+# convert a claim tree to plain data: its root numbers and [number, text, child numbers] per node
+def tree_to_dict(tree: ClaimTree) -> dict:
+    return {
+        "roots": [root.number for root in tree],
+        "nodes": [[n.number, n.text, [c.number for c in n.children]] for n in tree.nodes.values()],
+    }
+
+# rebuild a claim tree from the plain data produced by tree_to_dict, without parsing any claim text
+def tree_from_dict(data: dict) -> ClaimTree:
+    nodes = {number: ClaimNode(number, text) for number, text, _ in data["nodes"]}
+    for number, _, children in data["nodes"]:
+        for c in children:
+            nodes[number].add_child(nodes[c])
+    return ClaimTree([nodes[r] for r in data["roots"]], nodes)
+
+# hash a patent's claim list so identical claim sets share one parsed tree
+def claims_hash(claims) -> str:
+    return hashlib.sha256(json.dumps(claims, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+# parse a claim list into the plain data stored in the claim tree cache
+def parse_claims(claims) -> dict:
+    return tree_to_dict(build_claim_tree(claims))
+
+# parsed claim trees keyed by a hash of each claim list. The cache file is loaded once and saved once,
+# so a run rendering many batches does not rewrite it per batch. Uncached claim lists are parsed in a
+# process pool that is started on first use and reused for every later batch.
+class ClaimTreeCache:
+
+    def __init__(self, path=None, workers=None):
+        self.path = path
+        self.workers = workers
+        self.trees = load_json(path) if path and os.path.exists(path) else {}
+        self.used = set()
+        self.changed = False
+        self.executor = None
+
+    # mark the trees of patents whose entries are rendered elsewhere (e.g. from cached HTML) as in use
+    def keep(self, patents):
+        self.used.update(claims_hash(p.get("claims", "<No claims>")) for p in patents)
+
+    # render the claim trees of many patents, keyed by patent number. Patents sharing identical claims
+    # (and patents unchanged since an earlier run) are only parsed once.
+    def render(self, patents) -> dict:
+        hashes = {}
+        misses = {}
+        for p in patents:
+            claims = p.get("claims", "<No claims>")
+            h = claims_hash(claims)
+            hashes[p.get("patent_number", "N/A")] = h
+            if h not in self.trees:
+                misses[h] = claims
+
+        # parse each distinct uncached claim list once
+        if misses:
+            if self.workers == 1 or len(misses) == 1:
+                parsed = [parse_claims(claims) for claims in misses.values()]
+            else:
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers)
+                chunksize = max(1, len(misses) // ((self.workers or os.cpu_count() or 1) * 4))
+                parsed = list(self.executor.map(parse_claims, misses.values(), chunksize=chunksize))
+            self.trees.update(zip(misses, parsed))
+            self.changed = True
+        self.used.update(hashes.values())
+
+        rendered = {}
+        trees = {}
+        for number, h in hashes.items():
+            if h not in trees:
+                trees[h] = tree_from_dict(self.trees[h]).render()
+            rendered[number] = trees[h]
+        return rendered
+
+    # write the cache if it changed. With prune, only the trees used since it was loaded are kept, so
+    # the cache does not grow without bound.
+    def save(self, prune=True):
+        if prune and len(self.used) != len(self.trees):
+            self.trees = {h: tree for h, tree in self.trees.items() if h in self.used}
+            self.changed = True
+        if self.path and self.changed:
+            save_json(self.path, self.trees)
+            self.changed = False
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
-    return roots
+# render the claim trees of many patents in one go, keyed by patent number, using the cache file at
+# cache_path. With prune, trees not used by these patents are dropped from the cache.
+def render_claim_trees(patents, cache_path=None, workers=None, prune=True) -> dict:
+    with ClaimTreeCache(cache_path, workers) as cache:
+        rendered = cache.render(patents)
+        cache.save(prune)
+    return rendered
 
-# save json to file
+# save json to file, replacing any previous file atomically
 def save_json(file_name:str, data):
-    with open(file_name,'w') as f:
+    with open(file_name + '.tmp','w') as f:
         json.dump(data, f)
+    os.replace(file_name + '.tmp', file_name)
 
 # load data from json file
 def load_json(file_name:str):
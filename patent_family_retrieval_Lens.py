@@ -1,69 +1,240 @@
+import argparse
 import os
 import json
-from collections import defaultdict
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from family_graph import FamilyGraph, save_family_data
+from lens_archive import archived_records, open_response, response_paths, response_size
+from patent_ids import dedupe_patent_ids, normalize_patent_id
+from patent_store import PatentStore
 
 # Directories
 input_dir = 'data_Lens'
 output_dir = 'patent_family_data'
 
-# Ensure output directory exists
-os.makedirs(output_dir, exist_ok=True)
+# Matches the extended family key of a Lens record (quotes inside string values are always escaped)
+EXTENDED_FAMILY_KEY = re.compile(r'"extended_family"\s*:')
+
+# Amount of text read from a response at a time while streaming
+CHUNK_SIZE = 64 * 1024
+
+# Text kept between chunks so a key split across a chunk boundary is still found
+KEY_OVERLAP = 64
+
+
+# Stream through a Lens response, decoding only the values of the keys matched by key_pattern, in file
+# order. Yields (key, value) pairs, where key is the pattern's first group (or the whole match).
+# Responses kept in the directory's archive are read from there.
+def stream_json_values(filepath, key_pattern, chunk_size=CHUNK_SIZE):
+    decoder = json.JSONDecoder()
+    buffer = ""
+
+    with open_response(filepath) as f:
+        while True:
+            # Skip ahead to the next key without holding the rest of the file in memory
+            match = key_pattern.search(buffer)
+            while match is None:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                buffer = buffer[-KEY_OVERLAP:] + chunk
+                match = key_pattern.search(buffer)
+            key = match.group(1) if key_pattern.groups else match.group(0)
+            buffer = buffer[match.end():].lstrip()
+
+            # Read just enough to decode the value that follows the key
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer)
+                    break
+                except json.JSONDecodeError:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        raise
+                    buffer = (buffer + chunk).lstrip()
+            yield key, value
+            buffer = buffer[end:]
+
+
+# Stream through a Lens response and decode only its first extended family object. Archived responses
+# only have the families field of their records decoded.
+# Returns None if the response has no extended family (e.g. an empty search result).
+def stream_extended_family(filepath, chunk_size=CHUNK_SIZE):
+    records = archived_records(filepath, ["families"])
+    if records is not None:
+        for record in records:
+            if "extended_family" in record.get("families", {}):
+                return record["families"]["extended_family"]
+        return None
+    for _, value in stream_json_values(filepath, EXTENDED_FAMILY_KEY, chunk_size):
+        return value
+    return None
+
+
+# Collect the canonical patent numbers of an extended family object's members
+def family_member_ids(extended_family):
+    # Navigate to the extended family members
+    extended_family_members = extended_family.get('members', [])
+
+    # Handle single object vs list
+    if isinstance(extended_family_members, dict):
+        extended_family_members = [extended_family_members]
+
+    # Extract patent numbers as jurisdiction + doc_number
+    extracted_family = []
+    for member in extended_family_members:
+        doc = member.get('document_id', {})
+        jurisdiction = doc.get('jurisdiction')
+        doc_number = doc.get('doc_number')
+        if jurisdiction and doc_number:
+            extracted_family.append(f"{jurisdiction}{doc_number}")
+
+    # Members are listed once per publication kind, so collapse them to canonical numbers
+    return dedupe_patent_ids(extracted_family)
 
-# Dictionary to track family members and their related main patents
-family_member_relations = defaultdict(set)
 
-# Loop through all JSON files in the input directory
-for filename in os.listdir(input_dir):
-    if filename.endswith('.json'):
-        filepath = os.path.join(input_dir, filename)
+# Write a main patent's family to <patent>_extended_family.json
+def write_extended_family(main_patent_number, extracted_family, output_dir):
+    output_filename = f"{main_patent_number}_extended_family.json"
+    output_path = os.path.join(output_dir, output_filename)
+    with open(output_path, 'w', encoding='utf-8') as out_file:
+        json.dump(extracted_family, out_file, indent=2)
 
-        with open(filepath, 'r', encoding='utf-8') as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                print(f"Failed to decode {filename}")
-                continue
+    print(f"Saved extended family for {main_patent_number} with {len(extracted_family)} member(s).")
 
-        # Skip files with empty data_Lens list
-        if not data.get("data_Lens"):
-            print(f"Skipping {filename} due to empty data_Lens.")
+
+# Extract one response's extended family and write it to <patent>_extended_family.json.
+# Returns the main patent number and its family, or None if the file was skipped.
+def extract_extended_family(filepath, output_dir):
+    filename = os.path.basename(filepath)
+
+    try:
+        extended_family = stream_extended_family(filepath)
+    except json.JSONDecodeError:
+        print(f"Failed to decode {filename}")
+        return None
+
+    # Skip responses without any matching record
+    if extended_family is None:
+        print(f"Skipping {filename} due to empty data_Lens.")
+        return None
+
+    # Get the main patent number from the filename (strip .json)
+    main_patent_number = normalize_patent_id(os.path.splitext(filename)[0])
+    extracted_family = family_member_ids(extended_family)
+
+    write_extended_family(main_patent_number, extracted_family, output_dir)
+    return main_patent_number, extracted_family
+
+
+# Extract one response's extended family in a worker process, also returning the time taken and the
+# size of the response so the parent process can record them
+def timed_extract_extended_family(filepath, output_dir):
+    start = time.perf_counter()
+    result = extract_extended_family(filepath, output_dir)
+    return result, time.perf_counter() - start, response_size(filepath)
+
+
+# Extract the extended families of the responses saved in a patent store
+def extract_store_families(store, output_dir):
+    results = []
+    for main_patent_number, response in store.iter_publications():
+        records = response.get("data") or []
+        if not records or "extended_family" not in records[0].get("families", {}):
+            print(f"Skipping {main_patent_number} due to empty data_Lens.")
             continue
+        extracted_family = family_member_ids(records[0]["families"]["extended_family"])
+        write_extended_family(main_patent_number, extracted_family, output_dir)
+        results.append((main_patent_number, extracted_family))
+    return results
+
 
-        # Get the main patent number from the filename (strip .json)
-        main_patent_number = os.path.splitext(filename)[0]
+# Load every <patent>_extended_family.json in a directory as {main patent: [members]}
+def load_extended_families(directory):
+    families = {}
+    suffix = "_extended_family.json"
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(suffix):
+            with open(os.path.join(directory, filename), 'r', encoding='utf-8') as f:
+                families[filename[:-len(suffix)]] = json.load(f)
+    return families
 
-        # Navigate to the extended family members
-        extended_family_members = data["data_Lens"][0].get('families', {}).get('extended_family', {}).get('members', [])
 
-        # Handle single object vs list
-        if isinstance(extended_family_members, dict):
-            extended_family_members = [extended_family_members]
+# Extract the extended families of every Lens response in input_dir across a process pool,
+# then merge them into the family graph of members and their related main patents.
+# If a patent store is given, responses are read from it and the families are saved back to it.
+# With patent_numbers, only those main patents' responses are extracted, and the graph is rebuilt
+# from every extended family file in output_dir so the other families are kept.
+def extract_patent_families(input_dir=input_dir, output_dir=output_dir, workers=None, store=None,
+                            patent_numbers=None):
+    # Ensure output directory exists
+    os.makedirs(output_dir, exist_ok=True)
 
-        # Extract patent numbers as jurisdiction + doc_number
-        extracted_family = []
-        for member in extended_family_members:
-            doc = member.get('document_id', {})
-            jurisdiction = doc.get('jurisdiction')
-            doc_number = doc.get('doc_number')
-            if jurisdiction and doc_number:
-                patent_id = f"{jurisdiction}{doc_number}"
-                extracted_family.append(patent_id)
-                family_member_relations[patent_id].add(main_patent_number)
+    # Responses saved as files or in the directory's archive, skipping files such as the retrieval manifest
+    filepaths = response_paths(input_dir) if store is None else []
+    if patent_numbers is not None:
+        wanted = set(dedupe_patent_ids(patent_numbers))
+        filepaths = [filepath for filepath in filepaths
+                     if normalize_patent_id(os.path.splitext(os.path.basename(filepath))[0]) in wanted]
+
+    if store is not None:
+        with metrics.timer("family_extract_store"):
+            results = extract_store_families(store, output_dir)
+    else:
+        if workers == 1:
+            timed = [timed_extract_extended_family(filepath, output_dir) for filepath in filepaths]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunksize = max(1, len(filepaths) // ((workers or os.cpu_count() or 1) * 4))
+                timed = list(executor.map(timed_extract_extended_family, filepaths,
+                                          [output_dir] * len(filepaths), chunksize=chunksize))
+        results = []
+        for filepath, (result, seconds, size) in zip(filepaths, timed):
+            metrics.observe("item_seconds", seconds, step="family_extract")
+            metrics.log("item", step="family_extract", file=os.path.basename(filepath), seconds=round(seconds, 6))
+            metrics.count("bytes_read_total", size, source="data_Lens")
+            if result is None:
+                metrics.count("not_found_total")
+            results.append(result)
+
+    # Extended family of each main patent
+    extended_families = {}
+    for result in results:
+        if result is None:
+            continue
+        main_patent_number, extracted_family = result
+        extended_families[main_patent_number] = extracted_family
+        if store is not None:
+            store.save_family(main_patent_number, extracted_family)
 
-        # Write to output file
-        output_filename = f"{main_patent_number}_extended_family.json"
-        output_path = os.path.join(output_dir, output_filename)
-        with open(output_path, 'w', encoding='utf-8') as out_file:
-            json.dump(extracted_family, out_file, indent=2)
+    # Merge overlapping families so each member and main patent is written once per family
+    if patent_numbers is not None:
+        extended_families = load_extended_families(output_dir)
+    family_graph = FamilyGraph.build(extended_families)
+    metrics.count("bytes_written_total", save_family_data(family_graph, output_dir), target="family_graph")
 
-        print(f"Saved extended family for {main_patent_number} with {len(extracted_family)} member(s).")
+    print(f"Saved patent family graph with {family_graph.summary()}.")
+    return family_graph
 
-# Create the summary JSON with unique patent numbers and their related main patents
-family_summary = {member: sorted(list(related)) for member, related in family_member_relations.items()}
 
-# Write the summary to a single JSON file
-summary_path = os.path.join(output_dir, 'patent_family_set.json')
-with open(summary_path, 'w', encoding='utf-8') as summary_file:
-    json.dump(family_summary, summary_file, indent=2)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract extended patent families from saved Lens responses")
+    parser.add_argument("--input", default=input_dir, help="directory of saved Lens responses")
+    parser.add_argument("--output", default=output_dir, help="directory to write the family data to")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("--store", default=None,
+                        help="read responses from this SQLite patent store and save the families to it")
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
 
-print(f"Saved complete patent family set with {len(family_summary)} unique family member(s).")
+    store = PatentStore(args.store) if args.store else None
+    metrics.start_run("patent_family_retrieval_Lens", args.metrics_dir, args.profile)
+    try:
+        extract_patent_families(args.input, args.output, args.workers, store)
+    finally:
+        metrics.finish_run()
+        if store is not None:
+            store.close()
@@ -0,0 +1,63 @@
+import re
+
+# Separators that appear in hand-typed or office-formatted patent numbers (e.g. "US 2011/0167620 A1")
+SEPARATORS = re.compile(r"[\s,./\-]")
+
+# Jurisdiction, optional document type prefix (design, reissue, plant, ...), serial number and optional kind code
+PATENT_ID = re.compile(r"^([A-Z]{2})(D|RE|RX|PP|AI|H|T|X)?(\d+)([A-Z]\d?)?$")
+
+# Width the serial number of US designs, reissues and plants is zero-padded to by Lens
+US_PADDED_WIDTH = 7
+
+
+# Split a patent number into jurisdiction, type prefix, serial number and kind code.
+# Returns None if the number is not in a recognised format.
+def parse_patent_id(patent_id):
+    match = PATENT_ID.match(SEPARATORS.sub("", patent_id).upper())
+    if not match:
+        return None
+    jurisdiction, prefix, number, kind = match.groups()
+    return jurisdiction, prefix or "", number, kind or ""
+
+
+# Return the canonical spelling of a patent number: jurisdiction, type prefix and serial number,
+# without kind code or zero-padding, e.g. "USD0700966S" -> "USD700966" and "EP2422721A1" -> "EP2422721".
+# Numbers in an unrecognised format are only cleaned of separators and upper-cased.
+def normalize_patent_id(patent_id):
+    parts = parse_patent_id(patent_id)
+    if parts is None:
+        return SEPARATORS.sub("", patent_id).upper()
+
+    jurisdiction, prefix, number, _ = parts
+    # US grants, designs and reissues are zero-padded inconsistently; publications (year + serial) are not
+    if jurisdiction == "US" and (prefix or len(number) < 11):
+        number = number.lstrip("0") or "0"
+    return f"{jurisdiction}{prefix}{number}"
+
+
+# Return the document numbers Lens may use for a patent number (without its jurisdiction),
+# e.g. "USD700966" -> ["D700966", "D0700966"]
+def lens_doc_numbers(patent_id):
+    canonical = normalize_patent_id(patent_id)
+    parts = parse_patent_id(canonical)
+    if parts is None:
+        return [canonical[2:]]
+
+    jurisdiction, prefix, number, _ = parts
+    doc_numbers = [f"{prefix}{number}"]
+    if jurisdiction == "US" and prefix and len(number) < US_PADDED_WIDTH:
+        doc_numbers.append(f"{prefix}{number.zfill(US_PADDED_WIDTH)}")
+    return doc_numbers
+
+
+# Normalize a list of patent numbers, dropping duplicates but keeping the first-seen order
+def dedupe_patent_ids(patent_ids):
+    return list(dict.fromkeys(normalize_patent_id(patent_id) for patent_id in patent_ids))
+
+
+# Group patent numbers by canonical number, keeping every original spelling as an alias
+def group_aliases(patent_ids):
+    aliases = {}
+    for patent_id in patent_ids:
+        aliases.setdefault(normalize_patent_id(patent_id), []).append(patent_id)
+    return aliases
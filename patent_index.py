@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import re
+import time
+
+# Default location of the saved index
+INDEX_PATH = "patent_status_data/patent_index.json"
+
+# Fields of a status record that are indexed
+FIELDS = ("title", "abstract", "claims")
+
+# Words are runs of letters and digits, compared in lower case
+WORD = re.compile(r"[a-z0-9]+")
+
+# Pieces of a query: parentheses, an optional field prefix followed by a quoted phrase or a word
+QUERY_TOKEN = re.compile(r'\(|\)|(?:(\w+):)?(?:"([^"]*)"?|([^\s()"]+))')
+
+# Positions skipped between two claims so a phrase never matches across them
+CLAIM_GAP = 1
+
+
+# Split text into lower-case words
+def tokenize(text):
+    return WORD.findall((text or "").lower())
+
+
+# Inverted index over the titles, abstracts and claims of the scraped status records.
+# postings[field][term] maps each document (a position in the status file) to the word
+# positions of the term in that field.
+class PatentIndex:
+
+    def __init__(self, patents=(), statuses=(), postings=None):
+        self.patents = list(patents)
+        self.statuses = list(statuses)
+        self.postings = postings if postings is not None else {field: {} for field in FIELDS}
+
+    # Build an index from status records
+    @classmethod
+    def build(cls, records):
+        index = cls()
+        for record in records:
+            index.add(record)
+        return index
+
+    # Add one status record as a new document
+    def add(self, record):
+        doc = len(self.patents)
+        self.patents.append(record.get("patent_number", "N/A"))
+        self.statuses.append(record.get("status") or "Not Found")
+
+        claims = record.get("claims")
+        texts = {
+            "title": [record.get("title")],
+            "abstract": [record.get("abstract")],
+            "claims": claims if isinstance(claims, list) else [claims],
+        }
+        for field, parts in texts.items():
+            postings = self.postings[field]
+            position = 0
+            for part in parts:
+                for word in tokenize(part):
+                    postings.setdefault(word, {}).setdefault(doc, []).append(position)
+                    position += 1
+                position += CLAIM_GAP
+
+    # Documents containing a term in any of the given fields
+    def term(self, term, fields=FIELDS):
+        docs = set()
+        for field in fields:
+            docs.update(self.postings[field].get(term.lower(), ()))
+        return docs
+
+    # Documents containing the words of a phrase next to each other, within one field
+    def phrase(self, text, fields=FIELDS):
+        words = tokenize(text)
+        if len(words) < 2:
+            return self.term(words[0], fields) if words else set()
+
+        docs = set()
+        for field in fields:
+            postings = [self.postings[field].get(word) for word in words]
+            if not all(postings):
+                continue
+            # Only check positions in documents that contain every word, starting from the rarest
+            candidates = set.intersection(*(set(p) for p in sorted(postings, key=len)))
+            for doc in candidates:
+                starts = set(postings[0][doc])
+                for offset, word_postings in enumerate(postings[1:], 1):
+                    starts &= {position - offset for position in word_postings[doc]}
+                    if not starts:
+                        break
+                if starts:
+                    docs.add(doc)
+        return docs
+
+    # Documents matching a boolean query. Words and "quoted phrases" are combined with AND (the default
+    # between two operands), OR and NOT, grouped with parentheses, and can be limited to one field with
+    # a prefix such as claims:battery or claims:"hand piece".
+    def match(self, query):
+        tokens = []
+        for m in QUERY_TOKEN.finditer(query):
+            if m.group(0) in ("(", ")"):
+                tokens.append((m.group(0), None, None))
+            elif m.group(3) in ("AND", "OR", "NOT") and not m.group(1):
+                tokens.append((m.group(3), None, None))
+            else:
+                field = m.group(1).lower() if m.group(1) else None
+                if field is not None and field not in FIELDS:
+                    raise ValueError(f"Unknown field '{field}', expected one of {', '.join(FIELDS)}")
+                text = m.group(2) if m.group(2) is not None else m.group(3)
+                tokens.append(("TERM", field, text))
+
+        everything = set(range(len(self.patents)))
+        position = 0
+
+        def peek():
+            return tokens[position][0] if position < len(tokens) else None
+
+        def parse_or():
+            nonlocal position
+            docs = parse_and()
+            while peek() == "OR":
+                position += 1
+                docs = docs | parse_and()
+            return docs
+
+        def parse_and():
+            nonlocal position
+            docs = parse_not()
+            while peek() in ("AND", "NOT", "TERM", "("):
+                if peek() == "AND":
+                    position += 1
+                docs = docs & parse_not()
+            return docs
+
+        def parse_not():
+            nonlocal position
+            if peek() == "NOT":
+                position += 1
+                return everything - parse_not()
+            return parse_operand()
+
+        def parse_operand():
+            nonlocal position
+            kind, field, text = tokens[position] if position < len(tokens) else (None, None, None)
+            position += 1
+            if kind == "(":
+                docs = parse_or()
+                if peek() == ")":
+                    position += 1
+                return docs
+            if kind == "TERM":
+                return self.phrase(text, (field,) if field else FIELDS)
+            raise ValueError(f"Unexpected end of query: {query!r}" if kind is None
+                             else f"Unexpected '{kind}' in query: {query!r}")
+
+        if not tokens:
+            return set()
+        docs = parse_or()
+        if position < len(tokens):
+            raise ValueError(f"Unexpected '{tokens[position][0]}' in query: {query!r}")
+        return docs
+
+    # Patent numbers matching a query, in status file order. With status, only patents whose
+    # status starts with it (ignoring case) are returned, e.g. status="active".
+    def search(self, query, status=None):
+        docs = sorted(self.match(query))
+        if status:
+            status = status.lower()
+            docs = [doc for doc in docs if self.statuses[doc].lower().startswith(status)]
+        return [self.patents[doc] for doc in docs]
+
+    # Plain data form of the index. Postings are flattened to [doc, count, positions...] per term,
+    # with each document's positions stored as gaps from the previous position.
+    def to_dict(self):
+        postings = {}
+        for field, terms in self.postings.items():
+            postings[field] = {}
+            for term, docs in terms.items():
+                flat = []
+                for doc, positions in docs.items():
+                    flat += [doc, len(positions)]
+                    flat += [position - previous for previous, position in zip([0] + positions, positions)]
+                postings[field][term] = flat
+        return {"patents": self.patents, "statuses": self.statuses, "postings": postings}
+
+    # Rebuild an index from the data produced by to_dict
+    @classmethod
+    def from_dict(cls, data):
+        postings = {}
+        for field, terms in data["postings"].items():
+            postings[field] = {}
+            for term, flat in terms.items():
+                docs = {}
+                i = 0
+                while i < len(flat):
+                    doc, count = flat[i], flat[i + 1]
+                    positions = []
+                    position = 0
+                    for gap in flat[i + 2:i + 2 + count]:
+                        position += gap
+                        positions.append(position)
+                    docs[doc] = positions
+                    i += 2 + count
+                postings[field][term] = docs
+        return cls(data["patents"], data["statuses"], postings)
+
+    def save(self, path=INDEX_PATH):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    # Write the index as a script defining SEARCH_INDEX, for the lazy HTML page to load
+    def write_js(self, path):
+        data = json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"const SEARCH_INDEX = {data};\n")
+
+
+if __name__ == "__main__":
+    from visualize_patents import JSON_PATH, iter_patents
+
+    parser = argparse.ArgumentParser(description="Build or query the full-text index of scraped patents")
+    parser.add_argument("command", choices=["build", "query"])
+    parser.add_argument("query", nargs="?", help='e.g. claims:"hand piece" AND (battery OR cordless)')
+    parser.add_argument("--input", default=JSON_PATH, help="status JSON file written by google_scraper.py")
+    parser.add_argument("--store", default=None, help="read the statuses from this SQLite patent store instead")
+    parser.add_argument("--index", default=INDEX_PATH, help="file the index is saved to")
+    parser.add_argument("--status", default=None, help="only list patents whose status starts with this")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        index = PatentIndex.build(iter_patents(args.input, args.store))
+        index.save(args.index)
+        terms = sum(len(terms) for terms in index.postings.values())
+        print(f"Indexed {len(index.patents)} patents ({terms} terms) in {time.perf_counter() - start:.2f}s "
+              f"to {args.index}.")
+    else:
+        if not args.query:
+            parser.error("query needs a query string")
+        index = PatentIndex.load(args.index)
+        start = time.perf_counter()
+        matches = index.search(args.query, args.status)
+        elapsed = time.perf_counter() - start
+        for patent in matches:
+            print(patent)
+        print(f"{len(matches)} match(es) in {elapsed * 1000:.3f} ms.")
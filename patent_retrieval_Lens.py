@@ -1,7 +1,17 @@
-import requests
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+import hashlib
 import os
 import json
+import threading
+
+import metrics
+from lens_archive import load_response, response_exists, save_response
+from patent_ids import lens_doc_numbers, normalize_patent_id
+from patent_store import PatentStore
+from request_utils import RateLimiter, create_session, request_with_backoff
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -9,47 +19,291 @@ load_dotenv()
 # Retrieve the API key from the environment
 api_key = os.getenv("API_KEY")
 
+# Lens search endpoint (can be pointed at a local stub server for testing)
+LENS_API_URL = os.getenv("LENS_API_URL", "https://api.lens.org/patent/search")
+
+# Default request quota for the Lens API, in requests per minute
+DEFAULT_REQUESTS_PER_MINUTE = 50
+
+# Number of results requested per page of a batched search
+DEFAULT_PAGE_SIZE = 100
+
+
+# Name of the freshness manifest kept alongside the responses
+MANIFEST_FILENAME = "_manifest.json"
+
+# Guards manifest updates made from worker threads
+manifest_lock = threading.Lock()
+
+
+# Load the manifest recording fetch time, HTTP status and content hash per patent
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+# Save the manifest, replacing the previous one atomically
+def save_manifest(directory, manifest):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, MANIFEST_FILENAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+# Hash a response independently of how it was formatted on disk
+def hash_response(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+# Status recorded for a patent number that a batched search did not match
+UNMATCHED_STATUS = "unmatched"
+
+
+# Record the outcome of a fetch in the manifest. A failed fetch drops the hash of any earlier response.
+def record_fetch(manifest, patent_number, status, content_hash=None):
+    if manifest is None:
+        return
+    with manifest_lock:
+        entry = manifest.setdefault(patent_number, {})
+        entry["fetched_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        entry["status"] = status
+        if content_hash:
+            entry["sha256"] = content_hash
+        else:
+            entry.pop("sha256", None)
+
+
+# Check whether a patent's cached response is recent enough to skip refetching
+def is_fresh(patent_number, directory, manifest, max_age=None, only_missing=False):
+    if not response_exists(os.path.join(directory, f"{patent_number}.json")):
+        return False
+    # A response left over from before a failed or unmatched fetch is never fresh
+    entry = manifest.get(patent_number, {})
+    if entry.get("status", 200) != 200:
+        return False
+    if only_missing:
+        return True
+    if max_age is None or "fetched_at" not in entry:
+        return False
+    fetched_at = datetime.fromisoformat(entry["fetched_at"])
+    return datetime.now(timezone.utc) - fetched_at < max_age
+
+
+# Save a response to the store, if given, and write it to disk unless it is identical to the cached one.
+# Returns True if the file changed.
+def write_if_changed(patent_number, data, directory, manifest=None, store=None):
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, f"{patent_number}.json")
+    content_hash = hash_response(data)
+    if store is not None:
+        store.save_publication(patent_number, data)
+
+    if manifest is not None and response_exists(filename):
+        previous_hash = manifest.get(patent_number, {}).get("sha256")
+        if previous_hash is None:
+            previous_hash = hash_response(load_response(filename))
+        if previous_hash == content_hash:
+            record_fetch(manifest, patent_number, 200, content_hash)
+            print(f"[=] Unchanged: {filename}")
+            return False
+
+    # Written into the directory's archive instead when it has one
+    metrics.count("bytes_written_total", save_response(directory, patent_number, data), target="data_Lens")
+
+    record_fetch(manifest, patent_number, 200, content_hash)
+    print(f"[✓] Saved: {filename}")
+    return True
+
 
 # Function to save full API response to a JSON file
-def save_patent_json_response(patent_number, directory):
-    url = f"https://api.lens.org/patent/search?token={api_key}&query={patent_number}"
+def save_patent_json_response(patent_number, directory, session=None, limiter=None, timeout=30, manifest=None,
+                              store=None):
+    # Without a shared session, use one of our own and close it afterwards
+    if session is None:
+        with create_session(pool_size=1) as session:
+            return save_patent_json_response(patent_number, directory, session, limiter, timeout, manifest, store)
 
     try:
-        response = requests.get(url)
+        response = request_with_backoff(
+            session, "GET", LENS_API_URL, limiter=limiter, timeout=timeout,
+            params={"token": api_key, "query": patent_number}
+        )
 
         if response.status_code == 200:
             data = response.json()
-
-            os.makedirs(directory, exist_ok=True)
-            filename = os.path.join(directory, f"{patent_number}.json")
-
-            with open(filename, "w", encoding="utf-8") as file:
-                json.dump(data, file, indent=4)
-
-            print(f"[✓] Saved: {filename}")
+            if not data.get("data"):
+                metrics.count("not_found_total")
+            write_if_changed(patent_number, data, directory, manifest, store)
+            return True
         else:
+            record_fetch(manifest, patent_number, response.status_code)
             print(f"[!] Error for {patent_number} - {response.status_code}: {response.text}")
 
     except Exception as e:
         print(f"[!] Exception for {patent_number}: {e}")
 
+    return False
+
+
+# Write one patent's records in the same shape as a single-patent search response
+def write_patent_records(patent_number, records, directory, manifest=None, store=None):
+    data = {"total": len(records), "data": records, "results": len(records)}
+    return write_if_changed(patent_number, data, directory, manifest, store)
+
+
+# Search for many patent numbers in one structured request and split the results into per-patent files.
+# Returns the list of patent numbers that Lens did not match.
+def save_patent_batch_responses(patent_numbers, directory, session=None, limiter=None, timeout=30,
+                                page_size=DEFAULT_PAGE_SIZE, manifest=None, store=None):
+    if session is None:
+        with create_session(pool_size=1) as session:
+            return save_patent_batch_responses(patent_numbers, directory, session, limiter, timeout, page_size,
+                                               manifest, store)
+    # Match results by canonical number so spellings such as USD700966 and USD0700966 line up
+    wanted = {normalize_patent_id(patent): patent for patent in patent_numbers}
+    query = {"bool": {"must": [
+        {"terms": {"doc_number": sorted({doc_number for patent in wanted for doc_number in lens_doc_numbers(patent)})}},
+        {"terms": {"jurisdiction": sorted({patent[:2] for patent in wanted})}},
+    ]}}
+
+    matched = {patent: [] for patent in patent_numbers}
+    offset = 0
+    try:
+        # Page through the combined result set
+        while True:
+            response = request_with_backoff(
+                session, "POST", LENS_API_URL, limiter=limiter, timeout=timeout,
+                headers={"Authorization": f"Bearer {api_key}"},
+                json={"query": query, "from": offset, "size": page_size}
+            )
+            if response.status_code != 200:
+                for patent in patent_numbers:
+                    record_fetch(manifest, patent, response.status_code)
+                print(f"[!] Error for batch of {len(patent_numbers)} - {response.status_code}: {response.text}")
+                return list(patent_numbers)
+
+            data = response.json()
+            records = data.get("data", [])
+            for record in records:
+                patent = wanted.get(normalize_patent_id(f"{record.get('jurisdiction')}{record.get('doc_number')}"))
+                if patent:
+                    matched[patent].append(record)
+
+            offset += len(records)
+            if not records or offset >= data.get("total", 0):
+                break
+
+    except Exception as e:
+        print(f"[!] Exception for batch of {len(patent_numbers)}: {e}")
+        return list(patent_numbers)
+
+    unmatched = []
+    for patent, records in matched.items():
+        if records:
+            write_patent_records(patent, records, directory, manifest, store)
+        else:
+            # Recorded as unmatched, without a hash, so the number is retried on the next run
+            record_fetch(manifest, patent, UNMATCHED_STATUS)
+            metrics.count("not_found_total")
+            unmatched.append(patent)
+    return unmatched
+
+
+# Read the patent numbers listed one per line in input.txt
+def read_patent_list(input_file):
+    with open(input_file, "r") as file:
+        return [line.strip() for line in file if line.strip()]
+
 
 # Main routine to process all patent numbers from input.txt
-def process_patent_list(input_file, output_directory):
+def process_patent_list(input_file, output_directory, workers=1, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                        timeout=30, batch_size=None, max_age=None, only_missing=False, store=None):
     if not os.path.exists(input_file):
         print(f"[!] Input file not found: {input_file}")
         return
 
-    with open(input_file, "r") as file:
-        patent_numbers = [line.strip() for line in file if line.strip()]
+    process_patent_numbers(read_patent_list(input_file), output_directory, workers, requests_per_minute, timeout,
+                           batch_size, max_age, only_missing, store)
+
+
+# Retrieve and save the Lens responses of a list of patent numbers
+def process_patent_numbers(patent_numbers, output_directory, workers=1,
+                           requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, timeout=30, batch_size=None,
+                           max_age=None, only_missing=False, store=None):
+    # Skip patents whose cached response is still fresh
+    manifest = load_manifest(output_directory)
+    requested = len(patent_numbers)
+    patent_numbers = [patent for patent in patent_numbers
+                      if not is_fresh(patent, output_directory, manifest, max_age, only_missing)]
+    if len(patent_numbers) < requested:
+        print(f"Skipping {requested - len(patent_numbers)} patent(s) with a fresh cached response.")
+        metrics.count("skipped_fresh_total", requested - len(patent_numbers))
+
+    # One keep-alive session and one rate limiter are shared by every worker
+    session = create_session(pool_size=workers)
+    limiter = RateLimiter(requests_per_minute)
+
+    if batch_size:
+        # Send many patent numbers per search request instead of one request each
+        batches = [patent_numbers[i:i + batch_size] for i in range(0, len(patent_numbers), batch_size)]
+
+        def fetch_batch(batch):
+            with metrics.timer("lens_batch", patents=len(batch)):
+                return save_patent_batch_responses(batch, output_directory, session, limiter, timeout,
+                                                   manifest=manifest, store=store)
 
-    for patent in patent_numbers:
-        save_patent_json_response(patent, output_directory)
+        with session, ThreadPoolExecutor(max_workers=workers) as executor:
+            unmatched = [patent for missing in executor.map(fetch_batch, batches) for patent in missing]
+        save_manifest(output_directory, manifest)
 
+        print(f"Fetched {len(patent_numbers) - len(unmatched)} of {len(patent_numbers)} patent(s) "
+              f"in {len(batches)} batch(es).")
+        if unmatched:
+            print(f"[!] Not matched: {', '.join(unmatched)}")
+        return
+
+    def fetch(patent):
+        with metrics.timer("lens_fetch", patent=patent):
+            return save_patent_json_response(patent, output_directory, session, limiter, timeout, manifest, store)
+
+    with session, ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(fetch, patent_numbers))
+    save_manifest(output_directory, manifest)
+
+    print(f"Fetched {sum(results)} of {len(patent_numbers)} patent(s).")
 
-# Specifying paths
-input_file = "input.txt"
-output_directory = "data_Lens"
 
-# Running script
-process_patent_list(input_file, output_directory)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieve Lens search responses for the patents in input.txt")
+    parser.add_argument("--input", default="input.txt", help="file listing one patent number per line")
+    parser.add_argument("--output", default="data_Lens", help="directory to save the responses in")
+    parser.add_argument("--workers", type=int, default=4, help="number of concurrent requests")
+    parser.add_argument("--rate", type=float, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help="maximum requests per minute sent to Lens")
+    parser.add_argument("--timeout", type=float, default=30, help="per-request timeout in seconds")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="search for this many patent numbers per request instead of one at a time")
+    parser.add_argument("--max-age", type=float, default=None,
+                        help="skip patents fetched successfully within this many hours")
+    parser.add_argument("--only-missing", action="store_true",
+                        help="only fetch patents that have no cached response yet")
+    parser.add_argument("--store", default=None, help="also save responses to this SQLite patent store")
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    max_age = timedelta(hours=args.max_age) if args.max_age is not None else None
+    store = PatentStore(args.store) if args.store else None
+
+    # Running script
+    metrics.start_run("patent_retrieval_Lens", args.metrics_dir, args.profile)
+    try:
+        process_patent_list(args.input, args.output, args.workers, args.rate, args.timeout, args.batch_size,
+                            max_age, args.only_missing, store)
+    finally:
+        metrics.finish_run()
+        if store is not None:
+            store.close()
@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+
+from family_graph import FamilyGraph, load_family_graph, save_family_data
+from lens_archive import load_response, response_paths
+from patent_ids import normalize_patent_id
+
+# Default location of the store
+DEFAULT_DB_PATH = "patents.db"
+
+# Columns of a scraped status record, in the order of the JSON status file
+STATUS_FIELDS = ["index", "patent_number", "link", "title", "abstract", "status",
+                 "anticipated_expiration_date", "adjusted_expiration_date", "related_patents", "claims"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS publications (
+    patent_number TEXT PRIMARY KEY,
+    jurisdiction TEXT,
+    doc_number TEXT,
+    kind TEXT,
+    date_published TEXT,
+    title TEXT,
+    response TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS family_members (
+    family TEXT NOT NULL,
+    member TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (family, member)
+);
+CREATE INDEX IF NOT EXISTS family_members_member ON family_members (member);
+CREATE TABLE IF NOT EXISTS scrape_status (
+    patent_number TEXT PRIMARY KEY,
+    idx INTEGER,
+    link TEXT,
+    title TEXT,
+    abstract TEXT,
+    status TEXT,
+    anticipated_expiration_date TEXT,
+    adjusted_expiration_date TEXT,
+    related_patents TEXT
+);
+CREATE INDEX IF NOT EXISTS scrape_status_status ON scrape_status (status);
+CREATE INDEX IF NOT EXISTS scrape_status_idx ON scrape_status (idx);
+CREATE TABLE IF NOT EXISTS claims (
+    patent_number TEXT NOT NULL,
+    claim_index INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (patent_number, claim_index)
+);
+"""
+
+
+# Embedded SQLite store for Lens responses, family membership, scraped statuses and claims.
+# A single connection is shared between threads, with writes serialized by a lock.
+class PatentStore:
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Save a full Lens search response for a patent
+    def save_publication(self, patent_number, response):
+        records = response.get("data") or [{}]
+        record = records[0]
+        title = (record.get("biblio", {}).get("invention_title") or [{}])[0].get("text")
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO publications VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (normalize_patent_id(patent_number), record.get("jurisdiction"), record.get("doc_number"),
+                 record.get("kind"), record.get("date_published"), title,
+                 json.dumps(response, separators=(",", ":"), ensure_ascii=False))
+            )
+
+    # Load the Lens response saved for a patent, or None
+    def load_publication(self, patent_number):
+        row = self.conn.execute("SELECT response FROM publications WHERE patent_number = ?",
+                                (normalize_patent_id(patent_number),)).fetchone()
+        return json.loads(row["response"]) if row else None
+
+    # Iterate over (patent number, response) for every saved Lens response
+    def iter_publications(self):
+        for row in self.conn.execute("SELECT patent_number, response FROM publications ORDER BY patent_number"):
+            yield row["patent_number"], json.loads(row["response"])
+
+    # Replace the extended family members of a main patent
+    def save_family(self, family, members):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM family_members WHERE family = ?", (family,))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO family_members VALUES (?, ?, ?)",
+                [(family, member, position) for position, member in enumerate(members)]
+            )
+
+    # Members of a main patent's extended family, in Lens order
+    def family_members(self, family):
+        rows = self.conn.execute("SELECT member FROM family_members WHERE family = ? ORDER BY position", (family,))
+        return [row["member"] for row in rows]
+
+    # Map every main patent to its extended family members
+    def extended_families(self):
+        families = {}
+        for row in self.conn.execute("SELECT family, member FROM family_members ORDER BY family, position"):
+            families.setdefault(row["family"], []).append(row["member"])
+        return families
+
+    # Merge the saved families into a family graph
+    def family_graph(self):
+        return FamilyGraph.build(self.extended_families())
+
+    # Save scraped status records, replacing any previous record and claims for the same patents
+    def save_status_records(self, records):
+        with self._lock, self.conn:
+            for record in records:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO scrape_status VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (record.get("patent_number"), record.get("index"), record.get("link"), record.get("title"),
+                     record.get("abstract"), record.get("status"), record.get("anticipated_expiration_date"),
+                     record.get("adjusted_expiration_date"), json.dumps(record.get("related_patents") or []))
+                )
+                self.conn.execute("DELETE FROM claims WHERE patent_number = ?", (record.get("patent_number"),))
+                claims = record.get("claims")
+                if isinstance(claims, list):
+                    self.conn.executemany(
+                        "INSERT INTO claims VALUES (?, ?, ?)",
+                        [(record.get("patent_number"), i, text) for i, text in enumerate(claims)]
+                    )
+
+    # Rebuild a status record (in the JSON status file's format) from a scrape_status row
+    def _status_record(self, row):
+        claims = self.conn.execute("SELECT text FROM claims WHERE patent_number = ? ORDER BY claim_index",
+                                   (row["patent_number"],))
+        record = {field: row[field] for field in row.keys() if field != "idx"}
+        record["index"] = row["idx"]
+        record["related_patents"] = json.loads(row["related_patents"])
+        record["claims"] = [claim["text"] for claim in claims]
+        return {field: record[field] for field in STATUS_FIELDS}
+
+    # Load the scraped record for one patent, or None
+    def status_record(self, patent_number):
+        row = self.conn.execute("SELECT * FROM scrape_status WHERE patent_number = ?", (patent_number,)).fetchone()
+        return self._status_record(row) if row else None
+
+    # Iterate over every scraped record in index order
+    def iter_status_records(self):
+        for row in self.conn.execute("SELECT * FROM scrape_status ORDER BY idx, patent_number"):
+            yield self._status_record(row)
+
+    # Scraped records of the members of a family, optionally only those whose status starts with status
+    def family_status(self, family, status=None):
+        query = ("SELECT s.* FROM family_members f JOIN scrape_status s ON s.patent_number = f.member "
+                 "WHERE f.family = ?")
+        params = [family]
+        if status:
+            query += " AND s.status LIKE ?"
+            params.append(f"{status}%")
+        return [self._status_record(row) for row in self.conn.execute(query + " ORDER BY f.position", params)]
+
+    # Import the current JSON artifacts into the store
+    def import_json(self, lens_dir="data_Lens", family_dir="patent_family_data",
+                    status_path="patent_status_data/patent_family_set_status.json"):
+        for path in response_paths(lens_dir):
+            self.save_publication(os.path.splitext(os.path.basename(path))[0], load_response(path))
+
+        if os.path.isdir(family_dir):
+            imported = set()
+            for filename in sorted(os.listdir(family_dir)):
+                if filename.endswith("_extended_family.json"):
+                    main_patent = filename[:-len("_extended_family.json")]
+                    with open(os.path.join(family_dir, filename), "r", encoding="utf-8") as f:
+                        self.save_family(main_patent, json.load(f))
+                    imported.add(main_patent)
+
+            # Families only recorded in the family graph (or a hand-maintained family set)
+            family_graph = load_family_graph(family_dir)
+            if family_graph is not None:
+                for main_patent, members in family_graph.extended_families().items():
+                    if main_patent not in imported:
+                        self.save_family(main_patent, members)
+
+        if os.path.exists(status_path):
+            with open(status_path, "r", encoding="utf-8") as f:
+                self.save_status_records(json.load(f))
+
+    # Export the store to the JSON artifacts read by the existing scripts
+    def export_json(self, lens_dir="data_Lens", family_dir="patent_family_data",
+                    status_path="patent_status_data/patent_family_set_status.json"):
+        os.makedirs(lens_dir, exist_ok=True)
+        for patent_number, response in self.iter_publications():
+            with open(os.path.join(lens_dir, f"{patent_number}.json"), "w", encoding="utf-8") as f:
+                json.dump(response, f, indent=4)
+
+        os.makedirs(family_dir, exist_ok=True)
+        extended_families = self.extended_families()
+        for family, members in extended_families.items():
+            with open(os.path.join(family_dir, f"{family}_extended_family.json"), "w", encoding="utf-8") as f:
+                json.dump(members, f, indent=2)
+        save_family_data(FamilyGraph.build(extended_families), family_dir)
+
+        os.makedirs(os.path.dirname(status_path) or ".", exist_ok=True)
+        with open(status_path, "w", encoding="utf-8") as f:
+            json.dump(list(self.iter_status_records()), f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import or export the patent store to the pipeline's JSON files")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="path of the SQLite store")
+    args = parser.parse_args()
+
+    with PatentStore(args.db) as store:
+        if args.command == "import":
+            store.import_json()
+        else:
+            store.export_json()
+    print(f"{args.command.capitalize()}ed the patent store at {args.db}.")
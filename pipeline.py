@@ -0,0 +1,388 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from datetime import timedelta
+
+import metrics
+from claim_similarity import ClaimDeduper
+from family_graph import FAMILY_GRAPH_FILENAME, FAMILY_SET_FILENAME, load_family_graph
+from google_scraper import DEFAULT_PAGES_PER_DRIVER, get_default_browser, scrape_subset, scrape_with_checkpoint
+from lens_enrichment import MEMBER_DIR, LensRecords, fetch_member_records
+from patent_family_retrieval_Lens import extract_patent_families
+from patent_retrieval_Lens import (DEFAULT_REQUESTS_PER_MINUTE, MANIFEST_FILENAME, api_key, process_patent_numbers,
+                                   read_patent_list)
+from scrape_cache import ScrapeCache
+from stream_pipeline import DEFAULT_QUEUE_SIZE, run_streaming
+from visualize_patents import RENDER_VERSION, iter_patents, write_html
+
+# Files and directories used by the pipeline
+INPUT_FILE = "input.txt"
+LENS_DIR = "data_Lens"
+FAMILY_DIR = "patent_family_data"
+STATUS_DIR = "patent_status_data"
+STATUS_PATH = os.path.join(STATUS_DIR, "patent_family_set_status.json")
+CHECKPOINT_PATH = os.path.join(STATUS_DIR, "patent_family_set_status.jsonl")
+SCRAPE_CACHE_PATH = os.path.join(STATUS_DIR, "scrape_cache.json")
+OUTPUT_HTML = "patents.html"
+
+# Input hashes, output hashes and finish times of the last run of every stage, and the file hash cache
+STATE_PATH = os.path.join(STATUS_DIR, "pipeline_state.json")
+
+# Hours after which stages reading remote data run again even if their inputs did not change
+DEFAULT_LENS_MAX_AGE = 24
+DEFAULT_SCRAPE_MAX_AGE = 24
+
+# Amount of a file hashed at a time
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# Raised by a stage that cannot run, stopping the stages after it
+class StageError(Exception):
+    pass
+
+
+# Content hashes of files and directories. A file is only read again when its size or modification
+# time changed since it was last hashed, so unchanged inputs are checked without reading them.
+class FileHasher:
+
+    def __init__(self, cache=None):
+        self.cache = cache if cache is not None else {}
+
+    def file(self, path):
+        stat = os.stat(path)
+        cached = self.cache.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        self.cache[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    # Hash a list of files and directories together with stage parameters. The Lens manifest only records
+    # fetch times, so it is left out; the archive files (also named "_...") hold responses and are hashed.
+    def paths(self, paths, params=None):
+        digest = hashlib.sha256(json.dumps(params or {}, sort_keys=True).encode("utf-8"))
+        for path in paths:
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    for filename in sorted(files):
+                        if filename != MANIFEST_FILENAME:
+                            file_path = os.path.join(root, filename)
+                            digest.update(f"{file_path}\0{self.file(file_path)}\n".encode("utf-8"))
+            elif os.path.exists(path):
+                digest.update(f"{path}\0{self.file(path)}\n".encode("utf-8"))
+            else:
+                digest.update(f"{path}\0missing\n".encode("utf-8"))
+        return digest.hexdigest()
+
+
+# A step of the pipeline. run(config, patents) does the work, where patents is None for a full run or
+# the list of patents to limit the run to. A stage is skipped when the hash of its inputs and parameters
+# matches its last run and its outputs are unchanged since then, unless it is older than max_age hours.
+class Stage:
+
+    def __init__(self, name, deps, inputs, outputs, run, params=None, max_age=None):
+        self.name = name
+        self.deps = deps
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+        self.params = params or {}
+        self.max_age = max_age
+
+
+def run_retrieval(config, patents):
+    if not api_key:
+        print("No API_KEY set, using the saved Lens responses.")
+        return
+    if patents is None:
+        if not os.path.exists(config.input):
+            raise StageError(f"Input file not found: {config.input}")
+        patents = read_patent_list(config.input)
+        max_age = timedelta(hours=config.lens_max_age)
+    else:
+        max_age = None
+    process_patent_numbers(patents, LENS_DIR, config.workers, config.rate, batch_size=config.batch_size,
+                           max_age=max_age)
+
+
+def run_families(config, patents):
+    if not os.path.isdir(LENS_DIR):
+        raise StageError(f"No Lens responses found in {LENS_DIR}")
+    extract_patent_families(LENS_DIR, FAMILY_DIR, patent_numbers=patents)
+
+
+def run_enrich(config, patents):
+    if not api_key:
+        print("No API_KEY set, using the saved Lens member records.")
+        return
+    family_set = load_family_graph(FAMILY_DIR)
+    if family_set is None:
+        raise StageError(f"No family graph found in {FAMILY_DIR}")
+    max_age = timedelta(hours=config.lens_max_age) if patents is None else None
+    fetch_member_records(family_set, MEMBER_DIR, config.workers, config.rate, max_age=max_age, patents=patents)
+
+
+def run_scrape(config, patents):
+    family_set = load_family_graph(FAMILY_DIR)
+    if family_set is None:
+        raise StageError(f"No family graph found in {FAMILY_DIR}")
+
+    browser = get_default_browser()
+    if not browser and config.backend != "http":
+        raise StageError("Unable to detect the default browser; use --backend http to scrape without one")
+
+    os.makedirs(STATUS_DIR, exist_ok=True)
+    cache = None if config.no_cache else ScrapeCache(SCRAPE_CACHE_PATH)
+    lens = None if config.no_lens else LensRecords([LENS_DIR, MEMBER_DIR])
+    try:
+        if patents is None:
+            scrape_with_checkpoint(family_set, browser, CHECKPOINT_PATH, STATUS_PATH, False, config.workers,
+                                   DEFAULT_PAGES_PER_DRIVER, None, config.backend, cache, lens=lens)
+        else:
+            scrape_subset(family_set, patents, browser, CHECKPOINT_PATH, STATUS_PATH, config.workers,
+                          DEFAULT_PAGES_PER_DRIVER, None, config.backend, cache, lens=lens)
+    finally:
+        if cache is not None:
+            cache.save()
+            print(cache.summary())
+
+
+def run_render(config, patents):
+    if not os.path.exists(STATUS_PATH):
+        raise StageError(f"No status data found at {STATUS_PATH}")
+    # Only changed entries are rendered again, so a subset run renders the whole page as well
+    deduper = ClaimDeduper.build(iter_patents(STATUS_PATH)) if config.dedupe_claims else None
+    write_html(iter_patents(STATUS_PATH), config.output, deduper=deduper)
+
+
+# The pipeline's stages in dependency order
+def build_stages(config):
+    return [
+        Stage("retrieve", [], [config.input], [LENS_DIR], run_retrieval,
+              {"batch_size": config.batch_size}, config.lens_max_age),
+        Stage("families", ["retrieve"], [LENS_DIR],
+              [os.path.join(FAMILY_DIR, FAMILY_GRAPH_FILENAME), os.path.join(FAMILY_DIR, FAMILY_SET_FILENAME)],
+              run_families),
+        Stage("enrich", ["families"], [os.path.join(FAMILY_DIR, FAMILY_GRAPH_FILENAME)], [MEMBER_DIR],
+              run_enrich, {}, config.lens_max_age),
+        Stage("scrape", ["enrich"], [os.path.join(FAMILY_DIR, FAMILY_GRAPH_FILENAME), LENS_DIR, MEMBER_DIR],
+              [STATUS_PATH], run_scrape, {"backend": config.backend, "lens": not config.no_lens},
+              config.scrape_max_age),
+        Stage("render", ["scrape"], [STATUS_PATH], [config.output], run_render,
+              {"render_version": RENDER_VERSION, "dedupe_claims": config.dedupe_claims}),
+    ]
+
+
+# Order stages so each comes after the stages it depends on, keeping the selected ones
+def order_stages(stages, selected=None):
+    by_name = {stage.name: stage for stage in stages}
+    ordered, visiting, done = [], set(), set()
+
+    def visit(stage):
+        if stage.name in done:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Pipeline has a dependency cycle through {stage.name}")
+        visiting.add(stage.name)
+        for dep in stage.deps:
+            visit(by_name[dep])
+        visiting.discard(stage.name)
+        done.add(stage.name)
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return [stage for stage in ordered if selected is None or stage.name in selected]
+
+
+def load_state(path=STATE_PATH):
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {"stages": {}, "files": {}}
+
+
+def save_state(state, path=STATE_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# Reason a stage has to run, or None if its last run is still valid
+def stage_reason(stage, previous, input_hash, output_hash, now):
+    if previous is None:
+        return "never run"
+    if previous["inputs"] != input_hash:
+        return "inputs changed"
+    if not all(os.path.exists(path) for path in stage.outputs):
+        return "outputs missing"
+    if previous["outputs"] != output_hash:
+        return "outputs changed since the last run"
+    if stage.max_age is not None and now - previous["finished_at"] >= stage.max_age * 3600:
+        return f"older than {stage.max_age:g} hours"
+    return None
+
+
+# Run the pipeline. Each stage is skipped if its inputs are unchanged since its last run, unless force.
+# With patents, every selected stage runs for just those patents and the saved state is not updated,
+# since the stages' outputs no longer correspond to a full run. With dry_run, only report what would run.
+def run_pipeline(config, selected=None, patents=None, force=False, dry_run=False, state_path=STATE_PATH):
+    state = load_state(state_path)
+    hasher = FileHasher(state["files"])
+    ran = []
+
+    for stage in order_stages(build_stages(config), selected):
+        input_hash = hasher.paths(stage.inputs, stage.params)
+        output_hash = hasher.paths(stage.outputs)
+        previous = state["stages"].get(stage.name)
+        if patents is not None:
+            reason = f"{len(patents)} patent(s) requested"
+        elif force:
+            reason = "forced"
+        else:
+            reason = stage_reason(stage, previous, input_hash, output_hash, time.time())
+
+        if reason is None:
+            print(f"[=] {stage.name}: up to date")
+            continue
+        if dry_run:
+            print(f"[>] {stage.name}: would run ({reason})")
+            # Later stages may or may not change once this one has run
+            continue
+
+        print(f"[>] {stage.name}: running ({reason})")
+        try:
+            with metrics.timer("stage", stage=stage.name):
+                stage.run(config, patents)
+        except StageError as e:
+            print(f"[!] {stage.name} failed: {e}")
+            save_state(state, state_path)
+            return ran, False
+        ran.append(stage.name)
+
+        if patents is None:
+            record_stage(state, hasher, stage, input_hash)
+        save_state(state, state_path)
+        print(f"[✓] {stage.name}: done")
+
+    # A dry run leaves the saved state (and the file hash cache) as it was
+    if not dry_run:
+        save_state(state, state_path)
+    return ran, True
+
+
+def record_stage(state, hasher, stage, input_hash):
+    state["stages"][stage.name] = {
+        "inputs": input_hash,
+        "outputs": hasher.paths(stage.outputs),
+        "finished_at": time.time(),
+    }
+
+
+# Run retrieval, family extraction and scraping as one stream, so each Lens response is extracted as soon
+# as it arrives and each new family member is scraped right away, then render the page. Members are
+# filled from the Lens records saved by the last enrich stage, which does not run here. Every other
+# stage runs, and is recorded in the saved state as if it had run on its own.
+def run_streamed(config, force=False, state_path=STATE_PATH):
+    if not os.path.exists(config.input):
+        print(f"[!] Input file not found: {config.input}")
+        return [], False
+    browser = get_default_browser()
+    if not browser and config.backend != "http":
+        print("[!] Unable to detect the default browser; use --backend http to scrape without one")
+        return [], False
+    if not api_key:
+        print("No API_KEY set, streaming the saved Lens responses.")
+
+    os.makedirs(STATUS_DIR, exist_ok=True)
+    cache = None if config.no_cache else ScrapeCache(SCRAPE_CACHE_PATH)
+    lens = None if config.no_lens else LensRecords([LENS_DIR, MEMBER_DIR])
+    print("[>] retrieve, families, scrape: streaming")
+    try:
+        with metrics.timer("stage", stage="stream"):
+            run_streaming(read_patent_list(config.input), LENS_DIR, FAMILY_DIR, CHECKPOINT_PATH, STATUS_PATH,
+                          fetch_workers=config.workers, scrape_workers=config.workers, backend=config.backend,
+                          browser=browser, lens_rate=config.rate,
+                          max_age=None if force else timedelta(hours=config.lens_max_age), fetch=bool(api_key),
+                          cache=cache, lens=lens, queue_size=config.queue_size)
+    finally:
+        if cache is not None:
+            cache.save()
+            print(cache.summary())
+    print("[>] render: running")
+    with metrics.timer("stage", stage="render"):
+        run_render(config, None)
+
+    ran = ["retrieve", "families", "scrape", "render"]
+    state = load_state(state_path)
+    hasher = FileHasher(state["files"])
+    for stage in build_stages(config):
+        if stage.name in ran:
+            record_stage(state, hasher, stage, hasher.paths(stage.inputs, stage.params))
+    save_state(state, state_path)
+    print(f"[✓] {', '.join(ran)}: done")
+    return ran, True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the patent pipeline: Lens retrieval -> family extraction -> Lens enrichment -> status scraping -> "
+                    "rendering")
+    parser.add_argument("stages", nargs="*",
+                        help="stages to run: retrieve, families, enrich, scrape, render (default: all)")
+    parser.add_argument("--patents", nargs="+", default=None,
+                        help="only run for these patents (main patents or family members)")
+    parser.add_argument("--force", action="store_true", help="run stages even if their inputs did not change")
+    parser.add_argument("--dry-run", action="store_true", help="only show which stages would run")
+    parser.add_argument("--input", default=INPUT_FILE, help="file listing the main patents, one per line")
+    parser.add_argument("--output", default=OUTPUT_HTML, help="HTML file to write")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent requests or browsers")
+    parser.add_argument("--rate", type=float, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help="maximum requests per minute sent to Lens")
+    parser.add_argument("--batch-size", type=int, default=None, help="patent numbers per Lens search request")
+    parser.add_argument("--backend", choices=["selenium", "http"], default="selenium",
+                        help="how Google Patents pages are scraped")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="scrape every selected patent again instead of reusing fresh cached results")
+    parser.add_argument("--lens-max-age", type=float, default=DEFAULT_LENS_MAX_AGE,
+                        help="hours before Lens responses are refreshed even if input.txt did not change")
+    parser.add_argument("--no-lens", action="store_true",
+                        help="scrape every field instead of filling them from the saved Lens records first")
+    parser.add_argument("--stream", action="store_true",
+                        help="overlap retrieval, family extraction and scraping instead of running them in turn")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="with --stream, maximum patents waiting between two stages")
+    parser.add_argument("--dedupe-claims", action="store_true",
+                        help="render near-duplicate claim sets once, with a diff for each other patent")
+    parser.add_argument("--scrape-max-age", type=float, default=DEFAULT_SCRAPE_MAX_AGE,
+                        help="hours before statuses are scraped again even if the families did not change")
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+    unknown = set(args.stages) - {stage.name for stage in build_stages(args)}
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+    if args.stream and (args.stages or args.patents or args.dry_run):
+        parser.error("--stream runs every stage and cannot be combined with stages, --patents or --dry-run")
+
+    start = time.perf_counter()
+    metrics.start_run("pipeline", args.metrics_dir, args.profile)
+    try:
+        if args.stream:
+            ran, ok = run_streamed(args, args.force)
+        else:
+            ran, ok = run_pipeline(args, set(args.stages) or None, args.patents, args.force, args.dry_run)
+    finally:
+        metrics.finish_run()
+    print(f"\n{'Finished' if ok else 'Stopped'} in {time.perf_counter() - start:.1f}s; "
+          f"ran {', '.join(ran) if ran else 'no stages'}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# HTTP status codes that are worth retrying after a backoff
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Headers a server may use to tell us how long to wait before retrying
+RETRY_AFTER_HEADERS = ("Retry-After", "x-rate-limit-retry-after-seconds")
+
+
+# Thread-safe limiter that spaces out requests to stay under a requests-per-minute quota
+class RateLimiter:
+
+    def __init__(self, requests_per_minute=None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    # Block until the caller is allowed to send its next request
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+    # Hold back every caller for the given number of seconds (e.g. after a 429)
+    def pause(self, seconds):
+        with self._lock:
+            self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+# Create a keep-alive session whose connection pool can serve the given number of workers
+def create_session(pool_size=10):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Read the server's requested retry delay in seconds, if it sent one
+def get_retry_after(response):
+    for header in RETRY_AFTER_HEADERS:
+        value = response.headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            continue
+    return None
+
+
+# Send a request, retrying connection errors, 429 and 5xx responses with exponential backoff
+def request_with_backoff(session, method, url, limiter=None, max_retries=5, backoff=1.0, max_backoff=60.0,
+                         timeout=30, **kwargs):
+    for attempt in range(max_retries + 1):
+        if limiter:
+            limiter.wait()
+
+        delay = min(backoff * (2 ** attempt), max_backoff)
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            reason = "timeout" if isinstance(e, requests.Timeout) else "connection"
+            metrics.count("http_errors_total", reason=reason)
+            if attempt == max_retries:
+                raise
+            metrics.count("http_retries_total", reason=reason)
+        else:
+            metrics.observe("http_request_seconds", time.perf_counter() - start, method=method)
+            metrics.count("http_responses_total", code=response.status_code)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                metrics.count("bytes_read_total", len(response.content), source="http")
+                return response
+            metrics.count("http_retries_total", reason=str(response.status_code))
+            retry_after = get_retry_after(response)
+            if retry_after is not None:
+                delay = min(retry_after, max_backoff)
+            # A quota error applies to every worker sharing the limiter, not just this one
+            if response.status_code == 429 and limiter:
+                limiter.pause(delay)
+            response.close()
+
+        # Add jitter so workers that failed together do not retry together
+        time.sleep(delay + random.uniform(0, delay * 0.1))
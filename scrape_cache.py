@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Days a scraped record stays fresh, by the last status observed for the patent
+TERMINAL_TTL_DAYS = 365
+ACTIVE_TTL_DAYS = 7
+NOT_FOUND_TTL_DAYS = 0
+
+# Statuses a patent does not come back from
+TERMINAL_STATUSES = ("expired", "withdrawn", "abandoned", "ceased", "not-in-force", "revoked", "lapsed")
+
+# Default number of patents kept in the cache
+DEFAULT_MAX_ENTRIES = 100000
+
+
+# Number of seconds a record with the given status may be served from the cache
+def ttl_for_status(status):
+    s = (status or "").lower()
+    if not s or "not found" in s:
+        days = NOT_FOUND_TTL_DAYS
+    elif any(w in s for w in TERMINAL_STATUSES):
+        days = TERMINAL_TTL_DAYS
+    else:
+        days = ACTIVE_TTL_DAYS
+    return days * 24 * 60 * 60
+
+
+# Persistent cache of scraped patent records keyed by canonical patent number. Records expire
+# according to their status and the least recently used entries are evicted beyond max_entries.
+class ScrapeCache:
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.expired = self.evicted = 0
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = OrderedDict(json.load(f))
+
+    # Return the cached record for a patent if it is still fresh, otherwise None
+    def get(self, patent):
+        with self._lock:
+            entry = self.entries.get(patent)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.time() - entry["scraped_at"] >= ttl_for_status(entry["record"].get("status")):
+                self.expired += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(patent)
+            return entry["record"]
+
+    # Store a freshly scraped record
+    def put(self, patent, record):
+        with self._lock:
+            self.entries[patent] = {"scraped_at": time.time(), "record": record}
+            self.entries.move_to_end(patent)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evicted += 1
+
+    # Write the cache to disk, replacing the previous file atomically
+    def save(self):
+        with self._lock:
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(self.path + ".tmp", self.path)
+
+    def summary(self):
+        lookups = self.hits + self.misses + self.expired
+        rate = 100 * self.hits / lookups if lookups else 0
+        return (f"Scrape cache: {self.hits} hit(s), {self.misses} miss(es), {self.expired} expired "
+                f"({rate:.0f}% hit rate), {self.evicted} evicted, {len(self.entries)} stored.")
+
+
+# Result mapping that stores every record written to it in the cache as well
+class CachedResults:
+
+    def __init__(self, results, cache):
+        self.results = results
+        self.cache = cache
+
+    def __setitem__(self, idx, record):
+        self.cache.put(record["patent_number"], record)
+        self.results[idx] = record
+
+    def __contains__(self, idx):
+        return idx in self.results
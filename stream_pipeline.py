@@ -0,0 +1,217 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import metrics
+from family_graph import FamilyGraph, save_family_data
+from google_patents_http import PatentParseError, fetch_patent_details
+from google_scraper import (DEFAULT_PAGES_PER_DRIVER, CheckpointWriter, compact_checkpoint, create_webdriver,
+                            get_patent_details, run_driver_pool)
+from lens_archive import response_exists
+from lens_enrichment import LensMergedResults, lens_status_record, merge_lens_fields, missing_fields
+from patent_family_retrieval_Lens import timed_extract_extended_family
+from patent_ids import dedupe_patent_ids
+from patent_retrieval_Lens import is_fresh, load_manifest, save_manifest, save_patent_json_response
+from request_utils import RateLimiter, create_session
+
+# Maximum number of items waiting between two stages, which keeps memory flat on large portfolios
+DEFAULT_QUEUE_SIZE = 100
+
+# Number of processes decoding Lens responses
+DEFAULT_EXTRACT_WORKERS = 2
+
+
+# Streams patents from Lens retrieval through family extraction to status scraping. Each stage runs as
+# a group of asyncio workers connected by bounded queues: a Lens response is handed to family extraction
+# as soon as it is saved, and each newly discovered family member goes straight to a scraping worker.
+# Blocking work (HTTP requests, browsers, JSON decoding) runs in threads or worker processes.
+class StreamingPipeline:
+
+    def __init__(self, lens_dir, family_dir, checkpoint_path, fetch_workers=4, scrape_workers=4,
+                 extract_workers=DEFAULT_EXTRACT_WORKERS, backend="http", browser=None, lens_rate=None,
+                 scrape_rate=None, max_age=None, fetch=True, cache=None, lens=None,
+                 pages_per_driver=DEFAULT_PAGES_PER_DRIVER, queue_size=DEFAULT_QUEUE_SIZE):
+        self.lens_dir = lens_dir
+        self.family_dir = family_dir
+        self.checkpoint_path = checkpoint_path
+        self.fetch_workers = fetch_workers
+        self.scrape_workers = scrape_workers
+        self.extract_workers = extract_workers
+        self.backend = backend
+        self.browser = browser
+        self.lens_limiter = RateLimiter(lens_rate)
+        self.scrape_limiter = RateLimiter(scrape_rate)
+        self.max_age = max_age
+        self.fetch = fetch
+        self.cache = cache
+        self.lens = lens
+        self.pages_per_driver = pages_per_driver
+        self.queue_size = queue_size
+
+        self.extended_families = {}
+        self.scheduled = set()
+        self.failed = []
+
+    # Lens retrieval: save each main patent's response, then pass the file on to extraction.
+    # Responses that are still fresh, or every response when fetching is off, are passed on directly.
+    async def fetch_worker(self, fetch_queue, extract_queue, session, manifest):
+        while True:
+            patent = await fetch_queue.get()
+            if patent is None:
+                return
+            path = os.path.join(self.lens_dir, f"{patent}.json")
+            if self.fetch and not is_fresh(patent, self.lens_dir, manifest, self.max_age):
+                await asyncio.to_thread(self.fetch_response, patent, session, manifest)
+            if response_exists(path):
+                await extract_queue.put(path)
+
+    def fetch_response(self, patent, session, manifest):
+        with metrics.timer("lens_fetch", patent=patent):
+            save_patent_json_response(patent, self.lens_dir, session, self.lens_limiter, 30, manifest)
+
+    # Family extraction: decode a response's extended family and queue members not seen before
+    async def extract_worker(self, extract_queue, scrape_queue, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            path = await extract_queue.get()
+            if path is None:
+                return
+            result, seconds, size = await loop.run_in_executor(executor, timed_extract_extended_family, path,
+                                                               self.family_dir)
+            metrics.observe("item_seconds", seconds, step="family_extract")
+            metrics.count("bytes_read_total", size, source="data_Lens")
+            if result is None:
+                metrics.count("not_found_total")
+                continue
+            main_patent, family = result
+            self.extended_families[main_patent] = family
+            for member in dedupe_patent_ids(family):
+                if member not in self.scheduled:
+                    self.scheduled.add(member)
+                    await scrape_queue.put(member)
+
+    # Scrape one patent with this worker's session or browser. Patents the saved Lens records fill
+    # completely are not scraped, and fresh cached records are served directly. Related patents are
+    # filled in from the final family graph when the checkpoint is compacted.
+    def scrape(self, patent, session, driver):
+        fields = self.lens.fields(patent) if self.lens is not None else {}
+        if fields and not missing_fields(fields):
+            metrics.count("lens_records_total", source="complete")
+            return lens_status_record(0, patent, fields)
+
+        record = self.cache.get(patent) if self.cache is not None else None
+        if record is not None:
+            metrics.count("cache_hits_total")
+        else:
+            if driver is not None:
+                self.scrape_limiter.wait()
+                with metrics.timer("browser_page", patent=patent):
+                    record = get_patent_details(0, patent, driver)
+            else:
+                with metrics.timer("http_page", patent=patent):
+                    record = fetch_patent_details(0, patent, session, limiter=self.scrape_limiter)
+            if self.cache is not None:
+                self.cache.put(patent, record)
+        return merge_lens_fields(record, fields)
+
+    # Status scraping: each worker keeps its own browser (recycled after pages_per_driver pages) for the
+    # selenium backend; the http backend shares one session. Failed pages are retried at the end.
+    async def scrape_worker(self, scrape_queue, writer, session):
+        driver = None
+        pages = 0
+        try:
+            while True:
+                patent = await scrape_queue.get()
+                if patent is None:
+                    return
+                try:
+                    if self.backend == "selenium" and (driver is None or pages >= self.pages_per_driver):
+                        if driver is not None:
+                            await asyncio.to_thread(driver.quit)
+                        driver = None
+                        driver = await asyncio.to_thread(create_webdriver, self.browser)
+                        pages = 0
+                    pages += 1
+                    record = await asyncio.to_thread(self.scrape, patent, session, driver)
+                except Exception as e:
+                    metrics.count("scrape_errors_total", backend=self.backend)
+                    print(f"Error processing {patent}: {e}")
+                    # The http backend hands only pages it could not parse to the browser, not network errors
+                    if self.backend == "selenium" or isinstance(e, PatentParseError):
+                        self.failed.append(patent)
+                    if driver is not None:
+                        try:
+                            await asyncio.to_thread(driver.quit)
+                        except Exception:
+                            pass
+                        driver = None
+                else:
+                    # A failure to save the record is not a scraping error and is not retried
+                    writer[patent] = record
+        finally:
+            if driver is not None:
+                await asyncio.to_thread(driver.quit)
+
+    # Stream the main patents through every stage. Returns the family graph of the extracted families.
+    async def run(self, patent_numbers):
+        # asyncio.to_thread runs on the loop's default executor, which only has cpu_count + 4 threads. Give
+        # every fetch and scrape worker (and the extraction workers) a thread of its own, so a slow browser
+        # page cannot hold up Lens fetching.
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(self.fetch_workers + self.scrape_workers + self.extract_workers))
+
+        fetch_queue = asyncio.Queue(self.queue_size)
+        extract_queue = asyncio.Queue(self.queue_size)
+        scrape_queue = asyncio.Queue(self.queue_size)
+        os.makedirs(self.lens_dir, exist_ok=True)
+        os.makedirs(self.family_dir, exist_ok=True)
+        manifest = load_manifest(self.lens_dir)
+
+        lens_session = create_session(pool_size=self.fetch_workers)
+        scrape_session = create_session(pool_size=self.scrape_workers)
+        writer = CheckpointWriter(self.checkpoint_path)
+        with lens_session, scrape_session, ProcessPoolExecutor(self.extract_workers) as executor:
+            try:
+                fetchers = [asyncio.create_task(self.fetch_worker(fetch_queue, extract_queue, lens_session, manifest))
+                            for _ in range(self.fetch_workers)]
+                extractors = [asyncio.create_task(self.extract_worker(extract_queue, scrape_queue, executor))
+                              for _ in range(self.extract_workers)]
+                scrapers = [asyncio.create_task(self.scrape_worker(scrape_queue, writer, scrape_session))
+                            for _ in range(self.scrape_workers)]
+
+                # Each stage is told to stop once the stage before it has drained
+                for patent in patent_numbers:
+                    await fetch_queue.put(patent)
+                for stage_queue, workers in ((fetch_queue, fetchers), (extract_queue, extractors),
+                                             (scrape_queue, scrapers)):
+                    for _ in workers:
+                        await stage_queue.put(None)
+                    await asyncio.gather(*workers)
+
+                # Pages the http backend could not parse get one more try in a browser
+                if self.failed and self.browser:
+                    print(f"Falling back to the browser for {len(self.failed)} patent(s).")
+                    items = [(patent, patent, []) for patent in self.failed]
+                    partial = {}
+                    if self.lens is not None:
+                        partial = {patent: self.lens.fields(patent) for patent in self.failed}
+                    await asyncio.to_thread(run_driver_pool, items, LensMergedResults(writer, partial), self.browser,
+                                            self.scrape_workers, self.pages_per_driver, self.scrape_limiter)
+            finally:
+                writer.close()
+                save_manifest(self.lens_dir, manifest)
+
+        family_graph = FamilyGraph.build(self.extended_families)
+        save_family_data(family_graph, self.family_dir)
+        return family_graph
+
+
+# Run the streaming pipeline over a list of main patents and compact the scraped records into
+# status_path in family graph order. Returns the family graph.
+def run_streaming(patent_numbers, lens_dir, family_dir, checkpoint_path, status_path, **options):
+    pipeline = StreamingPipeline(lens_dir, family_dir, checkpoint_path, **options)
+    family_graph = asyncio.run(pipeline.run(patent_numbers))
+    count = compact_checkpoint(checkpoint_path, status_path, family_graph)
+    print(f"Streamed {len(family_graph.families)} famil{'y' if len(family_graph.families) == 1 else 'ies'}: "
+          f"{len(pipeline.scheduled)} patent(s) scraped, {count} record(s) saved to {status_path}.")
+    return family_graph
@@ -0,0 +1,44 @@
+from citation_graph import CitationGraph, npl_key
+
+# (citing, cited) pairs keyed as citation_edges keys them: normalized patent numbers and NPL IDs
+EDGES = [
+    ("US1000000", "US2000000"),
+    ("US1000000", npl_key("smith 2004")),
+    ("US3000000", "US1000000"),
+    ("US3000000", "US1000000"),
+    ("EP4000000", "US3000000"),
+]
+
+
+def test_save_and_load_round_trip(tmp_path):
+    graph = CitationGraph.build(EDGES)
+    path = str(tmp_path / "patent_citation_graph.bin")
+    graph.save(path)
+
+    with CitationGraph.load(path) as loaded:
+        assert len(loaded) == len(graph) == 5
+        # The repeated edge is stored once
+        assert loaded.edge_count == graph.edge_count == 4
+        assert [loaded.node_id(node) for node in range(len(loaded))] == \
+            [graph.node_id(node) for node in range(len(graph))]
+        # Lookups normalize the patent number
+        assert sorted(loaded.cited("US1000000B2")) == ["NPL:smith 2004", "US2000000"]
+        assert loaded.citing("US1000000B2") == ["US3000000"]
+        assert loaded.in_degree("US1000000B2") == 1 and loaded.out_degree("US1000000B2") == 2
+        assert loaded.k_hop(["US2000000A1"], hops=3) == {"US1000000": 1, "US3000000": 2, "EP4000000": 3}
+        assert "US9999999B2" not in loaded
+
+
+# The graph of the saved Lens responses reads back the same from its file
+def test_saved_responses_round_trip(tmp_path):
+    graph = CitationGraph.from_directories(["data_Lens"])
+    path = str(tmp_path / "patent_citation_graph.bin")
+    graph.save(path)
+
+    with CitationGraph.load(path) as loaded:
+        assert len(loaded) == len(graph) and loaded.edge_count == graph.edge_count
+        for node in range(len(graph)):
+            patent = graph.node_id(node)
+            assert loaded.node(patent) == node
+            assert loaded.cited(patent) == graph.cited(patent)
+            assert loaded.citing(patent) == graph.citing(patent)
@@ -0,0 +1,34 @@
+import time
+
+import pytest
+
+from patent_claim import find_claim_references
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("The device of claim 1, wherein", [1]),
+    ("The device of any of claims 1, 2 or 4.", [1, 2, 4]),
+    ("The device of claims 1-3 and 5, wherein", [1, 2, 3, 5]),
+    ("The device of claims 1 to 5, further comprising", [1, 2, 3, 4, 5]),
+    ("The device of claim 1 or 2 wherein", [1, 2]),
+    ("The device of claim 1 and claim 2, further", [1, 2]),
+    ("The device of claims 1, 2, and 3", [1, 2, 3]),
+    # A number after a separator that starts a quantity is not a claim
+    ("The device of claim 1, and 3 arms extending from the body", [1]),
+    ("The device of claim 1, 2 arms and 3 legs", [1]),
+])
+def test_claim_reference_lists(text, expected):
+    assert find_claim_references(text) == expected
+
+
+# Long whitespace runs after a reference must not make the pattern backtrack
+@pytest.mark.parametrize("text", [
+    "claim 1" + " " * 8000 + "x",
+    "claim 1," + " " * 8000 + "x",
+    "claim 1 and" + " " * 8000 + "x",
+    "claims" + " " * 8000,
+])
+def test_long_whitespace_runs(text):
+    start = time.perf_counter()
+    find_claim_references(text)
+    assert time.perf_counter() - start < 0.1
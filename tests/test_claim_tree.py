@@ -0,0 +1,46 @@
+import pytest
+
+from patent_claim import build_claim_tree, parse_claims, tree_from_dict
+
+
+# Claim k depends on "any one of claims 1 to k-1", as in many European and Canadian patents
+def chained_claims(count):
+    claims = ["1. A device comprising a widget."]
+    claims += [f"{k}. The device according to any one of claims 1 to {k - 1}, wherein part {k} is blue."
+               for k in range(2, count + 1)]
+    return claims
+
+
+# Each claim is rendered once, however many claims it depends on
+@pytest.mark.parametrize("count", [2, 12, 30, 1000])
+def test_chained_claims_render_once(count):
+    tree = build_claim_tree(chained_claims(count))
+    lines = tree.render().splitlines()
+
+    assert len(lines) == count + 1
+    assert sum(line.lstrip().startswith("- Claim ") for line in lines) == count
+    # The other claims each one depends on are noted instead
+    if count > 2:
+        assert "  - Claim 3 (also depends on claim 2): " in tree.render()
+        assert f"  - Claim {count} (also depends on claims 2-{count - 1}): " in tree.render()
+
+
+def test_shared_claim_under_its_lowest_parent():
+    tree = build_claim_tree([
+        "1. A device comprising a widget.",
+        "2. The device of claim 1, wherein the widget is blue.",
+        "3. A system for controlling a widget.",
+        "4. The device of claim 2 or the system of claim 3, wherein the widget is removable.",
+    ])
+
+    assert tree.render() == (
+        "\n- Claim 1: A device comprising a widget.\n"
+        "  - Claim 2: The device of claim 1, wherein the widget is blue.\n"
+        "    - Claim 4 (also depends on claim 3): "
+        "The device of claim 2 or the system of claim 3, wherein the widget is removable.\n"
+        "\n- Claim 3: A system for controlling a widget.\n"
+    )
+    # Claim 4 is still a child of both claims, and renders the same after a round trip through the cache
+    assert tree.node(3).children == [tree.node(4)]
+    claims = [f"{node.number}. {node.text}" for node in tree.nodes.values()]
+    assert tree_from_dict(parse_claims(claims)).render() == tree.render()
@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import google_patents_http
+import request_utils
+from google_patents_http import PatentParseError, parse_patent_html
+from google_scraper import run_http_pool
+from request_utils import RateLimiter
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load_fixture(name, mode="rb"):
+    with open(os.path.join(FIXTURES, name), mode) as f:
+        return f.read()
+
+
+# The Google Patents page of US8333778 and the record the Selenium scraper saved for it
+@pytest.fixture
+def us8333778():
+    return load_fixture("US8333778.html"), json.loads(load_fixture("US8333778.json", "r"))
+
+
+def test_parse_matches_selenium_record(us8333778):
+    page, expected = us8333778
+    record = parse_patent_html(page, expected["index"], expected["patent_number"], expected["link"],
+                               expected["related_patents"])
+
+    assert list(record) == list(expected)
+    for field in expected:
+        assert record[field] == expected[field], field
+
+
+def test_parse_errors():
+    with pytest.raises(PatentParseError):
+        parse_patent_html(b"<html><body><p>Sorry, we could not find that page.</p></body></html>", 0, "US1", "")
+    with pytest.raises(PatentParseError):
+        parse_patent_html(b"", 0, "US1", "")
+
+
+# Only pages that were fetched but could not be parsed are handed back for the browser fallback
+def test_http_pool_falls_back_on_parse_errors_only(us8333778, monkeypatch):
+    page, _ = us8333778
+    pages = {"US8333778": (200, page), "US1": (200, b"<html><body>Unexpected page</body></html>"),
+             "US2": (503, b"Service unavailable")}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, body = pages[self.path.split("/")[2]]
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(google_patents_http, "PATENT_URL",
+                        f"http://127.0.0.1:{server.server_address[1]}/patent/{{}}/en")
+    monkeypatch.setattr(request_utils.time, "sleep", lambda seconds: None)
+
+    items = [(0, "US8333778", []), (1, "US1", []), (2, "US2", [])]
+    results = {}
+    try:
+        fallback = run_http_pool(items, results, 2, RateLimiter())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert fallback == [(1, "US1", [])]
+    assert list(results) == [0]
+    assert results[0]["title"] == "Cordless hand-held ultrasonic cautery cutting device"
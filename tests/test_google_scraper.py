@@ -0,0 +1,105 @@
+import json
+import signal
+import threading
+import time
+
+import pytest
+
+import google_scraper
+from google_scraper import CheckpointWriter, RateLimiter, compact_checkpoint, load_checkpoint, run_driver_pool
+
+
+class FakeDriver:
+    def quit(self):
+        pass
+
+
+# Replace the browser with a fake one that records the patents it loads
+@pytest.fixture
+def loaded(monkeypatch):
+    patents = []
+
+    def get_patent_details(index, patent_num, driver, related_patents=None):
+        patents.append(patent_num)
+        time.sleep(0.01)
+        return {"index": index, "patent_number": patent_num, "related_patents": related_patents or []}
+
+    monkeypatch.setattr(google_scraper, "create_webdriver", lambda browser: FakeDriver())
+    monkeypatch.setattr(google_scraper, "get_patent_details", get_patent_details)
+    return patents
+
+
+def work_items(count):
+    return [(idx, f"US{idx}", []) for idx in range(count)]
+
+
+def test_driver_pool_scrapes_every_item(loaded):
+    results = {}
+    run_driver_pool(work_items(20), results, "chrome", 3, 5, RateLimiter())
+    assert sorted(results) == list(range(20))
+    assert sorted(loaded) == sorted(f"US{idx}" for idx in range(20))
+
+
+# Ctrl-C lets the pages in progress finish, then stops every worker before returning
+def test_driver_pool_stops_on_ctrl_c(loaded, monkeypatch, tmp_path):
+    get_patent_details = google_scraper.get_patent_details
+    main_thread = threading.main_thread().ident
+
+    def interrupted(index, patent_num, driver, related_patents=None):
+        if index == 5:
+            signal.pthread_kill(main_thread, signal.SIGINT)
+        return get_patent_details(index, patent_num, driver, related_patents)
+
+    monkeypatch.setattr(google_scraper, "get_patent_details", interrupted)
+    writer = CheckpointWriter(str(tmp_path / "checkpoint.jsonl"))
+    with pytest.raises(KeyboardInterrupt):
+        try:
+            run_driver_pool(work_items(200), writer, "chrome", 2, 50, RateLimiter())
+        finally:
+            writer.close()
+
+    # No worker is still running, so nothing is written to the closed checkpoint
+    scraped = len(loaded)
+    time.sleep(0.1)
+    assert len(loaded) == scraped < 20
+
+
+# A failure to save a result is not retried as a scraping error: the pool stops and re-raises it
+def test_driver_pool_stops_on_writer_error(loaded, tmp_path):
+    writer = CheckpointWriter(str(tmp_path / "checkpoint.jsonl"))
+    writer.close()
+
+    with pytest.raises(ValueError):
+        run_driver_pool(work_items(50), writer, "chrome", 2, 50, RateLimiter())
+    assert len(loaded) <= 2
+
+
+# Records survive a crash halfway through a line and a resumed run, and compact into the status file in
+# family set order, one record per spelling of each patent number (related patents are deduplicated)
+def test_checkpoint_resume_and_compact(tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.jsonl")
+    family_set = {"US1000000B2": ["US2000000"], "US1000000": ["US3000000"], "US2000000": ["US1000000B2"]}
+
+    writer = CheckpointWriter(checkpoint_path)
+    writer[0] = {"patent_number": "US1000000", "status": "Pending"}
+    writer[0] = {"patent_number": "US1000000", "status": "Active"}
+    writer.close()
+    with open(checkpoint_path, "a", encoding="utf-8") as f:
+        f.write('{"patent_number": "US2000000", "sta')
+
+    writer = CheckpointWriter(checkpoint_path, resume=True)
+    writer[1] = {"patent_number": "US2000000", "status": "Expired"}
+    writer.close()
+    assert sorted(load_checkpoint(checkpoint_path)) == ["US1000000", "US2000000"]
+
+    status_path = str(tmp_path / "status.json")
+    assert compact_checkpoint(checkpoint_path, status_path, family_set) == 3
+    with open(status_path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    assert records == [
+        {"patent_number": "US1000000B2", "status": "Active", "index": 0,
+         "related_patents": ["US2000000", "US3000000"]},
+        {"patent_number": "US1000000", "status": "Active", "index": 0,
+         "related_patents": ["US2000000", "US3000000"]},
+        {"patent_number": "US2000000", "status": "Expired", "index": 1, "related_patents": ["US1000000"]},
+    ]
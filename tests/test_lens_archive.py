@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+
+import lens_archive
+from lens_archive import ARCHIVE_INDEX, LensArchive, load_records, load_response, pack, response_paths, unpack
+
+SAMPLES = ("US8333778", "US9017355", "US9161769")
+
+
+# A response directory with a few of the saved Lens responses
+def copy_samples(directory):
+    os.makedirs(directory, exist_ok=True)
+    responses = {}
+    for patent in SAMPLES:
+        shutil.copy(os.path.join("data_Lens", f"{patent}.json"), directory)
+        with open(os.path.join(directory, f"{patent}.json"), "r", encoding="utf-8") as f:
+            responses[patent] = json.load(f)
+    return responses
+
+
+def test_pack_and_unpack_round_trip(tmp_path):
+    directory = str(tmp_path / "data_Lens")
+    responses = copy_samples(directory)
+
+    assert pack(directory) == len(SAMPLES)
+    assert not any(name.endswith(".json") for name in os.listdir(directory))
+    paths = response_paths(directory)
+    assert [os.path.basename(path) for path in paths] == [f"{patent}.json" for patent in SAMPLES]
+    for path, patent in zip(paths, SAMPLES):
+        assert load_response(path) == responses[patent]
+        # Archived records only hold the fields asked for
+        records = load_records(path, ("lens_id",))
+        assert records == [{"lens_id": record["lens_id"]} for record in responses[patent]["data"]]
+
+    assert unpack(directory) == len(SAMPLES)
+    assert sorted(os.listdir(directory)) == [f"{patent}.json" for patent in SAMPLES]
+    for patent in SAMPLES:
+        with open(os.path.join(directory, f"{patent}.json"), "r", encoding="utf-8") as f:
+            assert json.load(f) == responses[patent]
+
+
+def test_put_and_compact(tmp_path):
+    directory = str(tmp_path / "data_Lens")
+    responses = copy_samples(directory)
+    pack(directory)
+    archive = lens_archive.open_archive(directory)
+
+    replaced = {"total": 0, "data": []}
+    archive.put(SAMPLES[0], replaced)
+    archive.put(SAMPLES[0], responses[SAMPLES[0]])
+    before = archive.disk_size()
+    archive.compact()
+
+    assert archive.disk_size() < before
+    reopened = LensArchive(directory)
+    assert list(reopened) == list(SAMPLES)
+    for patent in SAMPLES:
+        assert reopened.get(patent) == responses[patent]
+
+
+# A write cut short leaves an unfinished index line; a later put starts a new line after it, so the
+# archive stays readable and only the unfinished entry is lost
+def test_put_after_unfinished_index_line(tmp_path):
+    directory = str(tmp_path / "data_Lens")
+    responses = copy_samples(directory)
+    pack(directory)
+    index_path = os.path.join(directory, ARCHIVE_INDEX)
+    with open(index_path, "a", encoding="utf-8") as f:
+        f.write('{"patent": "US0000001", "segm')
+
+    archive = LensArchive(directory)
+    assert list(archive) == list(SAMPLES)
+    archive.put("US0000002", {"total": 0, "data": []})
+
+    reopened = LensArchive(directory)
+    assert list(reopened) == ["US0000002", *SAMPLES]
+    assert reopened.get("US0000002") == {"total": 0, "data": []}
+    assert reopened.get(SAMPLES[0]) == responses[SAMPLES[0]]
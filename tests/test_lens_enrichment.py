@@ -0,0 +1,56 @@
+from lens_enrichment import LensMergedResults, format_claims, lens_fields
+
+
+def lens_record(claim_text, legal_status):
+    return {
+        "date_published": "2015-04-28",
+        "jurisdiction": "US",
+        "kind": "B2",
+        "claims": [{"lang": "en", "claims": [{"claim_text": [claim_text]}]}],
+        "legal_status": legal_status,
+    }
+
+
+# Lens runs the claim elements together; they are split into lines as on Google Patents
+def test_claim_elements_on_separate_lines():
+    claims = format_claims([{"lang": "en", "claims": [
+        {"claim_text": ["1. An assembly , comprising: a shaft; a grip dock; and a hand grip comprising: "
+                        "a battery; or a cell."]},
+        {"claim_text": ["The assembly according to claim 1 , wherein the grip is removable."]},
+    ]}])
+
+    assert claims == [
+        "1. An assembly, comprising:\na shaft;\na grip dock; and\na hand grip comprising:\na battery; or\na cell.",
+        "2. The assembly according to claim 1, wherein the grip is removable.",
+    ]
+
+
+# A scraped page's expiration dates are kept over Lens's estimate; the other Lens fields still win
+def test_scraped_expiration_dates_are_kept():
+    fields = lens_fields([lens_record("1. A device.", {
+        "granted": True,
+        "anticipated_term_date": "2029-01-18",
+        "calculation_log": ["Applied 73 days term extension."],
+        "patent_status": "ACTIVE",
+    })])
+    assert fields["adjusted_expiration_date"] == "2029-01-18"
+
+    scraped = {
+        "patent_number": "US9017355B2",
+        "status": "Status not found",
+        "anticipated_expiration_date": "Anticipated expiration date not found",
+        "adjusted_expiration_date": "2029-01-14",
+        "claims": [],
+    }
+    results = {}
+    LensMergedResults(results, {"US9017355B2": fields})[0] = scraped
+
+    assert results[0]["adjusted_expiration_date"] == "2029-01-14"
+    assert results[0]["anticipated_expiration_date"] == "Anticipated expiration date not found"
+    assert results[0]["status"] == "Active"
+    assert results[0]["claims"] == ["1. A device."]
+
+    # A page without either date takes Lens's
+    LensMergedResults(results, {"US9017355B2": fields})[1] = {
+        **scraped, "adjusted_expiration_date": "Adjusted expiration date not found"}
+    assert results[1]["adjusted_expiration_date"] == "2029-01-18"
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import patent_retrieval_Lens
+from lens_archive import load_response
+from patent_retrieval_Lens import (MANIFEST_FILENAME, UNMATCHED_STATUS, is_fresh, load_manifest, save_manifest,
+                                   save_patent_batch_responses, write_if_changed)
+
+# Records of a batched search, in the order Lens returns them. Designs come back zero-padded.
+RECORDS = [
+    {"lens_id": "1", "jurisdiction": "US", "doc_number": "D0700966", "kind": "S"},
+    {"lens_id": "2", "jurisdiction": "US", "doc_number": "8333778", "kind": "B2"},
+    {"lens_id": "3", "jurisdiction": "US", "doc_number": "8333778", "kind": "B1"},
+]
+
+
+# Local Lens search endpoint that pages through RECORDS by the "from" and "size" of each POSTed query
+@pytest.fixture
+def lens_server(monkeypatch):
+    queries = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            queries.append(query)
+            page = RECORDS[query["from"]:query["from"] + query["size"]]
+            body = json.dumps({"total": len(RECORDS), "data": page, "results": len(page)}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.queries = queries
+    monkeypatch.setattr(patent_retrieval_Lens, "LENS_API_URL",
+                        f"http://127.0.0.1:{server.server_address[1]}/patent/search")
+    monkeypatch.setattr(patent_retrieval_Lens, "api_key", "dummy-key")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_batch_split_across_pages(lens_server, tmp_path):
+    directory = str(tmp_path / "data_Lens")
+    manifest = {}
+
+    unmatched = save_patent_batch_responses(["USD700966", "US8333778B2", "US9999999"], directory,
+                                            page_size=2, manifest=manifest)
+
+    # Two pages were requested, and every requested number was searched for
+    assert [query["from"] for query in lens_server.queries] == [0, 2]
+    assert set(lens_server.queries[0]["query"]["bool"]["must"][0]["terms"]["doc_number"]) == \
+        {"D700966", "D0700966", "8333778", "9999999"}
+
+    # Records are saved under the spelling that was requested, and records split across pages are kept together
+    assert load_response(os.path.join(directory, "USD700966.json"))["data"] == RECORDS[:1]
+    assert load_response(os.path.join(directory, "US8333778B2.json"))["data"] == RECORDS[1:]
+    assert manifest["USD700966"]["status"] == manifest["US8333778B2"]["status"] == 200
+
+    # The unmatched number is returned, has no file and is recorded without a hash
+    assert unmatched == ["US9999999"]
+    assert not os.path.exists(os.path.join(directory, "US9999999.json"))
+    assert manifest["US9999999"]["status"] == UNMATCHED_STATUS
+    assert "sha256" not in manifest["US9999999"]
+
+
+# Write a cached response for US1000000 and a manifest recording a fetch the given number of hours ago
+def cache_response(directory, hours_ago, status=200):
+    write_if_changed("US1000000", {"total": 1, "data": [{"lens_id": "1"}]}, directory)
+    fetched_at = datetime.now(timezone.utc) - timedelta(hours=hours_ago)
+    save_manifest(directory, {"US1000000": {"fetched_at": fetched_at.isoformat(timespec="seconds"),
+                                            "status": status}})
+    return load_manifest(directory)
+
+
+@pytest.mark.parametrize("hours_ago, max_age, only_missing, expected", [
+    # --max-age: fresh only if fetched within the given age
+    (1, timedelta(hours=24), False, True),
+    (30, timedelta(hours=24), False, False),
+    # Without either option everything is refetched
+    (1, None, False, False),
+    # --only-missing: any cached response is fresh, however old
+    (1000, None, True, True),
+    (1000, timedelta(hours=24), True, True),
+])
+def test_is_fresh(tmp_path, hours_ago, max_age, only_missing, expected):
+    directory = str(tmp_path)
+    manifest = cache_response(directory, hours_ago)
+    assert is_fresh("US1000000", directory, manifest, max_age, only_missing) is expected
+
+
+def test_missing_response_is_never_fresh(tmp_path):
+    directory = str(tmp_path)
+    manifest = cache_response(directory, 1)
+    os.remove(os.path.join(directory, "US1000000.json"))
+    assert not is_fresh("US1000000", directory, manifest, timedelta(hours=24))
+    assert not is_fresh("US1000000", directory, manifest, only_missing=True)
+
+
+# A response left over from before a failed or unmatched fetch is refetched even with --only-missing
+@pytest.mark.parametrize("status", [429, 500, UNMATCHED_STATUS])
+def test_failed_fetch_is_never_fresh(tmp_path, status):
+    directory = str(tmp_path)
+    manifest = cache_response(directory, 1, status)
+    assert not is_fresh("US1000000", directory, manifest, timedelta(hours=24))
+    assert not is_fresh("US1000000", directory, manifest, only_missing=True)
+
+
+def test_unchanged_response_is_not_rewritten(tmp_path):
+    directory = str(tmp_path)
+    filename = os.path.join(directory, "US1000000.json")
+    data = {"total": 1, "data": [{"lens_id": "1", "title": "Widget"}]}
+    manifest = {}
+    assert write_if_changed("US1000000", data, directory, manifest)
+    os.utime(filename, (1000000000, 1000000000))
+
+    # The same response, even in a different key order, leaves the file and its mtime alone
+    reordered = {"data": [{"title": "Widget", "lens_id": "1"}], "total": 1}
+    assert not write_if_changed("US1000000", reordered, directory, manifest)
+    assert os.path.getmtime(filename) == 1000000000
+    # Also when the manifest has no hash yet, as for responses saved before the manifest existed
+    assert not write_if_changed("US1000000", data, directory, {})
+    assert os.path.getmtime(filename) == 1000000000
+    assert manifest["US1000000"]["status"] == 200
+
+    changed = {"total": 1, "data": [{"lens_id": "1", "title": "Gadget"}]}
+    assert write_if_changed("US1000000", changed, directory, manifest)
+    assert os.path.getmtime(filename) != 1000000000
+    assert load_response(filename) == changed
+    # The manifest is only updated in memory, the caller saves it once all fetches are done
+    assert not os.path.exists(os.path.join(directory, MANIFEST_FILENAME))
@@ -0,0 +1,20 @@
+import os
+
+import metrics
+
+
+# A run with both kinds of retry reason (a status code and an error name) still writes its metrics
+def test_finish_run_with_mixed_label_values(tmp_path):
+    metrics_dir = str(tmp_path / "metrics")
+    metrics.start_run("retrieval", metrics_dir)
+    metrics.count("http_retries_total", reason="timeout")
+    metrics.count("http_retries_total", reason=503)
+    metrics.count("http_retries_total", reason="503")
+    metrics.count("http_responses_total", code=200)
+    metrics.finish_run()
+
+    with open(os.path.join(metrics_dir, "retrieval.prom"), "r", encoding="utf-8") as f:
+        prom = f.read()
+    assert 'http_retries_total{stage="retrieval",reason="503"} 2' in prom
+    assert 'http_retries_total{stage="retrieval",reason="timeout"} 1' in prom
+    assert 'http_responses_total{stage="retrieval",code="200"} 1' in prom
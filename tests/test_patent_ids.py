@@ -0,0 +1,64 @@
+import pytest
+
+from patent_ids import dedupe_patent_ids, group_aliases, lens_doc_numbers, normalize_patent_id, parse_patent_id
+
+
+@pytest.mark.parametrize("patent_id, expected", [
+    # Designs, reissues and plants lose Lens's zero-padding and their kind code
+    ("USD0700966S", "USD700966"),
+    ("USD700966", "USD700966"),
+    ("USD0700966", "USD700966"),
+    ("USRE045325E", "USRE45325"),
+    ("USPP0012345P3", "USPP12345"),
+    # Kind codes are dropped
+    ("EP2422721A1", "EP2422721"),
+    ("EP2422721B1", "EP2422721"),
+    ("US8333778B2", "US8333778"),
+    ("JP2013528454A", "JP2013528454"),
+    # Separators and case
+    ("US 2011/0167620 A1", "US20110167620"),
+    ("us-8,333,778 b2", "US8333778"),
+    ("EP 2.422.721", "EP2422721"),
+    # 11-digit US publications (year + serial) keep their zeros
+    ("US20110167620A1", "US20110167620"),
+    ("US20090000123", "US20090000123"),
+    # Grants are unpadded
+    ("US08333778", "US8333778"),
+    # Numbers in an unknown format are only cleaned
+    ("WO 2012/061641", "WO2012061641"),
+    ("not a number", "NOTANUMBER"),
+])
+def test_normalize_patent_id(patent_id, expected):
+    assert normalize_patent_id(patent_id) == expected
+
+
+@pytest.mark.parametrize("patent_id, expected", [
+    ("USD0700966S", ("US", "D", "0700966", "S")),
+    ("EP2422721A1", ("EP", "", "2422721", "A1")),
+    ("US 2011/0167620 A1", ("US", "", "20110167620", "A1")),
+    ("not a number", None),
+])
+def test_parse_patent_id(patent_id, expected):
+    assert parse_patent_id(patent_id) == expected
+
+
+@pytest.mark.parametrize("patent_id, expected", [
+    # Lens may store US designs, reissues and plants padded to 7 digits
+    ("USD700966", ["D700966", "D0700966"]),
+    ("USD0700966S", ["D700966", "D0700966"]),
+    ("USRE45325", ["RE45325", "RE0045325"]),
+    ("USPP1234", ["PP1234", "PP0001234"]),
+    # Grants, publications and other offices are looked up as they are
+    ("US8333778B2", ["8333778"]),
+    ("US20110167620A1", ["20110167620"]),
+    ("EP2422721A1", ["2422721"]),
+])
+def test_lens_doc_numbers(patent_id, expected):
+    assert lens_doc_numbers(patent_id) == expected
+
+
+def test_dedupe_and_aliases():
+    patent_ids = ["USD0700966S", "US8333778B2", "USD700966", "US8333778"]
+    assert dedupe_patent_ids(patent_ids) == ["USD700966", "US8333778"]
+    assert group_aliases(patent_ids) == {"USD700966": ["USD0700966S", "USD700966"],
+                                         "US8333778": ["US8333778B2", "US8333778"]}
@@ -0,0 +1,43 @@
+import json
+import os
+
+from family_graph import load_family_graph
+from lens_archive import load_response, response_paths
+from patent_store import PatentStore
+
+STATUS_PATH = "patent_status_data/patent_family_set_status.json"
+
+
+def load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Import the saved JSON files, export them again and import the export into a second store: every
+# response, family and status record comes back unchanged
+def test_import_export_round_trip(tmp_path):
+    lens_dir = str(tmp_path / "data_Lens")
+    family_dir = str(tmp_path / "patent_family_data")
+    status_path = str(tmp_path / "patent_status_data" / "patent_family_set_status.json")
+
+    with PatentStore(str(tmp_path / "patents.db")) as store:
+        store.import_json("data_Lens", "patent_family_data", STATUS_PATH)
+        store.export_json(lens_dir, family_dir, status_path)
+
+    for path in response_paths("data_Lens"):
+        assert load_response(os.path.join(lens_dir, os.path.basename(path))) == load_response(path)
+
+    for filename in os.listdir("patent_family_data"):
+        if filename.endswith("_extended_family.json"):
+            assert load_json(os.path.join(family_dir, filename)) == \
+                load_json(os.path.join("patent_family_data", filename))
+    assert load_family_graph(family_dir).family_set() == load_family_graph("patent_family_data").family_set()
+
+    records = {record["patent_number"]: record for record in load_json(STATUS_PATH)}
+    exported = load_json(status_path)
+    assert {record["patent_number"]: record for record in exported} == records
+
+    with PatentStore(str(tmp_path / "reimported.db")) as store:
+        store.import_json(lens_dir, family_dir, status_path)
+        assert list(store.iter_status_records()) == exported
+        assert store.extended_families() == load_family_graph(family_dir).extended_families()
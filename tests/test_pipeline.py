@@ -0,0 +1,39 @@
+import json
+import os
+from types import SimpleNamespace
+
+from lens_archive import pack, save_response
+from patent_retrieval_Lens import MANIFEST_FILENAME
+from pipeline import FileHasher, run_pipeline
+
+
+def write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+# Responses in a packed directory are part of the hash, the retrieval manifest is not
+def test_hash_covers_archived_responses(tmp_path):
+    lens_dir = str(tmp_path / "data_Lens")
+    os.makedirs(lens_dir)
+    write_json(os.path.join(lens_dir, "US1000000.json"), {"total": 1, "data": [{"lens_id": "1"}]})
+    pack(lens_dir)
+
+    before = FileHasher({}).paths([lens_dir])
+    write_json(os.path.join(lens_dir, MANIFEST_FILENAME), {"US1000000": {"status": 200}})
+    assert FileHasher({}).paths([lens_dir]) == before
+
+    save_response(lens_dir, "US1000000", {"total": 1, "data": [{"lens_id": "2"}]})
+    assert FileHasher({}).paths([lens_dir]) != before
+
+
+def test_dry_run_leaves_no_state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = SimpleNamespace(input="input.txt", batch_size=1, lens_max_age=24, scrape_max_age=24, backend="http",
+                             no_lens=False, output="patents.html", dedupe_claims=False)
+    state_path = str(tmp_path / "pipeline_state.json")
+
+    ran, ok = run_pipeline(config, dry_run=True, state_path=state_path)
+
+    assert ok and ran == []
+    assert not os.path.exists(state_path)
@@ -0,0 +1,97 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import request_utils
+from request_utils import RateLimiter, create_session, request_with_backoff
+
+
+# Local HTTP server that answers each request with the next (status, headers) from a script
+@pytest.fixture
+def stub_server():
+    served = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, headers = server.script.pop(0) if server.script else (200, {})
+            served.append(status)
+            body = b'{"data": []}'
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.script = []
+    server.served = served
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/lens"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# Record the backoff delays instead of sleeping through them
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(request_utils.time, "sleep", delays.append)
+    return delays
+
+
+def test_retry_after_on_429(stub_server, sleeps):
+    stub_server.script = [(429, {"Retry-After": "2"}), (200, {})]
+    limiter = RateLimiter()
+
+    with create_session(pool_size=1) as session:
+        response = request_with_backoff(session, "GET", stub_server.url, limiter=limiter, backoff=0.1)
+
+    assert response.status_code == 200
+    assert stub_server.served == [429, 200]
+    # The server's delay replaces the exponential backoff, plus at most 10% jitter
+    assert 2.0 <= sleeps[0] <= 2.2
+    # The shared limiter is paused as well, so it holds back the retry (and every other worker).
+    # Sleeping is recorded rather than done, so the pause has not run out yet.
+    assert len(sleeps) == 2 and 1.9 <= sleeps[1] <= 2.0
+
+
+def test_exponential_backoff_on_5xx(stub_server, sleeps):
+    stub_server.script = [(503, {}), (502, {}), (200, {})]
+
+    with create_session(pool_size=1) as session:
+        response = request_with_backoff(session, "GET", stub_server.url, backoff=0.5)
+
+    assert response.status_code == 200
+    assert stub_server.served == [503, 502, 200]
+    assert len(sleeps) == 2
+    assert 0.5 <= sleeps[0] <= 0.55
+    assert 1.0 <= sleeps[1] <= 1.1
+
+
+def test_gives_up_after_max_retries(stub_server, sleeps):
+    stub_server.script = [(500, {})] * 5
+
+    with create_session(pool_size=1) as session:
+        response = request_with_backoff(session, "GET", stub_server.url, max_retries=2, backoff=0.1)
+
+    assert response.status_code == 500
+    assert stub_server.served == [500, 500, 500]
+    assert len(sleeps) == 2
+
+
+def test_client_errors_are_not_retried(stub_server, sleeps):
+    stub_server.script = [(404, {})]
+
+    with create_session(pool_size=1) as session:
+        response = request_with_backoff(session, "GET", stub_server.url, backoff=0.1)
+
+    assert response.status_code == 404
+    assert stub_server.served == [404]
+    assert sleeps == []
@@ -1,14 +1,72 @@
+import argparse
+import hashlib
 import json
-from patent_claim import build_claim_tree
+import os
+import sqlite3
+from itertools import islice
+
+import metrics
+from claim_similarity import DEFAULT_THRESHOLD, ClaimDeduper
+from patent_claim import ClaimTreeCache
+from patent_index import PatentIndex
+from patent_store import PatentStore
 
 # Path to your JSON data
 JSON_PATH = "patent_status_data/patent_family_set_status.json"
 # Output HTML file
 OUTPUT_HTML = "patents.html"
+# Parsed claim trees, keyed by a hash of each patent's claims
+CLAIM_CACHE_PATH = "patent_status_data/claim_tree_cache.json"
+# Rendered HTML entries, keyed by a hash of each patent's record
+FRAGMENT_CACHE_PATH = "patent_status_data/html_fragment_cache.db"
+# Bump whenever render_entry changes so cached fragments are rendered again
+RENDER_VERSION = 2
+# Number of records rendered together
+BATCH_SIZE = 500
+# Directory holding the abstracts and claims loaded on demand by the lazy page
+SHARD_DIR = "patents_shards"
+# Number of entries whose abstracts and claims are stored in one shard file
+SHARD_SIZE = 50
+# Amount of the status file read at a time while streaming
+CHUNK_SIZE = 64 * 1024
+
+
+# Stream the records of a JSON array file one at a time, without loading the whole file
+def iter_json_array(json_path, chunk_size=CHUNK_SIZE):
+    decoder = json.JSONDecoder()
+    with open(json_path, encoding="utf-8") as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{json_path} does not contain a JSON array")
+        buffer = buffer[1:]
+        while True:
+            buffer = buffer.lstrip().lstrip(",").lstrip()
+            if buffer.startswith("]"):
+                return
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer += chunk
+                continue
+            yield record
+            buffer = buffer[end:]
+
+
+# Load patent data from the status JSON file, or from a patent store if one is given
+def load_patents(json_path=JSON_PATH, store_path=None):
+    return list(iter_patents(json_path, store_path))
 
-# Load patent data
-with open(JSON_PATH, encoding="utf-8") as f:
-    patents = json.load(f)
+
+# Stream patent data from the status JSON file, or from a patent store if one is given
+def iter_patents(json_path=JSON_PATH, store_path=None):
+    if store_path:
+        with PatentStore(store_path) as store:
+            yield from store.iter_status_records()
+    else:
+        yield from iter_json_array(json_path)
 
 # Map raw status to CSS class
 def classify_status(raw_status: str) -> str:
@@ -21,8 +79,9 @@ def classify_status(raw_status: str) -> str:
         return "expired"
     return "misc"
 
-# Building HTML head and CSS (including search bar and filter buttons)
-html_head = """<!DOCTYPE html>
+# Building HTML head and CSS (including search bar and filter buttons). The lazy page writes its data
+# script between the head and the list of entries.
+lazy_html_head = """<!DOCTYPE html>
 <html lang="en">
 <head>
   <meta charset="UTF-8" />
@@ -130,12 +189,14 @@ html_head = """<!DOCTYPE html>
     <button onclick="filterStatus('expired')">Show Expired (Green)</button>
     <button onclick="filterStatus('not-found')">Show Not Found (Gray)</button>
     <button onclick="filterStatus('misc')">Show Misc (Yellow)</button>
-  </div>
+  </div>"""
+
+html_head = lazy_html_head + """
   <ul class="timeline">"""
 
-# Generate each entry
-html_body = []
-for p in patents:
+# Pull out the fields shown in a patent's one-line summary:
+# index, number, raw status, status class, title, expiration text and link
+def entry_summary(p):
     idx = p.get("index", "?")
     num = p.get("patent_number", "N/A")
     raw = p.get("status", "Not Found")
@@ -143,10 +204,6 @@ for p in patents:
     title = p.get("title", "<No title>").strip()
     ant = p.get("anticipated_expiration_date", "").strip()
     adj = p.get("adjusted_expiration_date", "").strip()
-    claims = build_claim_tree(p.get("claims", "<No claims>"))
-    claim_txt = ""
-    for root in claims:
-        claim_txt += "\n" + root.print_tree()
     link = p.get("link", "<No link>")
 
     parts = []
@@ -156,6 +213,12 @@ for p in patents:
         parts.append(f"Adjusted Expiration Date: {adj}")
     exp_text = " | ".join(parts) or "Expiration date not found"
 
+    return idx, num, raw, cls, title, exp_text, link
+
+# Render the HTML list entry for one patent, given its rendered claim trees
+def render_entry(p, claim_txt, claims_label="Claims"):
+    idx, num, raw, cls, title, exp_text, link = entry_summary(p)
+
     link_html = f'<a href="{link}" target="_blank" rel="noopener noreferrer">{num}</a>' if link and link.startswith("http") else num
     label = f"{idx}: Patent Number: {link_html} | Status: {raw} | Title: {title} | {exp_text}"
 
@@ -169,7 +232,7 @@ for p in patents:
 
     abstract = p.get("abstract", "Abstract not found").strip()
 
-    html_body.append(f"""
+    return f"""
     <li class="entry"> 
       <span class="marker {cls}"></span>
       <div>
@@ -181,11 +244,11 @@ for p in patents:
           <p>{abstract}</p>
         </details>
         <details>
-          <summary>Claims</summary>
+          <summary>{claims_label}</summary>
           <p>{claim_txt}</p>
         </details>
       </div>
-    </li>""")
+    </li>"""
 
 # Closing HTML and JavaScript
 html_tail = """
@@ -216,8 +279,403 @@ html_tail = """
 </body>
 </html>"""
 
-# Write the output HTML file
-with open(OUTPUT_HTML, 'w', encoding='utf-8') as out:
-    out.write(html_head)
-    out.write("\n".join(html_body))
-    out.write(html_tail)
+# Closing HTML and JavaScript for the lazy page. ENTRIES holds one compact row per patent:
+# [index, number, status, status class, title, expiration text, link, shard, position in shard, search key].
+# Only one page of rows is in the DOM at a time, and abstracts and claims are loaded from their
+# shard file the first time a <details> element is opened.
+lazy_html_tail = """
+  </ul>
+  <div id="pager">
+    <button id="prevPage">Previous</button>
+    <span id="pageInfo"></span>
+    <button id="nextPage">Next</button>
+  </div>
+  <script>
+    const PAGE_SIZE = 100;
+    const list = document.querySelector(".timeline");
+    const shards = {};
+    const pending = {};
+    let visible = ENTRIES;
+    let page = 0;
+    let statusFilter = "all";
+    let textFilter = "";
+
+    // Called by each shard file once it has loaded
+    function loadShard(id, data) {
+      shards[id] = data;
+      (pending[id] || []).forEach(callback => callback(data));
+      delete pending[id];
+    }
+
+    function withShard(id, callback) {
+      if (shards[id]) {
+        callback(shards[id]);
+        return;
+      }
+      if (!pending[id]) {
+        pending[id] = [];
+        const script = document.createElement("script");
+        script.src = SHARD_DIR + "/shard_" + id + ".js";
+        document.body.appendChild(script);
+      }
+      pending[id].push(callback);
+    }
+
+    function makeDetails(label, entry, field) {
+      const details = document.createElement("details");
+      const summary = document.createElement("summary");
+      const text = document.createElement("p");
+      summary.textContent = label;
+      details.append(summary, text);
+      details.addEventListener("toggle", () => {
+        if (details.open && !text.dataset.loaded) {
+          text.dataset.loaded = "1";
+          text.textContent = "Loading...";
+          withShard(entry[7], data => { text.textContent = data[entry[8]][field]; });
+        }
+      });
+      return details;
+    }
+
+    function makeEntry(entry) {
+      const [idx, num, raw, cls, title, expText, link] = entry;
+      const li = document.createElement("li");
+      li.className = "entry";
+      const marker = document.createElement("span");
+      marker.className = "marker " + cls;
+      const body = document.createElement("div");
+      const tooltip = document.createElement("span");
+      tooltip.className = "tooltip";
+      const number = link.startsWith("http") ? document.createElement("a") : document.createElement("span");
+      if (link.startsWith("http")) {
+        number.href = link;
+        number.target = "_blank";
+        number.rel = "noopener noreferrer";
+      }
+      number.textContent = num;
+      const hover = document.createElement("span");
+      hover.className = "tooltiptext";
+      hover.textContent = `Index: ${idx}\nPatent: ${num}\nStatus: ${raw}\nTitle: ${title}\n${expText}`;
+      tooltip.append(`${idx}: Patent Number: `, number, ` | Status: ${raw} | Title: ${title} | ${expText}`, hover);
+      body.append(tooltip, makeDetails("Abstract", entry, 0), makeDetails("Claims", entry, 1));
+      li.append(marker, body);
+      return li;
+    }
+
+    function render() {
+      const pages = Math.max(1, Math.ceil(visible.length / PAGE_SIZE));
+      page = Math.min(page, pages - 1);
+      const fragment = document.createDocumentFragment();
+      visible.slice(page * PAGE_SIZE, (page + 1) * PAGE_SIZE).forEach(entry => fragment.appendChild(makeEntry(entry)));
+      list.replaceChildren(fragment);
+      document.getElementById("pageInfo").textContent = `Page ${page + 1} of ${pages} (${visible.length} patents)`;
+    }
+
+    // Filtering only compares the precomputed status class and search key of each row,
+    // plus the patents found in the full-text index when the page has one
+    function applyFilters() {
+      visible = ENTRIES.filter(entry =>
+        (statusFilter === "all" || entry[3] === statusFilter) &&
+        (!textFilter || entry[9].includes(textFilter) || (indexMatches !== null && indexMatches.has(entry[1]))));
+      page = 0;
+      render();
+    }
+
+    function filterStatus(status) {
+      statusFilter = status;
+      applyFilters();
+    }
+
+    // Decode a term's flattened postings ([doc, count, position gaps...]) into a map of doc -> positions
+    const decoded = {};
+    function postings(field, word) {
+      const key = field + ":" + word;
+      if (!(key in decoded)) {
+        const flat = SEARCH_INDEX.postings[field][word] || [];
+        const docs = new Map();
+        for (let i = 0; i < flat.length; i += 2 + flat[i + 1]) {
+          const positions = [];
+          let position = 0;
+          for (let j = i + 2; j < i + 2 + flat[i + 1]; j++) {
+            positions.push(position += flat[j]);
+          }
+          docs.set(flat[i], positions);
+        }
+        decoded[key] = docs;
+      }
+      return decoded[key];
+    }
+
+    // Documents where the words appear next to each other in one field
+    function phraseDocs(words) {
+      const docs = new Set();
+      for (const field in SEARCH_INDEX.postings) {
+        const lists = words.map(word => postings(field, word));
+        for (const [doc, positions] of lists[0]) {
+          if (positions.some(start => lists.every((list, offset) => (list.get(doc) || []).includes(start + offset)))) {
+            docs.add(doc);
+          }
+        }
+      }
+      return docs;
+    }
+
+    // Patent numbers containing every word and "quoted phrase" of the query, or null without an index
+    let indexMatches = null;
+    function searchIndex(query) {
+      if (typeof SEARCH_INDEX === "undefined") {
+        return null;
+      }
+      let docs = null;
+      for (const part of query.match(/"[^"]*"?|[^\s"]+/g) || []) {
+        const words = part.toLowerCase().match(/[a-z0-9]+/g);
+        if (words) {
+          const found = phraseDocs(words);
+          docs = docs === null ? found : new Set([...docs].filter(doc => found.has(doc)));
+        }
+      }
+      return docs === null ? null : new Set([...docs].map(doc => SEARCH_INDEX.patents[doc]));
+    }
+
+    let searchTimer;
+    document.getElementById("searchInput").addEventListener("input", function () {
+      clearTimeout(searchTimer);
+      const value = this.value;
+      searchTimer = setTimeout(() => {
+        textFilter = value.toLowerCase();
+        indexMatches = searchIndex(value);
+        applyFilters();
+      }, 100);
+    });
+    document.getElementById("prevPage").addEventListener("click", () => { page = Math.max(0, page - 1); render(); });
+    document.getElementById("nextPage").addEventListener("click", () => { page += 1; render(); });
+    render();
+  </script>
+</body>
+</html>"""
+
+# Serialize data for embedding inside a <script> element
+def script_json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+
+# Write a shard file of [abstract, claims] pairs, leaving the file untouched if its content is unchanged
+def write_shard(shard_dir, shard_id, details):
+    content = f"loadShard({shard_id},{script_json(details)});\n"
+    path = os.path.join(shard_dir, f"shard_{shard_id}.js")
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            if f.read() == content:
+                return
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+# Write a lazily loaded version of the page for large portfolios. The HTML only carries one compact
+# summary row per patent; abstracts and claims go to shard files in shard_dir.
+# With search_index, a full-text index of titles, abstracts and claims is written next to the shards
+# and the page's search box also matches words and "quoted phrases" against it.
+def write_lazy_html(patents, output_html=OUTPUT_HTML, shard_dir=SHARD_DIR, claim_cache_path=CLAIM_CACHE_PATH,
+                    workers=None, shard_size=SHARD_SIZE, batch_size=BATCH_SIZE, search_index=False, deduper=None):
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_src = os.path.relpath(shard_dir, os.path.dirname(os.path.abspath(output_html))).replace(os.sep, "/")
+    shard, shard_id, entries = [], 0, 0
+    index = PatentIndex() if search_index else None
+
+    patents = iter(patents)
+    with ClaimTreeCache(claim_cache_path, workers) as claim_cache, \
+            open(output_html + ".tmp", "w", encoding="utf-8") as out:
+        out.write(lazy_html_head)
+        out.write(f"\n  <script>\n    const SHARD_DIR = {script_json(shard_src)};\n    const ENTRIES = [")
+        while True:
+            batch = list(islice(patents, batch_size))
+            if not batch:
+                break
+            diffs = {}
+            if deduper is not None:
+                for p in batch:
+                    deduper.observe(p)
+                diffs = {p.get("patent_number", "N/A"): deduper.diff(p) for p in batch}
+            parse = [p for p in batch if diffs.get(p.get("patent_number", "N/A")) is None]
+            with metrics.timer("claim_parse", patents=len(parse)):
+                claim_trees = claim_cache.render(parse)
+            for p in batch:
+                idx, num, raw, cls, title, exp_text, link = entry_summary(p)
+                key = f"{idx} {num} {raw} {title} {exp_text}".lower()
+                row = [idx, num, raw, cls, title, exp_text, link, shard_id, len(shard), key]
+                out.write(("," if entries else "") + "\n" + script_json(row))
+                claims = f"Near-duplicate of {diffs[num][0]}.\n{diffs[num][1]}" if diffs.get(num) else claim_trees[num]
+                shard.append([p.get("abstract", "Abstract not found").strip(), claims])
+                entries += 1
+                if index is not None:
+                    index.add(p)
+                if len(shard) == shard_size:
+                    write_shard(shard_dir, shard_id, shard)
+                    shard, shard_id = [], shard_id + 1
+        if shard:
+            write_shard(shard_dir, shard_id, shard)
+            shard_id += 1
+        out.write("\n    ];\n  </script>\n")
+        if index is not None:
+            index.write_js(os.path.join(shard_dir, "search_index.js"))
+            out.write(f'  <script src="{shard_src}/search_index.js"></script>\n')
+        out.write('  <ul class="timeline">')
+        out.write(lazy_html_tail)
+        claim_cache.save()
+    os.replace(output_html + ".tmp", output_html)
+    metrics.count("bytes_written_total", os.path.getsize(output_html), target="html")
+
+    # Remove shards left over from a larger portfolio
+    for filename in os.listdir(shard_dir):
+        if filename.startswith("shard_") and filename.endswith(".js") and int(filename[6:-3]) >= shard_id:
+            os.remove(os.path.join(shard_dir, filename))
+
+    print(f"Wrote {output_html}: {entries} entries in {shard_id} shard(s) under {shard_dir}.")
+
+# Open the cache of rendered entries
+def open_fragment_cache(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS fragments (hash TEXT PRIMARY KEY, html TEXT NOT NULL, run INTEGER)")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+
+# Hash a patent record together with the renderer version, and anything else its entry depends on
+def record_hash(p, extra=None):
+    data = json.dumps([RENDER_VERSION, p] + ([extra] if extra is not None else []), sort_keys=True,
+                      ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+# Label of a patent's Claims section. Representatives of near-duplicate clusters name their members.
+def claims_label(p, deduper=None):
+    members = deduper.members.get(p.get("patent_number")) if deduper is not None else None
+    return f"Claims (also covers {', '.join(members)})" if members else "Claims"
+
+
+# Render the entries of a batch of records, reusing cached fragments. Returns the fragment of each record.
+# With a deduper, members of a near-duplicate cluster show a diff against the cluster's representative
+# instead of their own claim tree, and their claims are not parsed.
+def render_batch(batch, conn, run, claim_cache, deduper=None):
+    if deduper is not None:
+        for p in batch:
+            deduper.observe(p)
+    hashes = [record_hash(p, deduper.cluster_key(p) if deduper is not None else None) for p in batch]
+    placeholders = ",".join("?" * len(hashes))
+    fragments = dict(conn.execute(f"SELECT hash, html FROM fragments WHERE hash IN ({placeholders})", hashes))
+
+    # Only records that changed since a previous run are rendered again
+    misses = {h: p for h, p in zip(hashes, batch) if h not in fragments}
+    metrics.count("fragment_cache_hits_total", len(batch) - len(misses))
+    # Cached entries still use their claim trees, so they are kept when the claim cache is pruned
+    claim_cache.keep(p for h, p in zip(hashes, batch) if h in fragments)
+    if misses:
+        diffs = {h: deduper.diff(p) for h, p in misses.items()} if deduper is not None else {}
+        parse = [p for h, p in misses.items() if diffs.get(h) is None]
+        claim_trees = {}
+        if parse:
+            with metrics.timer("claim_parse", patents=len(parse)):
+                claim_trees = claim_cache.render(parse)
+        with metrics.timer("render_entries", patents=len(misses)):
+            for h, p in misses.items():
+                if diffs.get(h) is not None:
+                    representative, diff = diffs[h]
+                    fragments[h] = render_entry(p, diff, f"Claims (near-duplicate of {representative})")
+                else:
+                    fragments[h] = render_entry(p, claim_trees[p.get("patent_number", "N/A")],
+                                                claims_label(p, deduper))
+        conn.executemany("INSERT OR REPLACE INTO fragments VALUES (?, ?, ?)",
+                         [(h, fragments[h], run) for h in misses])
+    conn.executemany("UPDATE fragments SET run = ? WHERE hash = ?", [(run, h) for h in hashes])
+
+    return hashes, [fragments[h] for h in hashes], len(misses)
+
+
+# Digest of a page's content together with the size and modification time of the file holding it
+def page_state(page_digest, path):
+    stat = os.stat(path)
+    return f"{page_digest.hexdigest()} {stat.st_size} {stat.st_mtime_ns}"
+
+
+# Write the output HTML file, streaming entries to disk in batches. Entries of records that did not
+# change are spliced in from the fragment cache, and the file is left untouched if nothing changed.
+# A ClaimDeduper built from the same records renders near-duplicate claims as diffs.
+def write_html(patents, output_html=OUTPUT_HTML, claim_cache_path=CLAIM_CACHE_PATH, workers=None,
+               fragment_cache_path=FRAGMENT_CACHE_PATH, batch_size=BATCH_SIZE, deduper=None):
+    conn = open_fragment_cache(fragment_cache_path)
+    row = conn.execute("SELECT value FROM meta WHERE key = 'run'").fetchone()
+    run = int(row[0]) + 1 if row else 1
+    # The page depends on its template as well as on its entries
+    page_digest = hashlib.sha256((html_head + html_tail).encode("utf-8"))
+    entries = rendered = 0
+
+    patents = iter(patents)
+    with conn, ClaimTreeCache(claim_cache_path, workers) as claim_cache, \
+            open(output_html + ".tmp", 'w', encoding='utf-8') as out:
+        out.write(html_head)
+        while True:
+            batch = list(islice(patents, batch_size))
+            if not batch:
+                break
+            hashes, fragments, misses = render_batch(batch, conn, run, claim_cache, deduper)
+            for h, fragment in zip(hashes, fragments):
+                out.write(("\n" if entries else "") + fragment)
+                page_digest.update(h.encode("ascii"))
+                entries += 1
+            rendered += misses
+        out.write(html_tail)
+        claim_cache.save()
+
+        # Drop fragments of records that are no longer in the portfolio
+        conn.execute("DELETE FROM fragments WHERE run != ?", (run,))
+        previous = conn.execute("SELECT value FROM meta WHERE key = 'page'").fetchone()
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('run', ?)", (str(run),))
+
+    # The stored page state also records the file written, so a page replaced since then (e.g. by the
+    # lazy writer) is written again
+    if previous and os.path.exists(output_html) and previous[0] == page_state(page_digest, output_html):
+        os.remove(output_html + ".tmp")
+        print(f"{output_html} is up to date ({entries} entries).")
+    else:
+        os.replace(output_html + ".tmp", output_html)
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('page', ?)", (page_state(page_digest, output_html),))
+        metrics.count("bytes_written_total", os.path.getsize(output_html), target="html")
+        print(f"Wrote {output_html}: {entries} entries, {rendered} rendered, {entries - rendered} from cache.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the scraped patent statuses as an HTML page")
+    parser.add_argument("--input", default=JSON_PATH, help="status JSON file written by google_scraper.py")
+    parser.add_argument("--output", default=OUTPUT_HTML, help="HTML file to write")
+    parser.add_argument("--store", default=None, help="read the statuses from this SQLite patent store instead")
+    parser.add_argument("--claim-cache", default=CLAIM_CACHE_PATH, help="file caching parsed claim trees")
+    parser.add_argument("--workers", type=int, default=None, help="processes used to parse uncached claims")
+    parser.add_argument("--fragment-cache", default=FRAGMENT_CACHE_PATH, help="database caching rendered entries")
+    parser.add_argument("--lazy", action="store_true",
+                        help="write a paginated page that loads abstracts and claims on demand from shard files")
+    parser.add_argument("--shard-dir", default=SHARD_DIR, help="directory for the lazy page's shard files")
+    parser.add_argument("--search-index", action="store_true",
+                        help="with --lazy, also write a full-text index of titles, abstracts and claims for the search box")
+    parser.add_argument("--dedupe-claims", action="store_true",
+                        help="render near-duplicate claim sets once per cluster, with a diff for each other member")
+    parser.add_argument("--similarity-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="with --dedupe-claims, claim similarity (0-1) above which claim sets are near-duplicates")
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    metrics.start_run("visualize_patents", args.metrics_dir, args.profile)
+    try:
+        deduper = None
+        if args.dedupe_claims:
+            with metrics.timer("claim_clusters"):
+                deduper = ClaimDeduper.build(iter_patents(args.input, args.store), args.similarity_threshold)
+            print(f"Found {len(deduper.members)} cluster(s) of near-duplicate claims covering "
+                  f"{len(deduper.representative)} other patent(s).")
+        if args.lazy:
+            write_lazy_html(iter_patents(args.input, args.store), args.output, args.shard_dir, args.claim_cache,
+                            args.workers, search_index=args.search_index, deduper=deduper)
+        else:
+            write_html(iter_patents(args.input, args.store), args.output, args.claim_cache, args.workers,
+                       args.fragment_cache, deduper=deduper)
+    finally:
+        metrics.finish_run()